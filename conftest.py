@@ -12,12 +12,58 @@ __copyright__ = 'Copyright 2018, ELCA'
 import json
 import pytest
 
-from typing import Tuple
+from typing import Dict, List, Tuple
+
+from docker_lib.backends import get_backend, set_backend
+from docker_lib.container_lock import ContainerLock
+from docker_lib.simulated_backend import SimulatedBackend
+from systemd_lib.systemd_tools import Systemd, UnitSnapshot
+
+# Services whose state is read once per container at the start of the session
+SNAPSHOT_SERVICES = ['grafana-server.service', 'monit.service', 'nginx.service']
+
+pytest_plugins = ['metrics_lib.pytest_plugin']
 
 
 def pytest_addoption(parser):
     parser.addoption("--config-file", action="store", help="Json container configuration file ", dest="config_file")
     parser.addoption("--grafana-config-file", action="store", help="Json psql credentials file ", dest="grafana_config_file")
+    parser.addoption("--simulate", action="store_true", help="Run the container tests against a simulated container",
+                     dest="simulate")
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'destructive: stops or restarts services of the container, never runs '
+                                       'at the same time as another test of the same container')
+    config.addinivalue_line('markers', 'xdist_group(name): tests of a group run on the same pytest-xdist worker')
+
+
+def read_container_names(config_file: str) -> List[str]:
+    """
+    :return: containers of a configuration file, listed in 'container_names' or single in 'container_name'
+    """
+    with open(config_file) as json_data:
+        config = json.load(json_data)
+    return [name for name in config.get('container_names') or [config.get('container_name')] if name]
+
+
+def pytest_generate_tests(metafunc):
+    """
+    Runs the tests using container_name once per container of the configuration file. The tests of a container form
+    an xdist group: with 'pytest -n <workers> --dist loadgroup', containers are tested concurrently and the tests of
+    one container sequentially
+    """
+    config_file = metafunc.config.getoption('config_file')
+    if 'container_name' not in metafunc.fixturenames or not config_file:
+        return
+    try:
+        container_names = read_container_names(config_file)
+    except (OSError, ValueError):
+        # Reported by the settings fixture
+        return
+    metafunc.parametrize('container_name',
+                         [pytest.param(name, marks=pytest.mark.xdist_group(name)) for name in container_names],
+                         ids=container_names, scope='class')
 
 
 def get_property(dictionary: dict, key: str):
@@ -27,6 +73,59 @@ def get_property(dictionary: dict, key: str):
     return value
 
 
+@pytest.fixture(scope='session', autouse=True)
+def simulated_backend(pytestconfig):
+    """
+    With --simulate, Container and Systemd talk to an in-process simulation of the container of the configuration
+    file instead of the docker daemon
+    """
+    if not pytestconfig.getoption('simulate'):
+        yield None
+        return
+    container_names = []
+    if pytestconfig.getoption('config_file'):
+        container_names = read_container_names(pytestconfig.getoption('config_file'))
+    previous_backend = get_backend()
+    backend = SimulatedBackend(container_names)
+    set_backend(backend)
+    yield backend
+    set_backend(previous_backend)
+
+
+@pytest.fixture(autouse=True)
+def container_lock(request):
+    """
+    Destructive tests lock their container exclusively, the other tests share the lock: no test sees the services of
+    its container stopped by a test running on another worker
+    """
+    if 'container_name' not in request.fixturenames:
+        yield None
+        return
+    lock = ContainerLock(request.getfixturevalue('container_name'))
+    with lock.exclusive() if 'destructive' in request.keywords else lock.shared():
+        yield lock
+
+
+class UnitSnapshots(dict):
+    """
+    State of SNAPSHOT_SERVICES per container, read with one docker exec the first time a test of the container asks
+    for it. Tests using container_name already hold the lock of their container (see container_lock)
+    """
+
+    def __missing__(self, container_name: str) -> Dict[str, UnitSnapshot]:
+        snapshot = Systemd.get_unit_snapshot(container_name, SNAPSHOT_SERVICES, ['ActiveState', 'ActiveEnterTimestamp'])
+        self[container_name] = snapshot
+        return snapshot
+
+
+@pytest.fixture(scope='session')
+def unit_snapshots(simulated_backend) -> UnitSnapshots:
+    """
+    State of SNAPSHOT_SERVICES, read once per container: a worker only reads the containers it tests
+    """
+    return UnitSnapshots()
+
+
 @pytest.fixture(scope='class')
 def settings(pytestconfig) -> dict:
     try:
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""asyncio counterparts of docker_lib.docker_tools, to check many containers concurrently.
+
+"""
+
+import asyncio
+import json
+
+from typing import Awaitable, Callable, Dict, Iterable, Union
+
+from docker_lib.backends import DockerError
+from metrics_lib import instrumentation
+
+
+async def docker(*args: str, timeout: float = None) -> bytes:
+    """
+    Runs the docker CLI without blocking the event loop
+    :param args: arguments of the docker command
+    :param timeout: delay in seconds after which the command is killed
+    :return: stdout
+    :raise DockerError: if the command exits with a non-zero code
+    :raise asyncio.TimeoutError: if the command did not complete after *timeout* seconds
+    """
+    with instrumentation.timed(instrumentation.docker_operation(args)):
+        try:
+            process = await asyncio.create_subprocess_exec('docker', *args, stdout=asyncio.subprocess.PIPE,
+                                                           stderr=asyncio.subprocess.PIPE)
+        except FileNotFoundError:
+            raise DockerError('docker', 127)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+    if process.returncode:
+        raise DockerError(' '.join(('docker',) + args), process.returncode, stdout, stderr)
+    return stdout
+
+
+async def gather_bounded(names: Iterable[str], function: Callable[[str], Awaitable],
+                         concurrency: int) -> Dict[str, Union[object, Exception]]:
+    """
+    Awaits *function(name)* for each name, at most *concurrency* at a time
+    :return: result of each name, or the exception it raised
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(name: str):
+        async with semaphore:
+            return await function(name)
+
+    names = list(names)
+    results = await asyncio.gather(*(bounded(name) for name in names), return_exceptions=True)
+    return dict(zip(names, results))
+
+
+class AsyncContainer:
+
+    @staticmethod
+    async def inspect(container_name: str, timeout: float = None) -> dict:
+        stdout = await docker('inspect', container_name, timeout=timeout)
+        return json.loads(stdout.decode('utf-8'))[0]
+
+    @staticmethod
+    async def status(container_name: str, timeout: float = None) -> str:
+        return (await AsyncContainer.inspect(container_name, timeout))['State']['Status']
+
+    @staticmethod
+    async def status_many(container_names: Iterable[str], concurrency: int = 10,
+                          timeout: float = None) -> Dict[str, Union[str, Exception]]:
+        """
+        Gets the status of many containers concurrently
+        :param container_names:
+        :param concurrency: maximum number of docker commands running at the same time
+        :param timeout: delay in seconds for each container
+        :return: status of each container, or the exception raised while getting it
+        """
+        return await gather_bounded(container_names, lambda name: AsyncContainer.status(name, timeout), concurrency)
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+
+"""Backends used by Container and Systemd to talk to the docker daemon.
+
+ShBackend runs the docker CLI (default), EngineBackend talks to the Engine API over the daemon socket.
+"""
+
+import json
+import sh
+import subprocess
+import tempfile
+import time
+
+from typing import Iterable, Iterator, List
+
+from docker_lib.engine_api import DEFAULT_SOCKET, EngineAPIError, EngineClient
+from metrics_lib import instrumentation
+
+# Bytes read or written at once when streaming an archive
+ARCHIVE_BUFFER_SIZE = 1024 * 1024
+
+
+class DockerError(Exception):
+    """
+    Raised when a docker command fails
+    """
+
+    def __init__(self, command: str, exit_code: int, stdout: bytes = b'', stderr: bytes = b''):
+        super().__init__('{command} exited with {code}: {stderr}'.format(
+            command=command, code=exit_code, stderr=stderr.decode('utf-8', 'replace').strip()))
+        self.command = command
+        self.exit_code = exit_code
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+class Backend:
+    """
+    Operations on containers needed by Container and Systemd
+    """
+
+    # Clock used by Container and Systemd to compute dates, deadlines and polling delays
+
+    def time(self) -> float:
+        return time.time()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+    def inspect(self, container_name: str) -> dict:
+        raise NotImplementedError
+
+    def inspect_many(self, container_names: List[str]) -> List[dict]:
+        """
+        :return: answers of inspect, in the order of *container_names*
+        :raise DockerError: if a container does not exist
+        """
+        return [self.inspect(container_name) for container_name in container_names]
+
+    def start(self, container_name: str) -> None:
+        raise NotImplementedError
+
+    def stop(self, container_name: str) -> None:
+        raise NotImplementedError
+
+    def restart(self, container_name: str) -> None:
+        raise NotImplementedError
+
+    def events(self, container_name: str, event: str, since: float, until: float) -> Iterator[dict]:
+        """
+        Yields the *event* events of the container between *since* and *until* (seconds since the epoch)
+        """
+        raise NotImplementedError
+
+    def exec(self, container_name: str, *args: str) -> bytes:
+        """
+        Runs *args* inside the container
+        :return: stdout
+        :raise DockerError: if the command exits with a non-zero code
+        """
+        raise NotImplementedError
+
+    def exec_stream(self, container_name: str, *args: str) -> Iterator[str]:
+        """
+        Runs *args* inside the container and yields its stdout line by line as it is produced. Closing the
+        generator stops the docker command
+        :raise DockerError: if the command exits with a non-zero code
+        """
+        raise NotImplementedError
+
+    def get_archive(self, container_name: str, path: str) -> Iterator[bytes]:
+        """
+        Yields a tar archive of *path* in the container as it is produced, the basename of *path* being the top
+        directory of the archive. Closing the generator stops the copy
+        :raise DockerError: if *path* cannot be read
+        """
+        raise NotImplementedError
+
+    def put_archive(self, container_name: str, path: str, chunks: Iterable[bytes]) -> None:
+        """
+        Extracts the tar archive streamed by *chunks* into directory *path* of the container
+        :raise DockerError: if the archive cannot be extracted
+        """
+        raise NotImplementedError
+
+
+class ShBackend(Backend):
+    """
+    Runs the docker CLI
+    """
+
+    @staticmethod
+    def _docker(*args: str, **kwargs):
+        try:
+            return sh.docker(*args, **kwargs)
+        except sh.ErrorReturnCode as e:
+            raise DockerError(' '.join(('docker',) + args), e.exit_code, e.stdout, e.stderr)
+        except sh.CommandNotFound:
+            raise DockerError('docker', 127)
+
+    def inspect(self, container_name: str) -> dict:
+        return self.inspect_many([container_name])[0]
+
+    def inspect_many(self, container_names: List[str]) -> List[dict]:
+        # A single 'docker inspect' for all containers
+        return json.loads(self._docker('inspect', *container_names).stdout.decode('utf-8'))
+
+    def start(self, container_name: str) -> None:
+        self._docker('start', container_name)
+
+    def stop(self, container_name: str) -> None:
+        self._docker('stop', container_name)
+
+    def restart(self, container_name: str) -> None:
+        self._docker('restart', container_name)
+
+    @staticmethod
+    def _stream(*args: str) -> Iterator[str]:
+        lines = ShBackend._docker(*args, _iter=True, _ok_code=range(256), _bg_exc=False)
+        try:
+            for line in lines:
+                yield line
+        finally:
+            if lines.process.is_alive()[0]:
+                lines.process.terminate()
+        if lines.exit_code != 0:
+            raise DockerError(' '.join(('docker',) + args), lines.exit_code)
+
+    def get_archive(self, container_name: str, path: str) -> Iterator[bytes]:
+        # sh keeps every chunk of the output in memory: the pipe is read directly, one buffer at a time, so that
+        # docker cp blocks while the consumer is slower
+        command = ['docker', 'cp', '{}:{}'.format(container_name, path), '-']
+        with tempfile.TemporaryFile() as stderr:
+            try:
+                process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+            except FileNotFoundError:
+                raise DockerError('docker', 127)
+            with process:
+                try:
+                    yield from iter(lambda: process.stdout.read(ARCHIVE_BUFFER_SIZE), b'')
+                finally:
+                    if process.poll() is None:
+                        process.terminate()
+            if process.returncode != 0:
+                stderr.seek(0)
+                raise DockerError(' '.join(command), process.returncode, stderr=stderr.read())
+
+    def put_archive(self, container_name: str, path: str, chunks: Iterable[bytes]) -> None:
+        self._docker('cp', '-', '{}:{}'.format(container_name, path), _in=chunks, _in_bufsize=ARCHIVE_BUFFER_SIZE)
+
+    def events(self, container_name: str, event: str, since: float, until: float) -> Iterator[dict]:
+        events = self._stream('events', '--filter', 'type=container', '--filter',
+                              'container={}'.format(container_name), '--filter', 'event={}'.format(event),
+                              '--since', '{:.6f}'.format(since), '--until', '{:.6f}'.format(until),
+                              '--format', '{{json .}}')
+        try:
+            for line in events:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+        finally:
+            events.close()
+
+    def exec(self, container_name: str, *args: str) -> bytes:
+        return self._docker('exec', container_name, *args).stdout
+
+    def exec_stream(self, container_name: str, *args: str) -> Iterator[str]:
+        lines = self._stream('exec', container_name, *args)
+        try:
+            for line in lines:
+                yield line
+        finally:
+            lines.close()
+
+
+class EngineBackend(Backend):
+    """
+    Talks to the Engine API over the daemon socket
+    """
+
+    def __init__(self, client: EngineClient = None, socket_path: str = DEFAULT_SOCKET):
+        self.client = client or EngineClient(socket_path)
+
+    @staticmethod
+    def _call(command: str, function, *args):
+        try:
+            return function(*args)
+        except EngineAPIError as e:
+            raise DockerError(command, 1, stderr=e.message.encode('utf-8'))
+        except OSError as e:
+            raise DockerError(command, 1, stderr=str(e).encode('utf-8'))
+
+    def inspect(self, container_name: str) -> dict:
+        return self._call('docker inspect', self.client.inspect, container_name)
+
+    def start(self, container_name: str) -> None:
+        self._call('docker start', self.client.start, container_name)
+
+    def stop(self, container_name: str) -> None:
+        self._call('docker stop', self.client.stop, container_name)
+
+    def restart(self, container_name: str) -> None:
+        self._call('docker restart', self.client.restart, container_name)
+
+    def events(self, container_name: str, event: str, since: float, until: float) -> Iterator[dict]:
+        filters = {'type': ['container'], 'container': [container_name], 'event': [event]}
+        events = self.client.events(filters, since, until)
+        try:
+            while True:
+                try:
+                    yield self._call('docker events', next, events)
+                except StopIteration:
+                    return
+        finally:
+            events.close()
+
+    def get_archive(self, container_name: str, path: str) -> Iterator[bytes]:
+        command = 'docker cp {}:{} -'.format(container_name, path)
+        chunks = self.client.get_archive(container_name, path, ARCHIVE_BUFFER_SIZE)
+        try:
+            while True:
+                try:
+                    yield self._call(command, next, chunks)
+                except StopIteration:
+                    return
+        finally:
+            chunks.close()
+
+    def put_archive(self, container_name: str, path: str, chunks: Iterable[bytes]) -> None:
+        self._call('docker cp - {}:{}'.format(container_name, path), self.client.put_archive, container_name, path,
+                   chunks)
+
+    def exec(self, container_name: str, *args: str) -> bytes:
+        command = ' '.join(('docker exec', container_name) + args)
+        exit_code, stdout, stderr = self._call(command, self.client.exec_run, container_name, list(args))
+        if exit_code:
+            raise DockerError(command, exit_code, stdout, stderr)
+        return stdout
+
+    def exec_stream(self, container_name: str, *args: str) -> Iterator[str]:
+        command = ' '.join(('docker exec', container_name) + args)
+        exec_id = self._call(command, self.client.exec_create, container_name, list(args))
+        frames = self.client.exec_start_stream(exec_id)
+        pending = b''
+        try:
+            while True:
+                try:
+                    stream_type, payload = self._call(command, next, frames)
+                except StopIteration:
+                    break
+                if stream_type == 2:
+                    continue
+                pending += payload
+                *lines, pending = pending.split(b'\n')
+                for line in lines:
+                    yield line.decode('utf-8') + '\n'
+        finally:
+            frames.close()
+        if pending:
+            yield pending.decode('utf-8')
+        exit_code = self._call(command, self.client.exec_inspect, exec_id).get('ExitCode')
+        if exit_code:
+            raise DockerError(command, exit_code)
+
+
+class InstrumentedBackend(Backend):
+    """
+    Records the duration of each call of another backend in metrics_lib.instrumentation, e.g. as 'docker.inspect'
+    or 'docker.exec.busctl'
+    """
+
+    def __init__(self, backend: Backend):
+        self.backend = backend
+
+    def time(self) -> float:
+        return self.backend.time()
+
+    def monotonic(self) -> float:
+        return self.backend.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        self.backend.sleep(seconds)
+
+    def inspect(self, container_name: str) -> dict:
+        with instrumentation.timed('docker.inspect'):
+            return self.backend.inspect(container_name)
+
+    def inspect_many(self, container_names: List[str]) -> List[dict]:
+        with instrumentation.timed('docker.inspect'):
+            return self.backend.inspect_many(container_names)
+
+    def start(self, container_name: str) -> None:
+        with instrumentation.timed('docker.start'):
+            self.backend.start(container_name)
+
+    def stop(self, container_name: str) -> None:
+        with instrumentation.timed('docker.stop'):
+            self.backend.stop(container_name)
+
+    def restart(self, container_name: str) -> None:
+        with instrumentation.timed('docker.restart'):
+            self.backend.restart(container_name)
+
+    def events(self, container_name: str, event: str, since: float, until: float) -> Iterator[dict]:
+        return instrumentation.timed_iterator('docker.events',
+                                              self.backend.events(container_name, event, since, until))
+
+    def get_archive(self, container_name: str, path: str) -> Iterator[bytes]:
+        return instrumentation.timed_iterator('docker.cp', self.backend.get_archive(container_name, path))
+
+    def put_archive(self, container_name: str, path: str, chunks: Iterable[bytes]) -> None:
+        with instrumentation.timed('docker.cp'):
+            self.backend.put_archive(container_name, path, chunks)
+
+    def exec(self, container_name: str, *args: str) -> bytes:
+        with instrumentation.timed('docker.exec.{}'.format(instrumentation.command_name(args))):
+            return self.backend.exec(container_name, *args)
+
+    def exec_stream(self, container_name: str, *args: str) -> Iterator[str]:
+        return instrumentation.timed_iterator('docker.exec.{}'.format(instrumentation.command_name(args)),
+                                              self.backend.exec_stream(container_name, *args))
+
+
+_backend: Backend = InstrumentedBackend(ShBackend())
+
+
+def get_backend() -> Backend:
+    return _backend
+
+
+def set_backend(backend: Backend) -> None:
+    """
+    Selects the backend used by Container and Systemd. Its calls are recorded by metrics_lib.instrumentation
+    """
+    global _backend
+    _backend = backend if isinstance(backend, InstrumentedBackend) else InstrumentedBackend(backend)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+"""Readers-writer lock of a container, shared by all processes of the host.
+
+Tests checking a container take the lock shared, tests stopping or restarting its services take it exclusively, so
+that pytest-xdist workers never check a container another worker is restarting. The lock is a flock on
+<temporary directory>/grafana-tools-locks/<container>.lock, released by the kernel if the process dies.
+"""
+
+import contextlib
+import fcntl
+import os
+import tempfile
+
+from typing import Iterator
+
+LOCK_DIRECTORY = os.path.join(tempfile.gettempdir(), 'grafana-tools-locks')
+
+
+class ContainerLock:
+    """
+    Lock of one container
+    """
+
+    def __init__(self, container_name: str, directory: str = LOCK_DIRECTORY):
+        self.container_name = container_name
+        self.path = os.path.join(directory, '{}.lock'.format(container_name))
+
+    @contextlib.contextmanager
+    def _locked(self, operation: int) -> Iterator[None]:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a') as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def shared(self, blocking: bool = True) -> contextlib.AbstractContextManager:
+        """
+        Waits until no process holds the lock exclusively
+        :param blocking: if False, raises BlockingIOError instead of waiting
+        """
+        return self._locked(fcntl.LOCK_SH if blocking else fcntl.LOCK_SH | fcntl.LOCK_NB)
+
+    def exclusive(self, blocking: bool = True) -> contextlib.AbstractContextManager:
+        """
+        Waits until no process holds the lock
+        :param blocking: if False, raises BlockingIOError instead of waiting
+        """
+        return self._locked(fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
@@ -7,49 +7,182 @@ __copyright__ = 'Copyright 2018, ELCA'
 
 import datetime
 import dateutil.parser
-import sh
-import time
+import threading
 
-from typing import Tuple
+from typing import Dict, List, Tuple
+
+from docker_lib.backends import DockerError, get_backend
+
+
+class ContainerState:
+    """
+    State of a container, as returned by 'docker inspect'
+    """
+
+    __slots__ = ('name', 'status', 'started_at', 'finished_at', 'restart_count', 'health', 'pid')
+
+    def __init__(self, name: str, status: str, started_at: str, finished_at: str, restart_count: int,
+                 health: str = None, pid: int = 0):
+        """
+        :param name:
+        :param status: e.g. 'running' or 'exited'
+        :param started_at: RFC 3339 date, e.g. '2018-05-14T13:39:30.850190Z'
+        :param finished_at: RFC 3339 date, '0001-01-01T00:00:00Z' if the container never stopped
+        :param restart_count: number of restarts done by the docker daemon
+        :param health: 'starting', 'healthy' or 'unhealthy', None without health check
+        :param pid: process id of the container, 0 if it is not running
+        """
+        self.name = name
+        self.status = status
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.restart_count = restart_count
+        self.health = health
+        self.pid = pid
+
+    @staticmethod
+    def from_inspect(name: str, inspect: dict) -> 'ContainerState':
+        state = inspect['State']
+        return ContainerState(name, state['Status'], state.get('StartedAt'), state.get('FinishedAt'),
+                              inspect.get('RestartCount', 0), (state.get('Health') or {}).get('Status'),
+                              state.get('Pid', 0))
 
 
 class Container:
 
+    # Event emitted by the docker daemon when a container enters a given status
+    STATUS_EVENTS = {'running': 'start', 'exited': 'die'}
+    # Delay between two 'docker inspect' when the event stream is not available
+    POLL_INTERVAL = 1.0
+    # Wait for 'docker events' instead of polling 'docker inspect'
+    use_events = True
+    # Delay in seconds during which the answer of 'docker inspect' is reused
+    CACHE_TTL = 1.0
+
+    _cache: Dict[str, Tuple[float, ContainerState]] = {}
+    _cache_lock = threading.Lock()
+
     @staticmethod
-    def _wait_until(container_name: str, status: str, timeout: int) -> None:
-        counter = 0
+    def inspect_many(container_names: List[str], max_age: float = None) -> Dict[str, ContainerState]:
+        """
+        Returns the state of the containers with a single 'docker inspect' for those which are not cached
+        :param container_names:
+        :param max_age: states older than this delay in seconds are read again, defaults to CACHE_TTL
+        :return: state of each container
+        :raise DockerError: if a container does not exist
+        """
+        max_age = Container.CACHE_TTL if max_age is None else max_age
+        now = get_backend().monotonic()
+        states = {}
+        with Container._cache_lock:
+            for container_name in container_names:
+                cached = Container._cache.get(container_name)
+                if cached is not None and now - cached[0] < max_age:
+                    states[container_name] = cached[1]
+        missing = [container_name for container_name in dict.fromkeys(container_names)
+                   if container_name not in states]
+        if missing:
+            inspected = get_backend().inspect_many(missing)
+            with Container._cache_lock:
+                for container_name, inspect in zip(missing, inspected):
+                    states[container_name] = ContainerState.from_inspect(container_name, inspect)
+                    Container._cache[container_name] = (now, states[container_name])
+        return states
+
+    @staticmethod
+    def inspect(container_name: str, max_age: float = None) -> ContainerState:
+        return Container.inspect_many([container_name], max_age)[container_name]
+
+    @staticmethod
+    def invalidate(container_name: str) -> None:
+        """
+        Forgets the cached state of the container
+        """
+        with Container._cache_lock:
+            Container._cache.pop(container_name, None)
+
+    @staticmethod
+    def _poll_until(container_name: str, status: str, deadline: float) -> None:
         while True:
-            time.sleep(1)
-            counter = counter + 1
-            if status in Container.status(container_name):
+            if status in Container.inspect(container_name, max_age=0).status:
                 return
-            if counter > timeout:
+            remaining = deadline - get_backend().monotonic()
+            if remaining <= 0:
                 raise TimeoutError
+            get_backend().sleep(min(Container.POLL_INTERVAL, remaining))
+
+    @staticmethod
+    def _wait_for_event(container_name: str, status: str, since: float, deadline: float) -> bool:
+        """
+        Subscribes to the docker event stream and waits for the event matching *status*
+        :param container_name:
+        :param status: 'running' or 'exited'
+        :param since: events older than this timestamp (seconds since the epoch) are ignored
+        :param deadline: monotonic clock value of the backend after which we stop listening
+        :return: True if the event was received, False if the stream ended without it
+        :raise DockerError: if the event stream is not available
+        """
+        event_name = Container.STATUS_EVENTS[status]
+        # 'docker events' expects wall-clock timestamps: --until ends the stream when our deadline expires.
+        backend = get_backend()
+        until = backend.time() + max(deadline - backend.monotonic(), 0)
+        events = backend.events(container_name, event_name, since, until)
+        try:
+            for event in events:
+                if event.get('status', event.get('Action')) == event_name:
+                    return True
+        finally:
+            events.close()
+        return False
+
+    @staticmethod
+    def _wait_until(container_name: str, status: str, timeout: int, since: float = None) -> None:
+        """
+        Waits until the container reaches *status*
+        :param container_name:
+        :param status: 'running' or 'exited'
+        :param timeout: delay in seconds
+        :param since: timestamp taken before the docker command was sent. When given, the matching docker event is
+                      awaited instead of polling the container status
+        :return:
+        :raise TimeoutError: if *status* is not reached after *timeout* seconds
+        """
+        deadline = get_backend().monotonic() + timeout
+        if since is not None and Container.use_events and status in Container.STATUS_EVENTS:
+            try:
+                if Container._wait_for_event(container_name, status, since, deadline):
+                    return
+            except DockerError:
+                # Event stream unavailable: fall back to polling
+                pass
+        Container._poll_until(container_name, status, deadline)
 
     @staticmethod
     def started_at(container_name: str) -> Tuple[str, float]:
-        state_started_at: str = sh.docker('inspect', container_name,
-                                          "--format='{{.State.StartedAt}}'").stdout.decode('utf-8').rstrip()
-        started_at: datetime.datetime = dateutil.parser.parse(state_started_at)
+        started_at: datetime.datetime = dateutil.parser.parse(Container.inspect(container_name).started_at)
         return started_at.strftime('%Y-%m-%d %H:%M:%S'), started_at.timestamp()
 
     @staticmethod
     def start(container_name: str, timeout: int) -> None:
-        sh.docker('start', container_name)
-        Container._wait_until(container_name, 'running', timeout)
+        since = get_backend().time()
+        get_backend().start(container_name)
+        Container.invalidate(container_name)
+        Container._wait_until(container_name, 'running', timeout, since)
 
     @staticmethod
     def restart(container_name: str, timeout: int) -> None:
-        sh.docker('restart', container_name)
-        Container._wait_until(container_name, 'running', timeout)
+        since = get_backend().time()
+        get_backend().restart(container_name)
+        Container.invalidate(container_name)
+        Container._wait_until(container_name, 'running', timeout, since)
 
     @staticmethod
     def stop(container_name: str, timeout: int) -> None:
-        sh.docker('stop', container_name)
-        Container._wait_until(container_name, 'exited', timeout)
+        since = get_backend().time()
+        get_backend().stop(container_name)
+        Container.invalidate(container_name)
+        Container._wait_until(container_name, 'exited', timeout, since)
 
     @staticmethod
     def status(container_name: str) -> str:
-        current_status = sh.docker('inspect', container_name,
-                                   "--format='{{.State.Status}}'").stdout.decode('utf-8')
-        return current_status
+        return Container.inspect(container_name).status
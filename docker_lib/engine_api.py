@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+
+"""Minimal Docker Engine API client.
+
+Talks HTTP to the docker daemon over its unix socket, keeping a small pool of keep-alive connections so that
+repeated calls do not pay for a process fork or a new connection.
+"""
+
+import http.client
+import json
+import queue
+import socket
+import struct
+import urllib.parse
+
+from typing import Iterable, Iterator, List, Tuple
+
+
+DEFAULT_SOCKET = '/var/run/docker.sock'
+
+
+class EngineAPIError(Exception):
+    """
+    Raised when the docker daemon answers with an error status
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__('{status}: {message}'.format(status=status, message=message))
+        self.status = status
+        self.message = message
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTPConnection over a unix domain socket
+    """
+
+    def __init__(self, socket_path: str, timeout: float = None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+def demultiplex(stream: bytes) -> Tuple[bytes, bytes]:
+    """
+    Splits the multiplexed output of a non-tty exec into stdout and stderr.
+    Each frame starts with an 8 bytes header: stream type (1 = stdout, 2 = stderr), 3 padding bytes and the
+    big-endian size of the payload.
+    :param stream: raw stream returned by /exec/{id}/start
+    :return: stdout, stderr
+    """
+    stdout = bytearray()
+    stderr = bytearray()
+    offset = 0
+    while offset + 8 <= len(stream):
+        stream_type, size = struct.unpack('>BxxxL', stream[offset:offset + 8])
+        payload = stream[offset + 8:offset + 8 + size]
+        if stream_type == 2:
+            stderr.extend(payload)
+        else:
+            stdout.extend(payload)
+        offset += 8 + size
+    return bytes(stdout), bytes(stderr)
+
+
+class EngineClient:
+    """
+    Docker Engine API client using pooled keep-alive connections to the daemon socket
+    """
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, pool_size: int = 4, timeout: float = 60,
+                 api_version: str = None):
+        """
+        :param socket_path: path of the docker daemon socket
+        :param pool_size: maximum number of idle connections kept open
+        :param timeout: socket timeout in seconds
+        :param api_version: e.g. '1.37'. Defaults to the version of the daemon
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.prefix = '/v{}'.format(api_version) if api_version else ''
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _get_connection(self) -> Tuple[UnixHTTPConnection, bool]:
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            return UnixHTTPConnection(self.socket_path, self.timeout), False
+
+    def _put_connection(self, connection: UnixHTTPConnection) -> None:
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def _url(self, path: str, params: dict = None) -> str:
+        url = self.prefix + path
+        if params:
+            url = '{url}?{query}'.format(url=url, query=urllib.parse.urlencode(params))
+        return url
+
+    def request(self, method: str, path: str, params: dict = None, body: dict = None) -> Tuple[int, bytes]:
+        """
+        Sends a request and reads the whole response
+        :param method: HTTP method
+        :param path: API path without version prefix, e.g. '/containers/grafana-1/json'
+        :param params: query string parameters
+        :param body: JSON body
+        :return: status, response body
+        :raise EngineAPIError: if the daemon answers with a status >= 400
+        """
+        url = self._url(path, params)
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        while True:
+            connection, reused = self._get_connection()
+            try:
+                connection.request(method, url, body=payload, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                connection.close()
+                if reused:
+                    # The daemon closed an idle keep-alive connection: retry on a new one
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._put_connection(connection)
+            break
+        if response.status >= 400:
+            try:
+                message = json.loads(data.decode('utf-8')).get('message', '')
+            except ValueError:
+                message = data.decode('utf-8', 'replace')
+            raise EngineAPIError(response.status, message)
+        return response.status, data
+
+    def _open(self, method: str, path: str, params: dict = None,
+              body: dict = None) -> Tuple[UnixHTTPConnection, http.client.HTTPResponse]:
+        """
+        Sends a request on a dedicated connection, the caller reads the response and closes the connection
+        :raise EngineAPIError: if the daemon answers with a status >= 400
+        """
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        connection = UnixHTTPConnection(self.socket_path, None)
+        try:
+            connection.request(method, self._url(path, params), body=payload, headers=headers)
+            response = connection.getresponse()
+            if response.status >= 400:
+                raise EngineAPIError(response.status, response.read().decode('utf-8', 'replace'))
+        except Exception:
+            connection.close()
+            raise
+        return connection, response
+
+    def stream(self, method: str, path: str, params: dict = None) -> Iterator[bytes]:
+        """
+        Sends a request on a dedicated connection and yields the response body line by line
+        :raise EngineAPIError: if the daemon answers with a status >= 400
+        """
+        connection, response = self._open(method, path, params)
+        try:
+            for line in response:
+                yield line
+        finally:
+            connection.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def inspect(self, container_name: str) -> dict:
+        _, data = self.request('GET', '/containers/{}/json'.format(container_name))
+        return json.loads(data.decode('utf-8'))
+
+    def start(self, container_name: str) -> None:
+        self.request('POST', '/containers/{}/start'.format(container_name))
+
+    def stop(self, container_name: str, timeout: int = None) -> None:
+        params = {'t': timeout} if timeout is not None else None
+        self.request('POST', '/containers/{}/stop'.format(container_name), params)
+
+    def restart(self, container_name: str, timeout: int = None) -> None:
+        params = {'t': timeout} if timeout is not None else None
+        self.request('POST', '/containers/{}/restart'.format(container_name), params)
+
+    def events(self, filters: dict, since: float = None, until: float = None) -> Iterator[dict]:
+        """
+        Yields the events of the daemon
+        :param filters: e.g. {'container': ['grafana-1'], 'event': ['start']}
+        :param since: timestamp in seconds since the epoch
+        :param until: timestamp in seconds since the epoch, the stream ends at this date
+        """
+        params = {'filters': json.dumps(filters)}
+        if since is not None:
+            params['since'] = '{:.6f}'.format(since)
+        if until is not None:
+            params['until'] = '{:.6f}'.format(until)
+        for line in self.stream('GET', '/events', params):
+            if line.strip():
+                yield json.loads(line.decode('utf-8'))
+
+    def get_archive(self, container_name: str, path: str, chunk_size: int = 65536) -> Iterator[bytes]:
+        """
+        Yields a tar archive of *path* in the container, *chunk_size* bytes at a time
+        """
+        connection, response = self._open('GET', '/containers/{}/archive'.format(container_name), {'path': path})
+        try:
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            connection.close()
+
+    def put_archive(self, container_name: str, path: str, chunks: Iterable[bytes]) -> None:
+        """
+        Extracts the tar archive of *chunks* into directory *path* of the container, sending it with a chunked
+        transfer encoding
+        :raise EngineAPIError: if the daemon answers with a status >= 400
+        """
+        connection = UnixHTTPConnection(self.socket_path, self.timeout)
+        try:
+            connection.request('PUT', self._url('/containers/{}/archive'.format(container_name), {'path': path}),
+                               body=iter(chunks), headers={'Content-Type': 'application/x-tar'}, encode_chunked=True)
+            response = connection.getresponse()
+            data = response.read()
+        finally:
+            connection.close()
+        if response.status >= 400:
+            try:
+                message = json.loads(data.decode('utf-8')).get('message', '')
+            except ValueError:
+                message = data.decode('utf-8', 'replace')
+            raise EngineAPIError(response.status, message)
+
+    def exec_create(self, container_name: str, cmd: List[str]) -> str:
+        body = {'AttachStdout': True, 'AttachStderr': True, 'Cmd': cmd}
+        _, data = self.request('POST', '/containers/{}/exec'.format(container_name), body=body)
+        return json.loads(data.decode('utf-8'))['Id']
+
+    def exec_start(self, exec_id: str) -> Tuple[bytes, bytes]:
+        _, data = self.request('POST', '/exec/{}/start'.format(exec_id), body={'Detach': False, 'Tty': False})
+        return demultiplex(data)
+
+    def exec_start_stream(self, exec_id: str) -> Iterator[Tuple[int, bytes]]:
+        """
+        Starts an exec and yields its output as it is produced
+        :return: stream type (1 = stdout, 2 = stderr), payload
+        """
+        connection, response = self._open('POST', '/exec/{}/start'.format(exec_id),
+                                          body={'Detach': False, 'Tty': False})
+        try:
+            while True:
+                header = response.read(8)
+                if len(header) < 8:
+                    return
+                stream_type, size = struct.unpack('>BxxxL', header)
+                yield stream_type, response.read(size)
+        finally:
+            connection.close()
+
+    def exec_inspect(self, exec_id: str) -> dict:
+        _, data = self.request('GET', '/exec/{}/json'.format(exec_id))
+        return json.loads(data.decode('utf-8'))
+
+    def exec_run(self, container_name: str, cmd: List[str]) -> Tuple[int, bytes, bytes]:
+        """
+        Equivalent of 'docker exec *container_name* *cmd*'
+        :return: exit code, stdout, stderr
+        """
+        exec_id = self.exec_create(container_name, cmd)
+        stdout, stderr = self.exec_start(exec_id)
+        return self.exec_inspect(exec_id).get('ExitCode'), stdout, stderr
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""Compares the latency of the docker CLI (ShBackend) and of the Engine API socket (EngineBackend).
+
+python -m docker_lib.engine_benchmark --container grafana-1 --iterations 20
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from typing import Callable, List
+
+from docker_lib.backends import Backend, EngineBackend, ShBackend
+from docker_lib.engine_api import DEFAULT_SOCKET, EngineClient
+
+VERSION = '1.0'
+
+
+def measure(function: Callable[[], object], iterations: int) -> List[float]:
+    latencies = []
+    for _ in range(iterations):
+        begin = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - begin)
+    return latencies
+
+
+def summarize(latencies: List[float]) -> dict:
+    return {'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+            'median_ms': round(statistics.median(latencies) * 1000, 3),
+            'min_ms': round(min(latencies) * 1000, 3),
+            'max_ms': round(max(latencies) * 1000, 3)}
+
+
+def benchmark(backend: Backend, container_name: str, iterations: int) -> dict:
+    return {'inspect': summarize(measure(lambda: backend.inspect(container_name), iterations)),
+            'exec': summarize(measure(lambda: backend.exec(container_name, 'true'), iterations))}
+
+
+def main():
+    prog_name = sys.argv[0]
+    usage = """{} [options]
+    """.format(prog_name)
+    parser = argparse.ArgumentParser(prog="{pn} {v}".format(pn=prog_name, v=VERSION), usage=usage)
+    parser.add_argument('--container', type=str, required=True, dest='container', help='Name of the container')
+    parser.add_argument('--iterations', type=int, default=20, dest='iterations',
+                        help='Number of calls per operation, defaults to 20')
+    parser.add_argument('--socket', type=str, default=DEFAULT_SOCKET, dest='socket',
+                        help='Docker daemon socket, defaults to {}'.format(DEFAULT_SOCKET))
+    args = parser.parse_args()
+
+    report = {'subprocess': benchmark(ShBackend(), args.container, args.iterations),
+              'socket': benchmark(EngineBackend(EngineClient(args.socket)), args.container, args.iterations)}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+"""Persistent shell inside a container.
+
+A single 'docker exec -i <container> sh' stays open and runs many commands, so that polling loops do not pay for a
+new docker exec (process setup in the container and in the docker CLI) on each iteration.
+"""
+
+import shlex
+import subprocess
+import threading
+import uuid
+
+from typing import List
+
+from docker_lib.backends import DockerError
+from metrics_lib import instrumentation
+
+
+class ExecSession:
+    """
+    Runs commands in a long-lived shell of a container. Commands are framed on stdin/stdout with a sentinel line
+    carrying their exit code. The shell is started again if it dies, e.g. because the container restarted.
+    Instances can be shared between threads.
+    """
+
+    def __init__(self, container_name: str, shell: str = 'sh', docker: str = 'docker'):
+        self.container_name = container_name
+        self.shell = shell
+        self.docker = docker
+        self._sentinel = '__exec_session_{}__'.format(uuid.uuid4().hex)
+        self._lock = threading.Lock()
+        self._process: subprocess.Popen = None
+        self._stderr_lines: List[bytes] = []
+        self._stderr_done = threading.Condition()
+
+    def __enter__(self) -> 'ExecSession':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _read_stderr(self, process: subprocess.Popen, lines: List[bytes]) -> None:
+        for line in process.stderr:
+            with self._stderr_done:
+                lines.append(line)
+                self._stderr_done.notify_all()
+        process.stderr.close()
+        with self._stderr_done:
+            lines.append(b'')
+            self._stderr_done.notify_all()
+
+    def _connect(self) -> None:
+        self._process = subprocess.Popen([self.docker, 'exec', '-i', self.container_name, self.shell],
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._stderr_lines = []
+        threading.Thread(target=self._read_stderr, args=(self._process, self._stderr_lines), daemon=True).start()
+
+    def _disconnect(self) -> None:
+        if self._process is not None:
+            if self._process.poll() is None:
+                self._process.kill()
+            self._process.wait()
+            self._process.stdin.close()
+            self._process.stdout.close()
+            self._process = None
+
+    def _wait_stderr(self, end: bytes) -> bytes:
+        with self._stderr_done:
+            while True:
+                if end in self._stderr_lines:
+                    index = self._stderr_lines.index(end)
+                elif b'' in self._stderr_lines:
+                    index = self._stderr_lines.index(b'')
+                else:
+                    self._stderr_done.wait()
+                    continue
+                stderr = b''.join(self._stderr_lines[:index])
+                del self._stderr_lines[:index + 1]
+                return stderr
+
+    def run(self, *args: str) -> bytes:
+        """
+        Runs *args* in the shell of the container
+        :return: stdout
+        :raise DockerError: if the command exits with a non-zero code or if the shell died while running it
+        """
+        with instrumentation.timed('docker.session.{}'.format(instrumentation.command_name(args))):
+            return self._run(*args)
+
+    def _run(self, *args: str) -> bytes:
+        command = ' '.join(shlex.quote(arg) for arg in args)
+        end = '{} end'.format(self._sentinel).encode('utf-8')
+        # printf adds a new line in case the output of the command does not end with one, on stdout and stderr
+        script = ("{command} </dev/null; rc=$?; printf '\\n{sentinel} %d\\n' $rc; "
+                  "printf '\\n{sentinel} end\\n' >&2\n").format(command=command, sentinel=self._sentinel)
+        with self._lock:
+            if self._process is None or self._process.poll() is not None:
+                self._disconnect()
+                self._connect()
+            try:
+                self._process.stdin.write(script.encode('utf-8'))
+                self._process.stdin.flush()
+            except BrokenPipeError:
+                # The shell died since the last command: nothing was run, try again on a new one
+                self._disconnect()
+                self._connect()
+                self._process.stdin.write(script.encode('utf-8'))
+                self._process.stdin.flush()
+
+            stdout = bytearray()
+            marker = self._sentinel.encode('utf-8')
+            while True:
+                line = self._process.stdout.readline()
+                if not line:
+                    self._disconnect()
+                    raise DockerError('docker exec {} {}'.format(self.container_name, command), 255, bytes(stdout),
+                                      b'exec session closed')
+                if line.startswith(marker):
+                    exit_code = int(line.split()[1])
+                    break
+                stdout.extend(line)
+            stderr = self._wait_stderr(end + b'\n')
+
+        output = bytes(stdout[:-1]) if stdout.endswith(b'\n') else bytes(stdout)
+        stderr = stderr[:-1] if stderr.endswith(b'\n') else stderr
+        if exit_code:
+            raise DockerError('docker exec {} {}'.format(self.container_name, command), exit_code, output, stderr)
+        return output
+
+    def close(self) -> None:
+        with self._lock:
+            self._disconnect()
@@ -0,0 +1,655 @@
+#!/usr/bin/env python
+
+"""In-process simulation of the Grafana container, used to run the container tests offline.
+
+The simulated containers run systemd units supervised by monit on a virtual clock. The clock only moves forward when
+the code under test sleeps or waits for an event, so waits of minutes take microseconds and every run is
+deterministic. The commands sent by Container, Systemd and JournalReader are interpreted: docker
+start/stop/restart/inspect/events/cp, 'sh -c' scripts made of echo, true, sleep, wait, kill and background
+'busctl monitor' ($! being its PID), busctl get-property/monitor, systemctl and journalctl.
+
+from docker_lib.backends import set_backend
+from docker_lib.simulated_backend import SimulatedBackend
+set_backend(SimulatedBackend(['grafana-1']))
+"""
+
+import datetime
+import heapq
+import io
+import itertools
+import json
+import posixpath
+import re
+import shlex
+import tarfile
+
+from typing import Callable, Dict, Generator, Iterable, Iterator, List, Optional
+
+from docker_lib.backends import ARCHIVE_BUFFER_SIZE, Backend, DockerError
+from systemd_lib.systemd_tools import Systemd
+
+# Date of the first start of the simulated containers: 2018-05-14 13:39:30 UTC
+EPOCH = 1526305170.0
+
+# Units of the simulated container. monit: name of the service in the configuration of monit, None if monit does not
+# watch the unit. restart: restarted by systemd when killed (Restart=always). start_delay: seconds spent activating.
+UNITS = {
+    'grafana-server.service': {'monit': 'grafana-server', 'restart': False, 'start_delay': 2.0},
+    'nginx.service': {'monit': 'nginx', 'restart': False, 'start_delay': 0.5},
+    'monit.service': {'monit': None, 'restart': True, 'start_delay': 0.2},
+}
+
+# D-Bus signature of the simulated unit properties
+SIGNATURES = {'Id': 's', 'ActiveState': 's', 'SubState': 's', 'ActiveEnterTimestamp': 't',
+              'InactiveEnterTimestamp': 't'}
+
+# Initial files of the simulated containers, read and written by docker cp
+FILES = {
+    '/var/lib/grafana/grafana.db': b'SQLite format 3\x00' + bytes(range(256)) * 256,
+    '/var/lib/grafana/plugins/grafana-piechart-panel/plugin.json': b'{"type": "panel", "id": "grafana-piechart-panel"}',
+}
+
+PRIORITIES = {'emerg': 0, 'alert': 1, 'crit': 2, 'err': 3, 'warning': 4, 'notice': 5, 'info': 6, 'debug': 7}
+
+
+def format_date(timestamp: Optional[float]) -> str:
+    """
+    :return: date as printed by 'docker inspect', e.g. '2018-05-14T13:39:30.000000Z'
+    """
+    if timestamp is None:
+        return '0001-01-01T00:00:00Z'
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def busctl_value(signature: str, value) -> str:
+    return 's "{}"'.format(value) if signature == 's' else '{} {}'.format(signature, value)
+
+
+def monitor_value(signature: str, value) -> str:
+    return 'STRING "{}"'.format(value) if signature == 's' else 'UINT64 {}'.format(value)
+
+
+class SimulatedContainer:
+    """
+    State of a simulated container
+    """
+
+    def __init__(self, name: str, container_id: str):
+        self.name = name
+        self.id = container_id
+        self.status = 'created'
+        self.started_at = None
+        self.finished_at = None
+        self.pid = 0
+        # Incremented on each start: timers of a previous run of the container are ignored
+        self.boot = 0
+        self.units: Dict[str, Dict[str, object]] = {}
+        # Incremented on each start of a unit: pending activations of a previous start are ignored
+        self.jobs: Dict[str, int] = {}
+        self.monit_generation = 0
+        self.journal: List[dict] = []
+        self.monitors: List['Monitor'] = []
+        self.files: Dict[str, bytes] = dict(FILES)
+
+    @property
+    def boot_id(self) -> str:
+        return '{:032x}'.format(self.boot)
+
+
+class Monitor:
+    """
+    Subscription of 'busctl monitor' to the PropertiesChanged signals of a unit
+    """
+
+    __slots__ = ('path', 'until', 'lines', 'pid')
+
+    def __init__(self, path: Optional[str], until: Optional[float]):
+        """
+        :param path: object of the unit, None for all units
+        :param until: date at which 'timeout' stops busctl, None for no timeout
+        """
+        self.path = path
+        self.until = until
+        self.lines = []
+        self.pid = None
+
+
+class SimulatedBackend(Backend):
+    """
+    Simulated docker daemon, systemd and monit on a virtual clock
+    """
+
+    # Delay in seconds between two checks of monit ('set daemon' in monitrc)
+    MONIT_CYCLE = 30.0
+    # Delay in seconds before systemd restarts a killed unit (RestartSec)
+    RESTART_SEC = 0.1
+    # Duration in seconds of 'docker stop'
+    STOP_DELAY = 0.5
+
+    def __init__(self, container_names: List[str] = ('grafana-1',), epoch: float = EPOCH):
+        """
+        :param container_names: containers running at *epoch*
+        :param epoch: initial value of the virtual clock, in seconds since the epoch
+        """
+        self.now = epoch
+        self._timers = []
+        self._sequence = itertools.count()
+        self._pids = itertools.count(100)
+        self._cookies = itertools.count(1)
+        self.docker_events: List[dict] = []
+        self.containers: Dict[str, SimulatedContainer] = {}
+        for index, container_name in enumerate(container_names):
+            container = SimulatedContainer(container_name, '{:064x}'.format(index + 1))
+            self.containers[container_name] = container
+            self._start_container(container)
+        # Let the units start
+        self.sleep(max(unit['start_delay'] for unit in UNITS.values()))
+
+    # Virtual clock
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self._advance_to(self.now + max(seconds, 0))
+
+    def _schedule(self, delay: float, callback: Callable[[], None]) -> None:
+        heapq.heappush(self._timers, (self.now + delay, next(self._sequence), callback))
+
+    def _next_timer(self) -> Optional[float]:
+        return self._timers[0][0] if self._timers else None
+
+    def _advance_to(self, target: float) -> None:
+        """
+        Moves the clock to *target*, running the timers which expire in between
+        """
+        while self._timers and self._timers[0][0] <= target:
+            when, _, callback = heapq.heappop(self._timers)
+            self.now = max(self.now, when)
+            callback()
+        self.now = max(self.now, target)
+
+    # Docker
+
+    def _container(self, command: str, container_name: str) -> SimulatedContainer:
+        container = self.containers.get(container_name)
+        if container is None:
+            raise DockerError(command, 1, stderr='Error: No such container: {}'.format(container_name).encode('utf-8'))
+        return container
+
+    def _docker_event(self, container: SimulatedContainer, action: str) -> None:
+        self.docker_events.append({'status': action, 'id': container.id, 'Type': 'container', 'Action': action,
+                                   'Actor': {'ID': container.id, 'Attributes': {'name': container.name}},
+                                   'time': int(self.now), 'timeNano': int(self.now * 1000000000)})
+
+    def _start_container(self, container: SimulatedContainer) -> None:
+        container.status = 'running'
+        container.started_at = self.now
+        container.pid = next(self._pids)
+        container.boot += 1
+        container.units = {unit: {'Id': unit, 'ActiveState': 'inactive', 'SubState': 'dead',
+                                  'ActiveEnterTimestamp': 0, 'InactiveEnterTimestamp': 0} for unit in UNITS}
+        container.monitors = []
+        self._docker_event(container, 'start')
+        for unit in UNITS:
+            self._start_unit(container, unit)
+
+    def _stop_container(self, container: SimulatedContainer) -> None:
+        self.sleep(self.STOP_DELAY)
+        container.status = 'exited'
+        container.finished_at = self.now
+        container.pid = 0
+        container.monitors = []
+        self._docker_event(container, 'die')
+        self._docker_event(container, 'stop')
+
+    def inspect(self, container_name: str) -> dict:
+        container = self._container('docker inspect', container_name)
+        return {'Id': container.id, 'Name': '/{}'.format(container.name), 'RestartCount': 0,
+                'State': {'Status': container.status, 'Running': container.status == 'running', 'Pid': container.pid,
+                          'StartedAt': format_date(container.started_at),
+                          'FinishedAt': format_date(container.finished_at)}}
+
+    def start(self, container_name: str) -> None:
+        container = self._container('docker start', container_name)
+        if container.status != 'running':
+            self._start_container(container)
+
+    def stop(self, container_name: str) -> None:
+        container = self._container('docker stop', container_name)
+        if container.status == 'running':
+            self._stop_container(container)
+
+    def restart(self, container_name: str) -> None:
+        container = self._container('docker restart', container_name)
+        if container.status == 'running':
+            self._stop_container(container)
+        self._start_container(container)
+        self._docker_event(container, 'restart')
+
+    def events(self, container_name: str, event: str, since: float, until: float) -> Iterator[dict]:
+        index = 0
+        while True:
+            for docker_event in self.docker_events[index:]:
+                if docker_event['Actor']['Attributes']['name'] == container_name and \
+                        docker_event['Action'] == event and since <= docker_event['timeNano'] / 1e9 <= until:
+                    yield docker_event
+            index = len(self.docker_events)
+            if self.now >= until:
+                return
+            self._advance_to(min(self._next_timer() or until, until))
+
+    def get_archive(self, container_name: str, path: str) -> Iterator[bytes]:
+        container = self._container('docker cp', container_name)
+        path = path.rstrip('/') or '/'
+        paths = sorted(file_path for file_path in container.files
+                       if file_path == path or file_path.startswith(path.rstrip('/') + '/'))
+        if not paths:
+            raise DockerError('docker cp', 1, stderr='Error: Could not find the file {} in container {}'.format(
+                path, container_name).encode('utf-8'))
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w') as tar:
+            for file_path in paths:
+                info = tarfile.TarInfo(posixpath.relpath(file_path, posixpath.dirname(path)))
+                info.size = len(container.files[file_path])
+                info.mtime = int(self.now)
+                tar.addfile(info, io.BytesIO(container.files[file_path]))
+        data = archive.getvalue()
+        for offset in range(0, len(data), ARCHIVE_BUFFER_SIZE):
+            yield data[offset:offset + ARCHIVE_BUFFER_SIZE]
+
+    def put_archive(self, container_name: str, path: str, chunks: Iterable[bytes]) -> None:
+        container = self._container('docker cp', container_name)
+        try:
+            with tarfile.open(fileobj=io.BytesIO(b''.join(chunks)), mode='r') as tar:
+                for member in tar:
+                    if member.isfile():
+                        file_path = posixpath.normpath(posixpath.join(path, member.name))
+                        container.files[file_path] = tar.extractfile(member).read()
+        except tarfile.TarError as e:
+            raise DockerError('docker cp', 1, stderr='Error: {}'.format(e).encode('utf-8'))
+
+    def exec(self, container_name: str, *args: str) -> bytes:
+        lines = []
+        try:
+            for line in self.exec_stream(container_name, *args):
+                lines.append(line)
+        except DockerError as e:
+            raise DockerError(e.command, e.exit_code, ''.join(lines).encode('utf-8'), e.stderr)
+        return ''.join(lines).encode('utf-8')
+
+    def exec_stream(self, container_name: str, *args: str) -> Iterator[str]:
+        command = ' '.join(('docker exec', container_name) + args)
+        container = self._container(command, container_name)
+        if container.status != 'running':
+            raise DockerError(command, 1, stderr='Container {} is not running'.format(container_name).encode('utf-8'))
+        errors = []
+        exit_code = yield from self._run(container, list(args), errors)
+        if exit_code:
+            raise DockerError(command, exit_code, stderr=''.join(errors).encode('utf-8'))
+
+    # Commands run inside the container. Each command is a generator yielding the lines of its stdout and returning
+    # its exit code, stderr is appended to *errors*.
+
+    def _run(self, container: SimulatedContainer, args: List[str], errors: List[str]) -> Generator[str, None, int]:
+        name, arguments = args[0], args[1:]
+        if name == 'sh' and len(arguments) == 2 and arguments[0] == '-c':
+            return (yield from self._script(container, arguments[1], errors))
+        if name == 'echo':
+            yield ' '.join(arguments) + '\n'
+            return 0
+        if name == 'true':
+            return 0
+        if name == 'sleep':
+            self.sleep(float(arguments[0]))
+            return 0
+        if name == 'kill':
+            return self._kill(container, arguments, errors)
+        monitor = self._parse_monitor(args)
+        if monitor is not None:
+            return (yield from self._follow_monitor(container, monitor))
+        if name == 'busctl' and arguments[:1] == ['get-property']:
+            return (yield from self._busctl_get_property(container, arguments[1:], errors))
+        if name == 'systemctl' and len(arguments) == 2:
+            return self._systemctl(container, arguments[0], arguments[1], errors)
+        if name == 'journalctl':
+            return (yield from self._journalctl(container, arguments, errors))
+        errors.append('sh: {}: not found\n'.format(name))
+        return 127
+
+    def _script(self, container: SimulatedContainer, script: str, errors: List[str]) -> Generator[str, None, int]:
+        """
+        Runs the commands of *script* separated by ';' or '&'. Background commands other than 'busctl monitor' run
+        in the foreground.
+        """
+        lexer = shlex.shlex(script, posix=True, punctuation_chars=';&')
+        lexer.whitespace_split = True
+        commands = []
+        current = []
+        for token in lexer:
+            if token in (';', '&'):
+                if current:
+                    commands.append((current, token == '&'))
+                current = []
+            else:
+                current.append(token)
+        if current:
+            commands.append((current, False))
+
+        exit_code = 0
+        monitors = []
+        detached = False
+        try:
+            for args, background in commands:
+                args = [str(monitors[-1].pid) if arg == '$!' and monitors else arg for arg in args]
+                monitor = self._parse_monitor(args)
+                if background and monitor is not None:
+                    monitor.pid = next(self._pids)
+                    container.monitors.append(monitor)
+                    monitors.append(monitor)
+                    exit_code = 0
+                elif args == ['wait']:
+                    yield from self._drain_monitors(monitors)
+                    exit_code = 0
+                else:
+                    exit_code = yield from self._run(container, args, errors)
+                for monitor in monitors:
+                    yield from self._flush(monitor)
+        except GeneratorExit:
+            # Closing the stream only stops the docker client: background monitors run until timeout or kill
+            detached = True
+            raise
+        finally:
+            for monitor in monitors:
+                if monitor in container.monitors and not detached:
+                    container.monitors.remove(monitor)
+        return exit_code
+
+    def _kill(self, container: SimulatedContainer, pids: List[str], errors: List[str]) -> int:
+        """
+        Stops the background monitors *pids*
+        """
+        exit_code = 0
+        for pid in pids:
+            monitors = [monitor for monitor in container.monitors if str(monitor.pid) == pid]
+            if not monitors:
+                errors.append('sh: kill: No such process\n')
+                exit_code = 1
+            for monitor in monitors:
+                monitor.until = self.now
+                container.monitors.remove(monitor)
+        return exit_code
+
+    # busctl
+
+    def _parse_monitor(self, args: List[str]) -> Optional[Monitor]:
+        """
+        :return: subscription of ['timeout', '10', 'busctl', 'monitor', '--match', "...path='...'..."], None if
+                 *args* is not a busctl monitor command
+        """
+        until = None
+        if args[:1] == ['timeout'] and len(args) > 2:
+            until = self.now + float(args[1])
+            args = args[2:]
+        if args[:2] != ['busctl', 'monitor']:
+            return None
+        path = None
+        if '--match' in args[2:-1]:
+            match = re.search(r"path='([^']*)'", args[args.index('--match') + 1])
+            path = match.group(1) if match else None
+        return Monitor(path, until)
+
+    def _flush(self, monitor: Monitor) -> Iterator[str]:
+        lines, monitor.lines = monitor.lines, []
+        yield from lines
+
+    def _drain_monitors(self, monitors: List[Monitor]) -> Iterator[str]:
+        """
+        Yields the signals received by *monitors* until they all time out
+        """
+        while True:
+            for monitor in monitors:
+                yield from self._flush(monitor)
+            running = [monitor for monitor in monitors if monitor.until is None or monitor.until > self.now]
+            if not running:
+                return
+            deadlines = [monitor.until for monitor in running if monitor.until is not None]
+            targets = [target for target in (self._next_timer(), min(deadlines) if deadlines else None)
+                       if target is not None]
+            if not targets:
+                return
+            self._advance_to(min(targets))
+
+    def _follow_monitor(self, container: SimulatedContainer, monitor: Monitor) -> Generator[str, None, int]:
+        container.monitors.append(monitor)
+        try:
+            yield from self._drain_monitors([monitor])
+        finally:
+            if monitor in container.monitors:
+                container.monitors.remove(monitor)
+        return 124 if monitor.until is not None else 0
+
+    def _busctl_get_property(self, container: SimulatedContainer, args: List[str],
+                             errors: List[str]) -> Generator[str, None, int]:
+        if len(args) < 4:
+            errors.append('Expects at least four arguments.\n')
+            return 1
+        unit_object, busctl_properties = args[1], args[3:]
+        units = [unit for unit in container.units if Systemd._unit_object(unit) == unit_object]
+        if not units:
+            errors.append('Failed to get property {property} on interface {interface}: Unknown object {object}.\n'
+                          .format(property=busctl_properties[0], interface=args[2], object=unit_object))
+            return 1
+        for busctl_property in busctl_properties:
+            if busctl_property not in SIGNATURES:
+                errors.append('Failed to get property {}: Unknown property.\n'.format(busctl_property))
+                return 1
+            yield busctl_value(SIGNATURES[busctl_property], container.units[units[0]][busctl_property]) + '\n'
+        return 0
+
+    def _properties_changed(self, unit_object: str, properties: Dict[str, object]) -> List[str]:
+        """
+        :return: lines printed by 'busctl monitor' for a PropertiesChanged signal
+        """
+        lines = ['‣ Type=signal  Endian=l  Flags=1  Version=1  Priority=0 Cookie={}\n'.format(next(self._cookies)),
+                 '  Sender=:1.0  Path={}  Interface=org.freedesktop.DBus.Properties  '
+                 'Member=PropertiesChanged\n'.format(unit_object),
+                 '  MESSAGE "sa{sv}as" {\n',
+                 '          STRING "org.freedesktop.systemd1.Unit";\n',
+                 '          ARRAY "{sv}" {\n']
+        for key, value in sorted(properties.items()):
+            lines += ['                  DICT_ENTRY "sv" {\n',
+                      '                          STRING "{}";\n'.format(key),
+                      '                          VARIANT "{}" {{\n'.format(SIGNATURES[key]),
+                      '                                  {};\n'.format(monitor_value(SIGNATURES[key], value)),
+                      '                          };\n',
+                      '                  };\n']
+        return lines + ['          };\n', '          ARRAY "s" {\n', '          };\n', '  };\n', '\n']
+
+    # systemd and monit
+
+    def _set_unit(self, container: SimulatedContainer, unit: str, active_state: str, sub_state: str) -> None:
+        changed = {'ActiveState': active_state, 'SubState': sub_state}
+        timestamp = int(round(self.now * 1000000))
+        if active_state == 'active':
+            changed['ActiveEnterTimestamp'] = timestamp
+        elif active_state in ('inactive', 'failed'):
+            changed['InactiveEnterTimestamp'] = timestamp
+        container.units[unit].update(changed)
+        unit_object = Systemd._unit_object(unit)
+        container.monitors = [monitor for monitor in container.monitors
+                              if monitor.until is None or monitor.until > self.now]
+        for monitor in container.monitors:
+            if monitor.path in (None, unit_object):
+                monitor.lines += self._properties_changed(unit_object, changed)
+
+    def _start_unit(self, container: SimulatedContainer, unit: str) -> None:
+        self._set_unit(container, unit, 'activating', 'start')
+        boot = container.boot
+        job = container.jobs[unit] = container.jobs.get(unit, 0) + 1
+
+        def activate() -> None:
+            if container.boot != boot or container.status != 'running' or container.jobs[unit] != job:
+                return
+            self._set_unit(container, unit, 'active', 'running')
+            self._log(container, 'systemd', 'Started {}.'.format(unit), unit=unit)
+            if unit == 'monit.service':
+                self._start_monit(container)
+
+        self._schedule(UNITS[unit]['start_delay'], activate)
+
+    def _stop_unit(self, container: SimulatedContainer, unit: str) -> None:
+        container.jobs[unit] = container.jobs.get(unit, 0) + 1
+        self._set_unit(container, unit, 'inactive', 'dead')
+        self._log(container, 'systemd', 'Stopped {}.'.format(unit), unit=unit)
+
+    def _kill_unit(self, container: SimulatedContainer, unit: str) -> None:
+        self._stop_unit(container, unit)
+        if UNITS[unit]['restart']:
+            boot = container.boot
+            job = container.jobs[unit]
+
+            def restart() -> None:
+                if container.boot == boot and container.status == 'running' and container.jobs[unit] == job:
+                    self._start_unit(container, unit)
+
+            self._schedule(self.RESTART_SEC, restart)
+
+    def _systemctl(self, container: SimulatedContainer, command: str, unit: str, errors: List[str]) -> int:
+        unit = unit if '.' in unit else '{}.service'.format(unit)
+        if unit not in container.units:
+            errors.append('Unit {} not found.\n'.format(unit))
+            return 5
+        active_state = container.units[unit]['ActiveState']
+        if command == 'start':
+            if active_state not in ('active', 'activating'):
+                self._start_unit(container, unit)
+        elif command == 'stop':
+            self._stop_unit(container, unit)
+        elif command == 'restart':
+            self._stop_unit(container, unit)
+            self._start_unit(container, unit)
+        elif command == 'kill':
+            if active_state in ('active', 'activating'):
+                self._kill_unit(container, unit)
+        elif command == 'is-active':
+            return 0 if active_state == 'active' else 3
+        else:
+            errors.append('Unknown operation {}.\n'.format(command))
+            return 1
+        return 0
+
+    def _start_monit(self, container: SimulatedContainer) -> None:
+        container.monit_generation += 1
+        generation = container.monit_generation
+
+        def cycle() -> None:
+            if container.monit_generation != generation or container.status != 'running' or \
+                    container.units['monit.service']['ActiveState'] != 'active':
+                return
+            for unit, description in UNITS.items():
+                if description['monit'] is None or container.units[unit]['ActiveState'] in ('active', 'activating'):
+                    continue
+                self._log(container, 'monit', "'{}' process is not running".format(description['monit']),
+                          priority=PRIORITIES['err'], unit='monit.service')
+                self._log(container, 'monit', "'{}' trying to restart".format(description['monit']),
+                          unit='monit.service')
+                self._start_unit(container, unit)
+            self._schedule(self.MONIT_CYCLE, cycle)
+
+        self._schedule(self.MONIT_CYCLE, cycle)
+
+    # journald
+
+    def _log(self, container: SimulatedContainer, identifier: str, message: str, priority: int = PRIORITIES['info'],
+             unit: str = None) -> None:
+        record = {'__CURSOR': 's={boot};i={index:x}'.format(boot=container.boot_id, index=len(container.journal) + 1),
+                  '__REALTIME_TIMESTAMP': str(int(round(self.now * 1000000))), '_BOOT_ID': container.boot_id,
+                  '_HOSTNAME': container.id[:12], 'PRIORITY': str(priority), 'SYSLOG_IDENTIFIER': identifier,
+                  'MESSAGE': message}
+        if identifier == 'systemd':
+            record.update({'_SYSTEMD_UNIT': 'init.scope', 'UNIT': unit})
+        else:
+            record['_SYSTEMD_UNIT'] = unit
+        container.journal.append(record)
+
+    def _journalctl(self, container: SimulatedContainer, args: List[str],
+                    errors: List[str]) -> Generator[str, None, int]:
+        units = []
+        priority = PRIORITIES['debug']
+        output = 'short'
+        fields = None
+        after = 0
+        since = 0
+        current_boot = follow = False
+        arguments = iter(args)
+        try:
+            for argument in arguments:
+                if argument == '-o':
+                    output = next(arguments)
+                elif argument == '-u':
+                    unit = next(arguments)
+                    units.append(unit if '.' in unit else '{}.service'.format(unit))
+                elif argument == '-p':
+                    value = next(arguments)
+                    priority = int(value) if value.isdigit() else PRIORITIES[value]
+                elif argument == '-b':
+                    current_boot = True
+                elif argument == '-f':
+                    follow = True
+                elif argument.startswith('--output-fields='):
+                    fields = argument.partition('=')[2].split(',')
+                elif argument == '--after-cursor':
+                    after = int(next(arguments).rpartition('i=')[2], 16)
+                elif argument == '--since':
+                    value = next(arguments)
+                    date_format = '%Y-%m-%d %H:%M:%S' if ':' in value else '%Y-%m-%d'
+                    since = datetime.datetime.strptime(value, date_format).replace(
+                        tzinfo=datetime.timezone.utc).timestamp()
+                elif argument not in ('--no-pager', '--no-tail'):
+                    raise ValueError(argument)
+        except (StopIteration, KeyError, ValueError) as e:
+            errors.append('journalctl: invalid arguments: {}\n'.format(e))
+            return 1
+        if output not in ('short', 'json'):
+            errors.append('Unknown output format {}.\n'.format(output))
+            return 1
+
+        def selected(record: dict) -> bool:
+            return (not units or record.get('_SYSTEMD_UNIT') in units or record.get('UNIT') in units) and \
+                int(record['PRIORITY']) <= priority and \
+                (not current_boot or record['_BOOT_ID'] == container.boot_id) and \
+                int(record['__REALTIME_TIMESTAMP']) >= since * 1000000
+
+        def line(record: dict) -> str:
+            if output == 'json':
+                if fields:
+                    record = {key: value for key, value in record.items()
+                              if key in fields or key in ('__CURSOR', '__REALTIME_TIMESTAMP')}
+                return json.dumps(record) + '\n'
+            date = datetime.datetime.fromtimestamp(int(record['__REALTIME_TIMESTAMP']) / 1000000.0,
+                                                   datetime.timezone.utc)
+            return '{date} {host} {identifier}[1]: {message}\n'.format(
+                date=date.strftime('%b %d %H:%M:%S'), host=record['_HOSTNAME'], identifier=record['SYSLOG_IDENTIFIER'],
+                message=record['MESSAGE'])
+
+        position = after
+        found = False
+        boot = container.boot
+        while True:
+            for record in container.journal[position:]:
+                if selected(record):
+                    found = True
+                    yield line(record)
+            position = len(container.journal)
+            if not follow:
+                break
+            if container.boot != boot or container.status != 'running' or self._next_timer() is None:
+                return 0
+            self._advance_to(self._next_timer())
+        if not found and output == 'short':
+            yield '-- No entries --\n'
+        return 0
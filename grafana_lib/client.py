@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+"""HTTP client of the Grafana API.
+
+A single requests.Session keeps the connections to Grafana alive, retries requests on 5xx answers and connection
+errors (POST requests only when the connection could not be established), and never puts the credentials in URLs.
+"""
+
+import copy
+import requests
+import time
+import urllib.parse
+
+from metrics_lib import instrumentation
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from typing import List, Tuple, Union
+
+DEFAULT_TIMEOUT = (3.05, 30)
+
+
+class GrafanaError(Exception):
+    """
+    Raised when Grafana answers with an error status
+    """
+
+    def __init__(self, response: requests.Response):
+        try:
+            message = response.json().get('message', response.text)
+        except ValueError:
+            message = response.text
+        super().__init__('{method} {url}: {status} {message}'.format(
+            method=response.request.method, url=response.request.path_url, status=response.status_code,
+            message=message))
+        self.response = response
+        self.status_code = response.status_code
+        self.message = message
+
+
+class GrafanaClient:
+    """
+    Client of the Grafana HTTP API
+    """
+
+    def __init__(self, host: str, port: Union[int, str], username: str = None, password: str = None,
+                 scheme: str = 'http', timeout: Tuple[float, float] = DEFAULT_TIMEOUT, retries: int = 3,
+                 backoff_factor: float = 0.2, pool_maxsize: int = 10, org_id: int = None):
+        """
+        :param host: IP/hostname of the Grafana container
+        :param port:
+        :param username: basic authentication, no authentication if None
+        :param password:
+        :param scheme: 'http' or 'https'
+        :param timeout: connect and read timeouts in seconds
+        :param retries: maximum number of retries on connection errors and 5xx answers. POST requests are only
+                        retried when the connection could not be established. Use 0 for requests which must not be
+                        sent twice, such as change_password
+        :param backoff_factor: delay before the n-th retry is backoff_factor * 2^(n-1) seconds
+        :param pool_maxsize: maximum number of connections kept alive
+        :param org_id: organization of the requests, defaults to the current organization of the user
+        """
+        self.base_url = '{scheme}://{host}:{port}'.format(scheme=scheme, host=host, port=port)
+        self.timeout = timeout
+        self.session = requests.Session()
+        if username is not None:
+            self.session.auth = (username, password)
+        self.org_id = org_id
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff_factor,
+                      status_forcelist=(500, 502, 503, 504), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __enter__(self) -> 'GrafanaClient':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.session.close()
+
+    def with_org(self, org_id: int) -> 'GrafanaClient':
+        """
+        :return: client sending its requests to organization *org_id*, sharing the connections of this client
+        """
+        client = copy.copy(self)
+        client.org_id = org_id
+        return client
+
+    def url(self, path: str) -> str:
+        return urllib.parse.urljoin(self.base_url, path)
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Sends a request without checking the status of the answer
+        :param method: HTTP method
+        :param path: e.g. '/api/admin/stats'
+        :param kwargs: arguments of requests.Session.request, e.g. json or params
+        :raise requests.exceptions.RequestException: if Grafana cannot be reached
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        if self.org_id is not None:
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **{'X-Grafana-Org-Id': str(self.org_id)})
+        begin = time.perf_counter()
+        failed = True
+        try:
+            response = self.session.request(method, self.url(path), **kwargs)
+            failed = not response.ok
+            return response
+        finally:
+            instrumentation.record(instrumentation.http_operation(method, path), time.perf_counter() - begin, failed)
+
+    def _call(self, method: str, path: str, **kwargs) -> Union[dict, list]:
+        response = self.request(method, path, **kwargs)
+        if not response.ok:
+            raise GrafanaError(response)
+        return response.json()
+
+    def get(self, path: str, **kwargs) -> Union[dict, list]:
+        """
+        :return: decoded JSON answer
+        :raise GrafanaError: if Grafana answers with an error status
+        """
+        return self._call('GET', path, **kwargs)
+
+    def post(self, path: str, data: dict, **kwargs) -> Union[dict, list]:
+        return self._call('POST', path, json=data, **kwargs)
+
+    def put(self, path: str, data: dict, **kwargs) -> Union[dict, list]:
+        return self._call('PUT', path, json=data, **kwargs)
+
+    def delete(self, path: str, **kwargs) -> Union[dict, list]:
+        return self._call('DELETE', path, **kwargs)
+
+    def change_password(self, old_password: str, new_password: str) -> dict:
+        """
+        Changes the password of the authenticated user. The request is not idempotent: once Grafana applied it, a
+        retry is rejected with 401 as the old password changed. Send it with a client created with retries=0
+        """
+        data = {'oldPassword': old_password,
+                'newPassword': new_password,
+                'confirmNew': new_password}
+        return self.put('/api/user/password', data)
+
+    def get_admin_settings(self) -> dict:
+        return self.get('/api/admin/settings')
+
+    def get_admin_stats(self) -> dict:
+        return self.get('/api/admin/stats')
+
+    def list_datasources(self) -> List[dict]:
+        return self.get('/api/datasources')
+
+    def get_datasource(self, datasource_id: int) -> dict:
+        """
+        :return: full model of the datasource, including the fields missing from list_datasources
+        """
+        return self.get('/api/datasources/{}'.format(datasource_id))
+
+    def create_datasource(self, datasource: dict) -> dict:
+        """
+        :return: e.g. {'id': 1, 'message': 'Datasource added', 'name': 'test_datasource'}
+        """
+        return self.post('/api/datasources', datasource)
+
+    def update_datasource(self, datasource_id: int, datasource: dict) -> dict:
+        return self.put('/api/datasources/{}'.format(datasource_id), datasource)
+
+    def delete_datasource(self, datasource_id: int) -> dict:
+        return self.delete('/api/datasources/{}'.format(datasource_id))
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+
+"""Incremental export/import of the Grafana dashboards.
+
+The backup directory holds a manifest (uid -> version, content hash, folder) and the dashboards stored as
+content-addressed JSON files (objects/<sha256>.json), so unchanged dashboards are never downloaded or written again.
+Each run lists the dashboards with /api/search and reads the last entry of the version history of each one, the
+search results having no version. The versions of the manifest are those of the exported instance: an import
+compares contents instead, and records in imports/<target>.json the version each dashboard has in the target once
+pushed or found identical, so that the next import only reads the dashboards saved in the target since then.
+
+python -m grafana_lib.dashboard_sync export --directory backup --password admin
+python -m grafana_lib.dashboard_sync import --directory backup --password admin
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import requests
+import sys
+import urllib.parse
+
+from grafana_lib.client import GrafanaClient, GrafanaError
+from typing import Dict, List, Optional, Tuple
+
+VERSION = '1.0'
+
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger('grafana_tools.dashboard_sync')
+
+MANIFEST = 'manifest.json'
+OBJECTS = 'objects'
+IMPORTS = 'imports'
+SEARCH_LIMIT = 5000
+
+
+def write_atomically(path: str, data: bytes) -> None:
+    temporary_path = '{}.tmp'.format(path)
+    with open(temporary_path, 'wb') as temporary_file:
+        temporary_file.write(data)
+    os.replace(temporary_path, path)
+
+
+def load_manifest(directory: str, name: str = MANIFEST) -> Dict[str, dict]:
+    try:
+        with open(os.path.join(directory, name)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(directory: str, manifest: Dict[str, dict], name: str = MANIFEST) -> None:
+    path = os.path.join(directory, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomically(path, json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+
+
+def import_state_name(client: GrafanaClient) -> str:
+    """
+    :return: path, relative to the backup directory, of the import state of the instance and organization of *client*
+    """
+    target = urllib.parse.urlsplit(client.base_url).netloc.replace(':', '_')
+    if client.org_id is not None:
+        target = '{}_org{}'.format(target, client.org_id)
+    return os.path.join(IMPORTS, '{}.json'.format(target))
+
+
+def content_digest(dashboard: dict) -> str:
+    """
+    :return: sha256 of the dashboard without the fields set by the instance holding it (id, version)
+    """
+    content = {key: value for key, value in dashboard.items() if key not in ('id', 'version')}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def store_object(directory: str, dashboard: dict) -> str:
+    """
+    Writes *dashboard* in objects/<sha256>.json unless this file already exists
+    :return: sha256 of the canonical JSON of the dashboard
+    """
+    data = json.dumps(dashboard, indent=2, sort_keys=True).encode('utf-8')
+    digest = hashlib.sha256(data).hexdigest()
+    path = os.path.join(directory, OBJECTS, '{}.json'.format(digest))
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomically(path, data)
+    return digest
+
+
+def load_object(directory: str, digest: str) -> dict:
+    with open(os.path.join(directory, OBJECTS, '{}.json'.format(digest))) as object_file:
+        return json.load(object_file)
+
+
+def search_dashboards(client: GrafanaClient, params: dict = None) -> List[dict]:
+    """
+    :param params: filters of the search, e.g. {'folderIds': 3}
+    :return: all dashboards of /api/search, usually with a single call
+    """
+    hits = []
+    page = 1
+    while True:
+        page_hits = client.get('/api/search', params=dict(params or {}, type='dash-db', limit=SEARCH_LIMIT, page=page))
+        hits += page_hits
+        if len(page_hits) < SEARCH_LIMIT:
+            return hits
+        page += 1
+
+
+def dashboard_version(client: GrafanaClient, hit: dict) -> Optional[int]:
+    """
+    :return: current version of the dashboard of the search *hit*. /api/search does not return versions: the last
+             entry of the version history is read, one request per dashboard but much smaller than the dashboard
+    """
+    versions = client.get('/api/dashboards/id/{}/versions'.format(hit['id']), params={'limit': 1})
+    if isinstance(versions, dict):
+        versions = versions.get('versions', [])
+    return versions[0]['version'] if versions else None
+
+
+def export_dashboard(client: GrafanaClient, directory: str, uid: str) -> dict:
+    """
+    Downloads one dashboard
+    :return: manifest entry
+    """
+    answer = client.get('/api/dashboards/uid/{}'.format(uid))
+    dashboard = answer['dashboard']
+    meta = answer.get('meta', {})
+    dashboard.pop('id', None)
+    return {'version': dashboard.get('version', meta.get('version')),
+            'sha256': store_object(directory, dashboard),
+            'title': dashboard.get('title'),
+            'folderUid': meta.get('folderUid')}
+
+
+def export_dashboards(client: GrafanaClient, directory: str, workers: int = 8) -> Dict[str, list]:
+    """
+    Downloads the dashboards whose version differs from the manifest
+    :return: uids of the exported, unchanged and removed dashboards
+    """
+    manifest = load_manifest(directory)
+    hits = {hit['uid']: hit for hit in search_dashboards(client)}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        versions = dict(zip(hits, executor.map(lambda hit: dashboard_version(client, hit), hits.values())))
+        changed = [uid for uid in hits if versions[uid] is None or uid not in manifest or
+                   manifest[uid].get('version') != versions[uid]]
+        entries = dict(zip(changed, executor.map(lambda uid: export_dashboard(client, directory, uid), changed)))
+    removed = [uid for uid in manifest if uid not in hits]
+    for uid in removed:
+        del manifest[uid]
+    manifest.update(entries)
+    if changed or removed:
+        save_manifest(directory, manifest)
+    return {'exported': changed, 'unchanged': [uid for uid in hits if uid not in entries], 'removed': removed}
+
+
+def import_dashboard(client: GrafanaClient, directory: str, uid: str, entry: dict,
+                     present: bool) -> Tuple[bool, Optional[int]]:
+    """
+    Pushes one dashboard of the manifest unless the target already holds the same content
+    :param present: whether the dashboard exists in the target
+    :return: whether the dashboard was pushed, its version in the target (None if it was not pushed)
+    """
+    dashboard = load_object(directory, entry['sha256'])
+    if present:
+        current = client.get('/api/dashboards/uid/{}'.format(uid))['dashboard']
+        if content_digest(current) == content_digest(dashboard):
+            return False, None
+    dashboard['id'] = None
+    data = {'dashboard': dashboard, 'overwrite': True}
+    # Folder ids are specific to each instance: the folder is found in the target by its uid, General otherwise
+    if entry.get('folderUid'):
+        data['folderUid'] = entry['folderUid']
+    return True, client.post('/api/dashboards/db', data).get('version')
+
+
+def import_dashboards(client: GrafanaClient, directory: str, workers: int = 8) -> Dict[str, list]:
+    """
+    Pushes the dashboards of the manifest which are missing in Grafana or whose content differs. Dashboards whose
+    version in Grafana is the one recorded by the previous import of the same object are not read. A dashboard which
+    cannot be imported is reported as failed, the import state of the others is still saved
+    :return: uids of the imported, unchanged and failed dashboards
+    """
+    manifest = load_manifest(directory)
+    state_name = import_state_name(client)
+    state = load_manifest(directory, state_name)
+    hits = {hit['uid']: hit for hit in search_dashboards(client)}
+
+    def import_one(uid: str) -> Tuple[str, Optional[int]]:
+        expected = {'sha256': manifest[uid]['sha256']}
+        try:
+            version = dashboard_version(client, hits[uid]) if uid in hits else None
+            if version is not None and state.get(uid) == dict(expected, version=version):
+                return 'unchanged', version
+            pushed, pushed_version = import_dashboard(client, directory, uid, manifest[uid], uid in hits)
+        except (GrafanaError, requests.exceptions.RequestException, OSError, ValueError) as e:
+            logger.error('Failed to import dashboard {uid}: {error}'.format(uid=uid, error=e))
+            return 'failed', None
+        return ('imported', pushed_version) if pushed else ('unchanged', version)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        results = dict(zip(manifest, executor.map(import_one, manifest)))
+    new_state = {uid: entry for uid, entry in state.items() if uid in manifest}
+    for uid, (status, version) in results.items():
+        if status != 'failed':
+            new_state[uid] = {'sha256': manifest[uid]['sha256'], 'version': version}
+    if new_state != state:
+        save_manifest(directory, new_state, state_name)
+    return {status: [uid for uid, (result, _) in results.items() if result == status]
+            for status in ('imported', 'unchanged', 'failed')}
+
+
+def main():
+    prog_name = sys.argv[0]
+    usage = """{} export|import [options]
+    """.format(prog_name)
+    parser = argparse.ArgumentParser(prog="{pn} {v}".format(pn=prog_name, v=VERSION), usage=usage)
+    parser.add_argument('command', choices=['export', 'import'], help='Direction of the synchronization')
+    parser.add_argument('--directory', type=str, required=True, dest='directory', help='Backup directory')
+    parser.add_argument('--host', type=str, default='127.0.0.1', dest='host',
+                        help='IP/hostname of the Grafana container, defaults to 127.0.0.1')
+    parser.add_argument('--password', type=str, required=True, dest='password', metavar='pwd', help='Password')
+    parser.add_argument('--port', type=int, default=80, dest='port', help='Connection port, defaults to 80')
+    parser.add_argument('--user', type=str, default='admin', dest='user', help='User, defaults to admin')
+    parser.add_argument('--workers', type=int, default=8, dest='workers',
+                        help='Number of concurrent requests, defaults to 8')
+    args = parser.parse_args()
+    logger.setLevel(logging.INFO)
+
+    os.makedirs(args.directory, exist_ok=True)
+    with GrafanaClient(args.host, args.port, args.user, args.password, pool_maxsize=args.workers) as client:
+        try:
+            if args.command == 'export':
+                report = export_dashboards(client, args.directory, args.workers)
+            else:
+                report = import_dashboards(client, args.directory, args.workers)
+        except (GrafanaError, requests.exceptions.RequestException, OSError) as e:
+            logger.error('Dashboard {command} failed: {error}'.format(command=args.command, error=e))
+            sys.exit(1)
+    print(json.dumps({key: len(value) for key, value in report.items()}))
+    sys.exit(1 if report.get('failed') else 0)
+
+
+if __name__ == "__main__":
+    main()
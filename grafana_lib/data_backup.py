@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+"""Streaming backup and restore of the Grafana data directory of a container (grafana.db, plugins).
+
+The tar archive of the directory is read from the container ('docker cp container:/var/lib/grafana -' or the
+archive endpoint of the Engine API) and cut into fixed-size chunks, so that memory use does not depend on the size
+of the volume. Each backup is either:
+- a gzip archive (--archive), restorable by tar as well;
+- a manifest listing the chunks of the archive, each chunk being compressed and stored once under its sha256
+  (--store). Chunks unchanged since a previous backup of the store are not written again.
+
+python -m grafana_lib.data_backup backup --container grafana-1 --archive grafana-1.tar.gz
+python -m grafana_lib.data_backup backup --container grafana-1 --store backups
+python -m grafana_lib.data_backup restore --container grafana-1 --store backups
+"""
+
+import argparse
+import contextlib
+import gzip
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import sys
+import time
+import zlib
+
+from docker_lib.backends import DockerError, get_backend, set_backend
+from typing import Iterable, Iterator, List, Tuple
+
+VERSION = '1.0'
+
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger('grafana_tools.data_backup')
+
+GRAFANA_DATA = '/var/lib/grafana'
+CHUNK_SIZE = 4 * 1024 * 1024
+BACKUPS = 'backups'
+CHUNKS = 'chunks'
+# wbits of zlib for a gzip container
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def fixed_chunks(stream: Iterable[bytes], chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Cuts *stream* into chunks of *chunk_size* bytes, the last one being shorter
+    """
+    buffer = bytearray()
+    for data in stream:
+        buffer += data
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def read_chunks(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    with open(path, 'rb') as input_file:
+        yield from iter(lambda: input_file.read(chunk_size), b'')
+
+
+def decompress(stream: Iterable[bytes], chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Yields the decompressed content of the gzip stream, *chunk_size* bytes at most at a time
+    """
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    for data in stream:
+        while data:
+            output = decompressor.decompress(data, chunk_size)
+            if output:
+                yield output
+            data = decompressor.unconsumed_tail
+    output = decompressor.flush()
+    if output:
+        yield output
+
+
+def backup_to_archive(container_name: str, archive_path: str, path: str = GRAFANA_DATA,
+                      chunk_size: int = CHUNK_SIZE, level: int = 6) -> dict:
+    """
+    Streams the tar archive of *path* through gzip into *archive_path*, which is only replaced once complete
+    :return: e.g. {'size': 104857600, 'compressed': 20971520}
+    :raise DockerError: if *path* cannot be read
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    size = compressed = 0
+    temporary_path = '{}.tmp'.format(archive_path)
+    try:
+        with open(temporary_path, 'wb') as archive_file, \
+                contextlib.closing(get_backend().get_archive(container_name, path)) as stream:
+            for chunk in fixed_chunks(stream, chunk_size):
+                size += len(chunk)
+                output = compressor.compress(chunk)
+                compressed += len(output)
+                archive_file.write(output)
+            output = compressor.flush()
+            compressed += len(output)
+            archive_file.write(output)
+        os.replace(temporary_path, archive_path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+    return {'size': size, 'compressed': compressed}
+
+
+def restore_from_archive(container_name: str, archive_path: str, path: str = GRAFANA_DATA,
+                         chunk_size: int = CHUNK_SIZE) -> None:
+    """
+    Streams the gzip archive written by backup_to_archive back into the container
+    :raise DockerError: if the archive cannot be extracted
+    """
+    get_backend().put_archive(container_name, posixpath.dirname(path.rstrip('/')),
+                              decompress(read_chunks(archive_path, chunk_size), chunk_size))
+
+
+def chunk_path(store: str, digest: str) -> str:
+    return os.path.join(store, CHUNKS, '{}.gz'.format(digest))
+
+
+def store_chunk(store: str, chunk: bytes, level: int = 6) -> Tuple[str, int]:
+    """
+    Writes the compressed *chunk* in chunks/<sha256>.gz unless this file already exists
+    :return: sha256 of the chunk, number of bytes written
+    """
+    digest = hashlib.sha256(chunk).hexdigest()
+    path = chunk_path(store, digest)
+    if os.path.exists(path):
+        return digest, 0
+    data = gzip.compress(chunk, level, mtime=0)
+    temporary_path = '{}.tmp'.format(path)
+    with open(temporary_path, 'wb') as chunk_file:
+        chunk_file.write(data)
+    os.replace(temporary_path, path)
+    return digest, len(data)
+
+
+def load_chunks(store: str, digests: List[str]) -> Iterator[bytes]:
+    """
+    Yields the stored chunks *digests*
+    :raise ValueError: if a chunk is corrupted
+    """
+    for digest in digests:
+        with open(chunk_path(store, digest), 'rb') as chunk_file:
+            chunk = gzip.decompress(chunk_file.read())
+        if hashlib.sha256(chunk).hexdigest() != digest:
+            raise ValueError('Chunk {} is corrupted'.format(digest))
+        yield chunk
+
+
+def list_backups(store: str) -> List[str]:
+    """
+    :return: names of the backups of the store, oldest first
+    """
+    try:
+        return sorted(name[:-len('.json')] for name in os.listdir(os.path.join(store, BACKUPS))
+                      if name.endswith('.json'))
+    except FileNotFoundError:
+        return []
+
+
+def load_backup(store: str, name: str) -> dict:
+    with open(os.path.join(store, BACKUPS, '{}.json'.format(name))) as manifest_file:
+        return json.load(manifest_file)
+
+
+def backup_to_store(container_name: str, store: str, name: str = None, path: str = GRAFANA_DATA,
+                    chunk_size: int = CHUNK_SIZE, level: int = 6) -> dict:
+    """
+    Stores the new chunks of the tar archive of *path* and writes the manifest backups/<name>.json
+    :param name: name of the backup, defaults to the current UTC date
+    :return: e.g. {'name': '20181017T120000Z', 'size': 104857600, 'chunks': 25, 'stored_chunks': 1,
+             'stored_bytes': 1048576}
+    :raise DockerError: if *path* cannot be read
+    """
+    name = name or time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(get_backend().time()))
+    os.makedirs(os.path.join(store, CHUNKS), exist_ok=True)
+    os.makedirs(os.path.join(store, BACKUPS), exist_ok=True)
+    digests = []
+    size = stored_chunks = stored_bytes = 0
+    with contextlib.closing(get_backend().get_archive(container_name, path)) as stream:
+        for chunk in fixed_chunks(stream, chunk_size):
+            digest, written = store_chunk(store, chunk, level)
+            digests.append(digest)
+            size += len(chunk)
+            stored_chunks += written > 0
+            stored_bytes += written
+    manifest = {'container': container_name, 'path': path, 'chunk_size': chunk_size, 'size': size,
+                'chunks': digests}
+    manifest_path = os.path.join(store, BACKUPS, '{}.json'.format(name))
+    with open('{}.tmp'.format(manifest_path), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace('{}.tmp'.format(manifest_path), manifest_path)
+    return {'name': name, 'size': size, 'chunks': len(digests), 'stored_chunks': stored_chunks,
+            'stored_bytes': stored_bytes}
+
+
+def restore_from_store(container_name: str, store: str, name: str = None) -> dict:
+    """
+    Streams the chunks of backup *name* into the container
+    :param name: defaults to the last backup of the store
+    :return: manifest of the restored backup
+    :raise DockerError: if the archive cannot be extracted
+    :raise ValueError: if the store has no backup or a chunk is corrupted
+    """
+    if name is None:
+        names = list_backups(store)
+        if not names:
+            raise ValueError('No backup in {}'.format(store))
+        name = names[-1]
+    manifest = load_backup(store, name)
+    get_backend().put_archive(container_name, posixpath.dirname(manifest['path'].rstrip('/')),
+                              load_chunks(store, manifest['chunks']))
+    return dict(manifest, name=name)
+
+
+def main():
+    prog_name = sys.argv[0]
+    usage = """{} backup|restore [options]
+    """.format(prog_name)
+    parser = argparse.ArgumentParser(prog="{pn} {v}".format(pn=prog_name, v=VERSION), usage=usage)
+    parser.add_argument('command', choices=['backup', 'restore'], help='Direction of the copy')
+    parser.add_argument('--archive', type=str, dest='archive', metavar='file', help='gzip archive of the backup')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE // (1024 * 1024), dest='chunk_size',
+                        metavar='MiB', help='Size of the chunks, defaults to {}'.format(CHUNK_SIZE // (1024 * 1024)))
+    parser.add_argument('--container', type=str, required=True, dest='container', help='Name of the container')
+    parser.add_argument('--level', type=int, default=6, dest='level', help='Compression level, defaults to 6')
+    parser.add_argument('--name', type=str, dest='name',
+                        help='Name of the backup in the store, defaults to the date for a backup and to the last '
+                             'backup for a restore')
+    parser.add_argument('--path', type=str, default=GRAFANA_DATA, dest='path',
+                        help='Directory of the container, defaults to {}'.format(GRAFANA_DATA))
+    parser.add_argument('--simulate', action='store_true', dest='simulate',
+                        help='Runs against a simulated container instead of the docker daemon')
+    parser.add_argument('--store', type=str, dest='store', metavar='directory',
+                        help='Directory of deduplicated chunks and manifests')
+    args = parser.parse_args()
+    logger.setLevel(logging.INFO)
+
+    if (args.archive is None) == (args.store is None):
+        parser.error('Either --archive or --store is required')
+    if args.chunk_size < 1:
+        parser.error('--chunk-size must be at least 1')
+    if args.simulate:
+        # Only loaded when asked for: the simulator is not needed against the docker daemon
+        from docker_lib.simulated_backend import SimulatedBackend
+        set_backend(SimulatedBackend([args.container]))
+    chunk_size = args.chunk_size * 1024 * 1024
+    try:
+        if args.command == 'backup' and args.archive:
+            report = backup_to_archive(args.container, args.archive, args.path, chunk_size, args.level)
+        elif args.command == 'backup':
+            report = backup_to_store(args.container, args.store, args.name, args.path, chunk_size, args.level)
+        elif args.archive:
+            restore_from_archive(args.container, args.archive, args.path, chunk_size)
+            report = {'restored': args.archive}
+        else:
+            manifest = restore_from_store(args.container, args.store, args.name)
+            report = {'restored': manifest['name'], 'size': manifest['size']}
+    except (DockerError, OSError, ValueError, zlib.error) as e:
+        logger.error('{command} failed: {error}'.format(command=args.command.capitalize(), error=e))
+        sys.exit(1)
+    print(json.dumps(report, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+"""Declarative synchronization of the Grafana datasources.
+
+The current datasources of each organization are read with a single listing call and compared with the desired
+state. The listing lacks some fields (basicAuthUser, withCredentials, version...): a datasource differing from its
+listing entry is read in full, compared again and, if it still differs, updated from its full model since an update
+replaces the whole datasource. Only the datasources which differ are created, updated or deleted.
+
+Desired state file: either a list of datasources (current organization of the user) or
+{"orgs": [{"orgId": 1, "datasources": [...]}, ...]}
+Desired fields missing from GET /api/datasources cost one more read of the datasource on each run.
+
+python -m grafana_lib.datasource_sync --config datasources.json --password admin --dry-run
+"""
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import requests
+import sys
+
+from grafana_lib.client import GrafanaClient, GrafanaError
+from typing import Callable, Dict, List, Optional
+
+VERSION = '1.0'
+
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger('grafana_tools.datasource_sync')
+
+# Write-only fields: Grafana never returns them, they cannot be compared
+SECURE_FIELDS = ('password', 'basicAuthPassword', 'secureJsonData')
+
+
+class Action:
+    """
+    Write needed to bring one datasource to its desired state
+    """
+
+    __slots__ = ('kind', 'org_id', 'name', 'datasource_id', 'datasource', 'changes')
+
+    def __init__(self, kind: str, org_id: Optional[int], name: str, datasource_id: int = None,
+                 datasource: dict = None, changes: List[str] = None):
+        """
+        :param kind: 'create', 'update' or 'delete'
+        :param org_id: organization, None for the current organization of the user
+        :param name: name of the datasource
+        :param datasource_id: id of the existing datasource (update, delete)
+        :param datasource: body of the request (create, update)
+        :param changes: fields which differ (update)
+        """
+        self.kind = kind
+        self.org_id = org_id
+        self.name = name
+        self.datasource_id = datasource_id
+        self.datasource = datasource
+        self.changes = changes or []
+
+    def __str__(self) -> str:
+        org = 'current org' if self.org_id is None else 'org {}'.format(self.org_id)
+        details = ' ({})'.format(', '.join(self.changes)) if self.changes else ''
+        return '{org}: {kind} {name}{details}'.format(org=org, kind=self.kind, name=self.name, details=details)
+
+
+def diff_fields(desired, current, prefix: str = '') -> List[str]:
+    """
+    :return: fields of *desired* whose value differs in *current*. Nested objects (e.g. jsonData) are compared key
+             by key, so that the defaults added by Grafana do not count as differences
+    """
+    if isinstance(desired, dict) and isinstance(current, dict):
+        changes = []
+        for key, value in sorted(desired.items()):
+            if not prefix and key in SECURE_FIELDS:
+                continue
+            changes += diff_fields(value, current.get(key), '{}{}.'.format(prefix, key))
+        return changes
+    return [] if desired == current else [prefix[:-1]]
+
+
+def index_datasources(datasources: List[dict]) -> Dict[str, dict]:
+    """
+    :return: datasources indexed by 'uid:<uid>' and by 'name:<name>'
+    """
+    index = {}
+    for datasource in datasources:
+        if datasource.get('uid'):
+            index['uid:{}'.format(datasource['uid'])] = datasource
+        index['name:{}'.format(datasource['name'])] = datasource
+    return index
+
+
+def plan(org_id: Optional[int], desired: List[dict], current: List[dict], prune: bool = False,
+         get_datasource: Callable[[dict], dict] = None) -> List[Action]:
+    """
+    Computes the minimal list of writes bringing *current* to *desired*
+    :param org_id: organization of the datasources
+    :param desired: desired datasources, matched with the current ones by uid if they have one, by name otherwise
+    :param current: answer of GET /api/datasources
+    :param prune: delete the current datasources which are not desired
+    :param get_datasource: returns the full model of a datasource of *current*, read when its listing entry differs
+                           from the desired state. Without it, updates are built from the listing entries
+    """
+    index = index_datasources(current)
+    actions = []
+    matched = set()
+    for datasource in desired:
+        existing = None
+        if datasource.get('uid'):
+            existing = index.get('uid:{}'.format(datasource['uid']))
+        if existing is None:
+            # Also matches a datasource created without uid
+            existing = index.get('name:{}'.format(datasource['name']))
+        if existing is None:
+            actions.append(Action('create', org_id, datasource['name'], datasource=datasource))
+            continue
+        matched.add(existing['id'])
+        changes = diff_fields(datasource, existing)
+        if changes and get_datasource is not None:
+            existing = get_datasource(existing)
+            changes = diff_fields(datasource, existing)
+        if changes:
+            body = dict(existing, **datasource)
+            if isinstance(existing.get('jsonData'), dict) and isinstance(datasource.get('jsonData'), dict):
+                body['jsonData'] = dict(existing['jsonData'], **datasource['jsonData'])
+            actions.append(Action('update', org_id, datasource['name'], existing['id'], body, changes))
+    if prune:
+        actions += [Action('delete', org_id, datasource['name'], datasource['id'])
+                    for datasource in current if datasource['id'] not in matched]
+    return actions
+
+
+def apply(client: GrafanaClient, action: Action) -> dict:
+    """
+    Sends the write of *action*
+    :return: outcome, e.g. {'action': 'org 1: create graphite', 'status': 'done'}
+    """
+    org_client = client.with_org(action.org_id) if action.org_id is not None else client
+    try:
+        if action.kind == 'create':
+            org_client.create_datasource(action.datasource)
+        elif action.kind == 'update':
+            org_client.update_datasource(action.datasource_id, action.datasource)
+        else:
+            org_client.delete_datasource(action.datasource_id)
+    except (GrafanaError, requests.exceptions.RequestException) as e:
+        return {'action': str(action), 'status': 'failed', 'error': str(e)}
+    return {'action': str(action), 'status': 'done'}
+
+
+def load_desired_state(path: str) -> Dict[Optional[int], List[dict]]:
+    """
+    :return: desired datasources of each organization, None being the current organization of the user
+    """
+    with open(path) as desired_file:
+        desired = json.load(desired_file)
+    if isinstance(desired, list):
+        return {None: desired}
+    return {org['orgId']: org.get('datasources', []) for org in desired['orgs']}
+
+
+def sync(client: GrafanaClient, desired: Dict[Optional[int], List[dict]], prune: bool = False,
+         dry_run: bool = False, workers: int = 8) -> Dict[str, list]:
+    """
+    Synchronizes the datasources of all organizations of *desired*: one listing call per organization, one read of
+    each datasource whose listing entry differs, then only the needed writes, *workers* at a time
+    :return: {'plan': [...], 'results': [...]}, results being empty in dry run mode
+    """
+    def org_plan(org_id: Optional[int]) -> List[Action]:
+        org_client = client.with_org(org_id) if org_id is not None else client
+        return plan(org_id, desired[org_id], org_client.list_datasources(), prune,
+                    lambda datasource: org_client.get_datasource(datasource['id']))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        actions = [action for org_actions in executor.map(org_plan, desired) for action in org_actions]
+        results = [] if dry_run else list(executor.map(lambda action: apply(client, action), actions))
+    return {'plan': [str(action) for action in actions], 'results': results}
+
+
+def main():
+    prog_name = sys.argv[0]
+    usage = """{} [options]
+    """.format(prog_name)
+    parser = argparse.ArgumentParser(prog="{pn} {v}".format(pn=prog_name, v=VERSION), usage=usage)
+    parser.add_argument('--config', type=str, required=True, dest='config', metavar='file',
+                        help='JSON file of the desired datasources')
+    parser.add_argument('--dry-run', action='store_true', dest='dry_run', help='Print the plan without applying it')
+    parser.add_argument('--host', type=str, default='127.0.0.1', dest='host',
+                        help='IP/hostname of the Grafana container, defaults to 127.0.0.1')
+    parser.add_argument('--password', type=str, required=True, dest='password', metavar='pwd', help='Password')
+    parser.add_argument('--port', type=int, default=80, dest='port', help='Connection port, defaults to 80')
+    parser.add_argument('--prune', action='store_true', dest='prune',
+                        help='Delete the datasources which are not in the configuration file')
+    parser.add_argument('--user', type=str, default='admin', dest='user', help='User, defaults to admin')
+    parser.add_argument('--workers', type=int, default=8, dest='workers',
+                        help='Number of concurrent requests, defaults to 8')
+    args = parser.parse_args()
+    logger.setLevel(logging.INFO)
+
+    try:
+        desired = load_desired_state(args.config)
+    except (OSError, ValueError, KeyError) as e:
+        logger.error('Invalid configuration file {file}: {error}'.format(file=args.config, error=e))
+        sys.exit(1)
+
+    with GrafanaClient(args.host, args.port, args.user, args.password, pool_maxsize=args.workers) as client:
+        try:
+            report = sync(client, desired, args.prune, args.dry_run, args.workers)
+        except (GrafanaError, requests.exceptions.RequestException) as e:
+            logger.error('Failed to list the datasources: {error}'.format(error=e))
+            sys.exit(1)
+
+    for action in report['plan']:
+        print(action)
+    if not report['plan']:
+        logger.info('Datasources are up to date')
+    failures = [result for result in report['results'] if result['status'] != 'done']
+    for failure in failures:
+        logger.error('{action} failed: {error}'.format(action=failure['action'], error=failure['error']))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+"""Load generator of the Grafana API.
+
+Sends a weighted mix of GET requests (admin stats, search, datasources, dashboards) at a target rate from a pool of
+threads, and reports the throughput, the error rate and the latency percentiles. With a target rate, latencies are
+measured from the date at which each request was scheduled, so that a slow server delaying the next requests does
+not hide its own slowness (coordinated omission).
+
+python -m grafana_lib.load_test --config tests_config/grafana.json --rate 50 --duration 30 --mix stats=1,search=2
+"""
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import random
+import requests
+import sys
+import threading
+import time
+
+from grafana_lib.client import GrafanaClient, GrafanaError
+from metrics_lib.histogram import Histogram
+from typing import Dict, List, Tuple
+
+VERSION = '1.0'
+
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger('grafana_tools.load_test')
+
+OPERATIONS = {'stats': '/api/admin/stats',
+              'search': '/api/search',
+              'datasources': '/api/datasources',
+              'dashboard': '/api/dashboards/uid/{uid}'}
+
+PERCENTILES = (50, 90, 95, 99, 99.9)
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """
+    :param mix: e.g. 'stats=1,search=2,dashboard=0.5'
+    :return: weight of each operation
+    :raise ValueError: if an operation is unknown
+    """
+    weights = {}
+    for item in mix.split(','):
+        operation, _, weight = item.partition('=')
+        if operation.strip() not in OPERATIONS:
+            raise ValueError('Unknown operation {}, expected one of {}'.format(operation, ', '.join(OPERATIONS)))
+        weights[operation.strip()] = float(weight) if weight else 1.0
+    return weights
+
+
+def load_settings(path: str) -> dict:
+    """
+    :return: host, port and credentials of a Grafana configuration file such as tests_config/grafana.json
+    """
+    with open(path) as settings_file:
+        return json.load(settings_file)
+
+
+def summarize(histogram: Histogram, requests_count: int, errors: int) -> dict:
+    latencies = {key: None if value is None else round(value / 1000.0, 3)
+                 for key, value in histogram.percentiles(PERCENTILES).items()}
+    return {'requests': requests_count,
+            'errors': errors,
+            'error_rate': round(errors / requests_count, 4) if requests_count else 0.0,
+            'latency_ms': dict(latencies, max=None if histogram.max is None else round(histogram.max / 1000.0, 3),
+                               mean=None if histogram.mean is None else round(histogram.mean / 1000.0, 3))}
+
+
+def run_load(client: GrafanaClient, mix: Dict[str, float], rate: float, duration: float, workers: int = 16,
+             seed: int = 0) -> dict:
+    """
+    Sends the requests of *mix* during *duration* seconds
+    :param client:
+    :param mix: weight of each operation of OPERATIONS
+    :param rate: requests per second, 0 to send them as fast as the *workers* can
+    :param duration: seconds
+    :param workers: number of concurrent requests
+    :param seed: seed of the random choice of the operations
+    :return: throughput, errors and latencies, overall and per operation
+    """
+    mix = dict(mix)
+    uids: List[str] = []
+    if 'dashboard' in mix:
+        uids = [hit['uid'] for hit in client.get('/api/search', params={'type': 'dash-db'}) if hit.get('uid')]
+        if not uids:
+            logger.warning('No dashboard found, dashboard requests are skipped')
+            del mix['dashboard']
+    if not mix:
+        raise ValueError('No operation to send')
+
+    operations = sorted(mix)
+    weights = [mix[operation] for operation in operations]
+    choice_random = random.Random(seed)
+    choice_lock = threading.Lock()
+    histograms = {operation: Histogram() for operation in operations}
+    counts = {operation: [0, 0] for operation in operations}
+    counts_lock = threading.Lock()
+
+    def next_request() -> Tuple[str, str]:
+        with choice_lock:
+            operation = choice_random.choices(operations, weights)[0]
+            uid = choice_random.choice(uids) if operation == 'dashboard' else None
+        return operation, OPERATIONS[operation].format(uid=uid)
+
+    def send(operation: str, path: str, scheduled: float) -> None:
+        try:
+            failed = not client.request('GET', path).ok
+        except requests.exceptions.RequestException:
+            failed = True
+        histograms[operation].record_seconds(time.perf_counter() - scheduled)
+        with counts_lock:
+            counts[operation][0] += 1
+            counts[operation][1] += failed
+
+    begin = time.perf_counter()
+    deadline = begin + duration
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        if rate > 0:
+            # Open loop: request i is due at begin + i / rate whatever the answers of the previous ones
+            for index in range(int(rate * duration)):
+                scheduled = begin + index / rate
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(send, *next_request(), scheduled)
+        else:
+            def loop() -> None:
+                while time.perf_counter() < deadline:
+                    send(*next_request(), time.perf_counter())
+
+            for _ in range(workers):
+                executor.submit(loop)
+    elapsed = time.perf_counter() - begin
+
+    overall = Histogram()
+    for histogram in histograms.values():
+        overall.merge(histogram)
+    total_requests = sum(count[0] for count in counts.values())
+    report = summarize(overall, total_requests, sum(count[1] for count in counts.values()))
+    report.update({'duration_s': round(elapsed, 3),
+                   'throughput_rps': round(total_requests / elapsed, 3) if elapsed else 0.0,
+                   'operations': {operation: summarize(histograms[operation], *counts[operation])
+                                  for operation in operations}})
+    return report
+
+
+def main():
+    prog_name = sys.argv[0]
+    usage = """{} [options]
+    """.format(prog_name)
+    parser = argparse.ArgumentParser(prog="{pn} {v}".format(pn=prog_name, v=VERSION), usage=usage)
+    parser.add_argument('--config', type=str, default='tests_config/grafana.json', dest='config', metavar='file',
+                        help='Grafana configuration file (host, port, default_user, default_password), '
+                             'defaults to tests_config/grafana.json')
+    parser.add_argument('--duration', type=float, default=30, dest='duration',
+                        help='Duration of the test in seconds, defaults to 30')
+    parser.add_argument('--host', type=str, dest='host', help='Overrides the host of the configuration file')
+    parser.add_argument('--max-error-rate', type=float, dest='max_error_rate',
+                        help='Exits with 1 if the error rate is higher, e.g. 0.01')
+    parser.add_argument('--max-p99', type=float, dest='max_p99', metavar='ms',
+                        help='Exits with 1 if the 99th percentile of the latencies is higher')
+    parser.add_argument('--mix', type=str, default='stats=1,search=1,datasources=1,dashboard=1', dest='mix',
+                        help='Weight of each operation among {}, defaults to equal weights'.format(
+                            ', '.join(OPERATIONS)))
+    parser.add_argument('--port', type=int, dest='port', help='Overrides the port of the configuration file')
+    parser.add_argument('--rate', type=float, default=20, dest='rate',
+                        help='Requests per second, 0 for as many as possible, defaults to 20')
+    parser.add_argument('--workers', type=int, default=16, dest='workers',
+                        help='Number of concurrent requests, defaults to 16')
+    args = parser.parse_args()
+    logger.setLevel(logging.INFO)
+
+    try:
+        settings = load_settings(args.config)
+        mix = parse_mix(args.mix)
+    except (OSError, ValueError) as e:
+        logger.error('Invalid configuration: {error}'.format(error=e))
+        sys.exit(1)
+
+    with GrafanaClient(args.host or settings['host'], args.port or settings['port'], settings.get('default_user'),
+                       settings.get('default_password'), retries=0, pool_maxsize=args.workers) as client:
+        try:
+            report = run_load(client, mix, args.rate, args.duration, args.workers)
+        except (GrafanaError, requests.exceptions.RequestException, ValueError) as e:
+            logger.error('Load test failed: {error}'.format(error=e))
+            sys.exit(1)
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+    failed = False
+    if args.max_error_rate is not None and report['error_rate'] > args.max_error_rate:
+        logger.error('Error rate {rate} higher than {limit}'.format(rate=report['error_rate'],
+                                                                   limit=args.max_error_rate))
+        failed = True
+    if args.max_p99 is not None and (report['latency_ms']['p99'] or 0) > args.max_p99:
+        logger.error('p99 latency {p99} ms higher than {limit} ms'.format(p99=report['latency_ms']['p99'],
+                                                                         limit=args.max_p99))
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+
+"""Scraper of the Prometheus /metrics endpoint of Grafana.
+
+The exposition format is parsed line by line while the answer is streamed, and only the samples of the requested
+metric families are kept. Two scrapes give the increase of the counters and histograms in between, hence request
+rates and latency quantiles of a time window, e.g. the p99 of the /api/search requests after a warm-up.
+
+python -m grafana_lib.metrics_scraper --config tests_config/grafana.json --interval 30 \
+    --budget 'grafana_http_request_duration_seconds{handler="/api/search/"}:0.99<0.25'
+"""
+
+import argparse
+import contextlib
+import fnmatch
+import json
+import logging
+import math
+import re
+import requests
+import sys
+import time
+
+from grafana_lib.client import GrafanaClient, GrafanaError
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+VERSION = '1.0'
+
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger('grafana_tools.metrics_scraper')
+
+DEFAULT_FAMILIES = ('grafana_http_request_duration_seconds', 'grafana_db_*', 'grafana_database_*',
+                    'grafana_alerting_*')
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+# Suffixes of the samples of a family, e.g. name_bucket for a histogram
+SUFFIXES = ('_bucket', '_sum', '_count', '_total', '_created', '_info')
+
+LABEL = re.compile(r'\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*"((?:[^"\\]|\\.)*)"\s*(,|\})')
+ESCAPE = re.compile(r'\\(.)')
+
+
+class Sample:
+    """
+    One line of the exposition format
+    """
+
+    __slots__ = ('name', 'labels', 'value', 'timestamp')
+
+    def __init__(self, name: str, labels: Dict[str, str], value: float, timestamp: int = None):
+        self.name = name
+        self.labels = labels
+        self.value = value
+        self.timestamp = timestamp
+
+    @property
+    def key(self) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+        return self.name, tuple(sorted(self.labels.items()))
+
+    def matches(self, labels: Dict[str, str]) -> bool:
+        return all(self.labels.get(name) == value for name, value in labels.items())
+
+
+class MetricFamily:
+    """
+    Samples of one metric, e.g. the buckets, sums and counts of a histogram
+    """
+
+    __slots__ = ('name', 'type', 'help', 'samples')
+
+    def __init__(self, name: str, metric_type: str = 'untyped', help_text: str = ''):
+        self.name = name
+        self.type = metric_type
+        self.help = help_text
+        self.samples: List[Sample] = []
+
+
+def _unescape(value: str) -> str:
+    return ESCAPE.sub(lambda match: '\n' if match.group(1) == 'n' else match.group(1), value)
+
+
+def parse_labels(text: str, start: int = 0) -> Tuple[Dict[str, str], int]:
+    """
+    :param text: e.g. 'name{code="200",handler="/api/search/"} 12'
+    :param start: index following the opening brace
+    :return: labels and index following the closing brace
+    :raise ValueError: if the labels are malformed
+    """
+    labels = {}
+    position = start
+    if text[position:position + 1] == '}':
+        return labels, position + 1
+    while True:
+        match = LABEL.match(text, position)
+        if match is None:
+            raise ValueError('Invalid labels: {}'.format(text))
+        labels[match.group(1)] = _unescape(match.group(2))
+        position = match.end()
+        if match.group(3) == '}':
+            return labels, position
+        # Trailing comma: 'name{code="200",} 12'
+        if text[position:position + 1] == '}':
+            return labels, position + 1
+
+
+def parse_sample(line: str) -> Sample:
+    """
+    :param line: e.g. 'grafana_api_response_status_total{code="200"} 1500'
+    :raise ValueError: if the line is malformed
+    """
+    brace = line.find('{')
+    space = line.find(' ')
+    if brace != -1 and (space == -1 or brace < space):
+        name = line[:brace]
+        labels, end = parse_labels(line, brace + 1)
+        values = line[end:].split()
+    else:
+        name, *values = line.split()
+        labels = {}
+    if not values:
+        raise ValueError('No value: {}'.format(line))
+    return Sample(name, labels, float(values[0]), int(values[1]) if len(values) > 1 else None)
+
+
+def family_name(sample_name: str, types: Dict[str, str]) -> str:
+    """
+    :return: name of the family of a sample, e.g. 'grafana_http_request_duration_seconds' for
+             'grafana_http_request_duration_seconds_bucket'
+    """
+    if sample_name in types:
+        return sample_name
+    for suffix in SUFFIXES:
+        if sample_name.endswith(suffix) and sample_name[:-len(suffix)] in types:
+            return sample_name[:-len(suffix)]
+    return sample_name
+
+
+def parse_metrics(lines: Iterable[Union[str, bytes]], families: Sequence[str] = None) -> Dict[str, MetricFamily]:
+    """
+    Parses the exposition format one line at a time
+    :param lines: e.g. response.iter_lines()
+    :param families: names or shell patterns of the families to keep, e.g. 'grafana_alerting_*', all if None
+    :return: families by name
+    """
+    types: Dict[str, str] = {}
+    helps: Dict[str, str] = {}
+    selected: Dict[str, bool] = {}
+    parsed: Dict[str, MetricFamily] = {}
+
+    def is_selected(name: str) -> bool:
+        if families is None:
+            return True
+        if name not in selected:
+            selected[name] = any(fnmatch.fnmatchcase(name, pattern) for pattern in families)
+        return selected[name]
+
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#'):
+            words = line.split(None, 3)
+            if len(words) >= 3 and words[1] == 'TYPE':
+                types[words[2]] = words[3] if len(words) > 3 else 'untyped'
+            elif len(words) >= 3 and words[1] == 'HELP':
+                helps[words[2]] = words[3] if len(words) > 3 else ''
+            continue
+        # The name is resolved before the labels are parsed so that skipped families cost little
+        end = min(index for index in (line.find('{'), line.find(' '), len(line)) if index != -1)
+        name = family_name(line[:end], types)
+        if not is_selected(name):
+            continue
+        family = parsed.get(name)
+        if family is None:
+            family = parsed[name] = MetricFamily(name, types.get(name, 'untyped'), helps.get(name, ''))
+        family.samples.append(parse_sample(line))
+    return parsed
+
+
+def histogram_quantile(quantile: float, buckets: List[Tuple[float, float]]) -> Optional[float]:
+    """
+    Estimates a quantile from cumulative buckets as Prometheus does, interpolating linearly inside a bucket
+    :param quantile: e.g. 0.99
+    :param buckets: (upper bound, cumulative count) sorted by upper bound, the last one being +Inf
+    :return: None if there is no observation
+    """
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    rank = quantile * buckets[-1][1]
+    previous_bound, previous_count = 0.0, 0.0
+    for index, (bound, count) in enumerate(buckets):
+        if count >= rank:
+            if math.isinf(bound):
+                # Above the highest finite bound, which is the best estimate
+                return previous_bound if index > 0 else None
+            if count == previous_count:
+                return bound
+            return previous_bound + (bound - previous_bound) * (rank - previous_count) / (count - previous_count)
+        previous_bound, previous_count = bound, count
+    return previous_bound
+
+
+class Scrape:
+    """
+    Families read at one date, or their increase between two scrapes (see delta)
+    """
+
+    def __init__(self, families: Dict[str, MetricFamily], timestamp: float, elapsed: float = None):
+        """
+        :param families:
+        :param timestamp: date of the scrape in seconds
+        :param elapsed: seconds between the two scrapes of a delta, None for a single scrape
+        """
+        self.families = families
+        self.timestamp = timestamp
+        self.elapsed = elapsed
+
+    def samples(self, name: str, **labels: str) -> List[Sample]:
+        """
+        :param name: name of a sample, e.g. 'grafana_api_response_status_total'
+        :param labels: labels the samples must have
+        """
+        family = self.families.get(name) or self.families.get(family_name(name, self.families))
+        if family is None:
+            return []
+        return [sample for sample in family.samples if sample.name == name and sample.matches(labels)]
+
+    def value(self, name: str, **labels: str) -> float:
+        """
+        :return: sum of the samples *name* with *labels*, e.g. the requests of all status codes
+        """
+        return sum(sample.value for sample in self.samples(name, **labels))
+
+    def rate(self, name: str, **labels: str) -> float:
+        """
+        :return: increase per second of a delta
+        :raise ValueError: if this is not a delta
+        """
+        if not self.elapsed:
+            raise ValueError('Rates need the delta of two scrapes')
+        return self.value(name, **labels) / self.elapsed
+
+    def histogram(self, name: str, **labels: str) -> List[Tuple[float, float]]:
+        """
+        :return: buckets of histogram *name* summed over the series with *labels*, sorted by upper bound
+        """
+        counts: Dict[float, float] = {}
+        for sample in self.samples('{}_bucket'.format(name), **labels):
+            bound = float(sample.labels['le'])
+            counts[bound] = counts.get(bound, 0.0) + sample.value
+        return sorted(counts.items())
+
+    def quantile(self, name: str, quantile: float, **labels: str) -> Optional[float]:
+        """
+        :return: e.g. the 99th percentile of histogram *name* for quantile=0.99, None without observation
+        """
+        return histogram_quantile(quantile, self.histogram(name, **labels))
+
+
+def delta(before: Scrape, after: Scrape) -> Scrape:
+    """
+    :return: increase of the counters and histograms between the scrapes, last value of the gauges
+    """
+    previous = {sample.key: sample.value for family in before.families.values() for sample in family.samples}
+    families = {}
+    for name, family in after.families.items():
+        difference = MetricFamily(name, family.type, family.help)
+        for sample in family.samples:
+            value = sample.value
+            cumulative = family.type in ('counter', 'histogram') or \
+                (family.type == 'summary' and 'quantile' not in sample.labels)
+            if cumulative and sample.key in previous:
+                # A decrease means that Grafana restarted and counts again from 0
+                value = value - previous[sample.key] if value >= previous[sample.key] else value
+            difference.samples.append(Sample(sample.name, sample.labels, value, sample.timestamp))
+        families[name] = difference
+    return Scrape(families, after.timestamp, after.timestamp - before.timestamp)
+
+
+def scrape(client: GrafanaClient, families: Sequence[str] = None, path: str = '/metrics') -> Scrape:
+    """
+    Streams and parses the metrics of Grafana
+    :param families: names or shell patterns of the families to keep, all if None
+    :raise GrafanaError: if Grafana answers with an error status
+    """
+    timestamp = time.time()
+    response = client.request('GET', path, stream=True)
+    with contextlib.closing(response):
+        if not response.ok:
+            raise GrafanaError(response)
+        return Scrape(parse_metrics(response.iter_lines(), families), timestamp)
+
+
+def summarize(scrape_delta: Scrape, quantiles: Sequence[float] = QUANTILES) -> Dict[str, List[dict]]:
+    """
+    :return: per family and series, the increase and rate of the counters, the count, rate and quantiles of the
+             histograms and the value of the gauges
+    """
+    summary = {}
+    for name, family in sorted(scrape_delta.families.items()):
+        series = []
+        if family.type == 'histogram':
+            label_sets = []
+            for sample in family.samples:
+                labels = {key: value for key, value in sample.labels.items() if key != 'le'}
+                if sample.name == '{}_count'.format(name) and labels not in label_sets:
+                    label_sets.append(labels)
+            for labels in label_sets:
+                count = scrape_delta.value('{}_count'.format(name), **labels)
+                entry = {'labels': labels, 'count': count,
+                         'rate': round(count / scrape_delta.elapsed, 3) if scrape_delta.elapsed else None}
+                for quantile in quantiles:
+                    entry['p{:g}'.format(quantile * 100)] = scrape_delta.quantile(name, quantile, **labels)
+                series.append(entry)
+        else:
+            for sample in family.samples:
+                entry = {'name': sample.name, 'labels': sample.labels, 'value': sample.value}
+                if family.type == 'counter' and scrape_delta.elapsed:
+                    entry['rate'] = round(sample.value / scrape_delta.elapsed, 3)
+                series.append(entry)
+        summary[name] = series
+    return summary
+
+
+def parse_budget(budget: str) -> Tuple[str, Dict[str, str], float, float]:
+    """
+    :param budget: e.g. 'grafana_http_request_duration_seconds{handler="/api/search/"}:0.99<0.25'
+    :return: histogram name, labels, quantile and maximum
+    :raise ValueError: if the budget is malformed
+    """
+    selector, _, limit = budget.rpartition('<')
+    selector, _, quantile = selector.rpartition(':')
+    if not selector or not quantile or not limit:
+        raise ValueError('Invalid budget {}, expected name{{labels}}:quantile<maximum'.format(budget))
+    labels = {}
+    if '{' in selector:
+        brace = selector.index('{')
+        labels, _ = parse_labels(selector, brace + 1)
+        selector = selector[:brace]
+    return selector, labels, float(quantile), float(limit)
+
+
+def main():
+    prog_name = sys.argv[0]
+    usage = """{} [options]
+    """.format(prog_name)
+    parser = argparse.ArgumentParser(prog="{pn} {v}".format(pn=prog_name, v=VERSION), usage=usage)
+    parser.add_argument('--budget', type=str, action='append', default=[], dest='budgets',
+                        help='Exits with 1 if a quantile of a histogram is higher, '
+                             'e.g. grafana_http_request_duration_seconds{handler="/api/search/"}:0.99<0.25')
+    parser.add_argument('--config', type=str, default='tests_config/grafana.json', dest='config', metavar='file',
+                        help='Grafana configuration file (host, port, default_user, default_password), '
+                             'defaults to tests_config/grafana.json')
+    parser.add_argument('--families', type=str, nargs='+', default=list(DEFAULT_FAMILIES), dest='families',
+                        help='Names or shell patterns of the metric families, defaults to {}'.format(
+                            ' '.join(DEFAULT_FAMILIES)))
+    parser.add_argument('--host', type=str, dest='host', help='Overrides the host of the configuration file')
+    parser.add_argument('--interval', type=float, default=10, dest='interval',
+                        help='Seconds between the two scrapes, defaults to 10')
+    parser.add_argument('--port', type=int, dest='port', help='Overrides the port of the configuration file')
+    args = parser.parse_args()
+    logger.setLevel(logging.INFO)
+
+    try:
+        with open(args.config) as config_file:
+            settings = json.load(config_file)
+        budgets = [parse_budget(budget) for budget in args.budgets]
+    except (OSError, ValueError) as e:
+        logger.error('Invalid configuration: {error}'.format(error=e))
+        sys.exit(1)
+    families = list(args.families) + [name for name, _, _, _ in budgets]
+
+    with GrafanaClient(args.host or settings['host'], args.port or settings['port'], settings.get('default_user'),
+                       settings.get('default_password')) as client:
+        try:
+            before = scrape(client, families)
+            time.sleep(args.interval)
+            scrape_delta = delta(before, scrape(client, families))
+        except (GrafanaError, requests.exceptions.RequestException, ValueError) as e:
+            logger.error('Scrape failed: {error}'.format(error=e))
+            sys.exit(1)
+    print(json.dumps(summarize(scrape_delta), indent=2, sort_keys=True))
+
+    failed = False
+    for name, labels, quantile, limit in budgets:
+        value = scrape_delta.quantile(name, quantile, **labels)
+        if value is not None and value > limit:
+            logger.error('{name}{labels} quantile {quantile}: {value} higher than {limit}'.format(
+                name=name, labels=labels, quantile=quantile, value=value, limit=limit))
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
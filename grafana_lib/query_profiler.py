@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+
+"""Profiler of the queries of Grafana dashboards.
+
+The targets of each panel of a dashboard are sent to the datasource query API (/api/ds/query) as Grafana would send
+them (panel time range, template variables, datasource), several times and from a pool of threads. The report ranks
+the panels by latency, measured by the client and, when Grafana sends a Server-Timing header, by the server, with the
+size of the results.
+
+python -m grafana_lib.query_profiler --config tests_config/grafana.json --dashboard my-dashboard-uid --repetitions 5
+python -m grafana_lib.query_profiler --config tests_config/grafana.json --folder my-folder-uid --top 10
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import json
+import logging
+import re
+import requests
+import sys
+import time
+
+from grafana_lib.client import GrafanaClient, GrafanaError
+from grafana_lib.dashboard_sync import search_dashboards
+from grafana_lib.load_test import PERCENTILES, load_settings, summarize
+from metrics_lib.histogram import Histogram
+from typing import Dict, Iterator, List, Optional, Tuple
+
+VERSION = '1.0'
+
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger('grafana_tools.query_profiler')
+
+DEFAULT_TIME_RANGE = {'from': 'now-6h', 'to': 'now'}
+DEFAULT_MAX_DATA_POINTS = 1000
+MIXED_DATASOURCE = '-- Mixed --'
+
+UNITS_MS = {'s': 1000, 'm': 60000, 'h': 3600000, 'd': 86400000, 'w': 604800000, 'M': 2592000000,
+            'y': 31536000000}
+RELATIVE_TIME = re.compile(r'([+-])(\d+)([smhdwMy])')
+VARIABLE = re.compile(r'\$\{(\w+)(?::\w+)?\}|\[\[(\w+)(?::\w+)?\]\]|\$(\w+)')
+
+
+class PanelQuery:
+    """
+    Request of /api/ds/query sent by one panel
+    """
+
+    __slots__ = ('dashboard_uid', 'dashboard_title', 'panel_id', 'title', 'datasources', 'body')
+
+    def __init__(self, dashboard_uid: str, dashboard_title: str, panel_id: int, title: str, datasources: List[str],
+                 body: dict):
+        self.dashboard_uid = dashboard_uid
+        self.dashboard_title = dashboard_title
+        self.panel_id = panel_id
+        self.title = title
+        self.datasources = datasources
+        self.body = body
+
+
+def resolve_time(value, now_ms: int) -> int:
+    """
+    :param value: e.g. 'now-6h', 'now-1d-6h', 'now/d', 1526305170000 or '2018-05-14T13:39:30Z'
+    :param now_ms: current date in milliseconds since the epoch
+    :return: date in milliseconds since the epoch. Roundings such as '/d' are ignored
+    :raise ValueError: if the date cannot be parsed
+    """
+    if isinstance(value, (int, float)) or str(value).isdigit():
+        return int(value)
+    text = str(value).split('/')[0]
+    if text.startswith('now'):
+        offset = 0
+        position = len('now')
+        for match in RELATIVE_TIME.finditer(text, position):
+            if match.start() != position:
+                break
+            offset += (1 if match.group(1) == '+' else -1) * int(match.group(2)) * UNITS_MS[match.group(3)]
+            position = match.end()
+        if position != len(text):
+            raise ValueError('Invalid time {}'.format(value))
+        return now_ms + offset
+    date = datetime.datetime.fromisoformat(text.replace('Z', '+00:00'))
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return int(date.timestamp() * 1000)
+
+
+def template_variables(dashboard: dict) -> Dict[str, str]:
+    """
+    :return: current value of each template variable, values of multi-value variables being joined with ','
+    """
+    variables = {}
+    for variable in dashboard.get('templating', {}).get('list', []):
+        value = variable.get('current', {}).get('value')
+        if isinstance(value, list):
+            value = ','.join(str(item) for item in value)
+        if variable.get('name') and value is not None:
+            variables[variable['name']] = str(value)
+    return variables
+
+
+def substitute(value, variables: Dict[str, str]):
+    """
+    Replaces $name, ${name} and [[name]] in the strings of *value*, leaving unknown and built-in variables
+    ($__interval...) to Grafana
+    """
+    if isinstance(value, str):
+        def replace(match):
+            name = match.group(1) or match.group(2) or match.group(3)
+            return variables.get(name, match.group(0))
+        return VARIABLE.sub(replace, value)
+    if isinstance(value, dict):
+        return {key: substitute(item, variables) for key, item in value.items()}
+    if isinstance(value, list):
+        return [substitute(item, variables) for item in value]
+    return value
+
+
+def iter_panels(dashboard: dict) -> Iterator[dict]:
+    """
+    Yields the panels of the dashboard, including those of collapsed rows and of the rows of old schemas
+    """
+    for panel in dashboard.get('panels', []):
+        yield panel
+        yield from panel.get('panels', [])
+    for row in dashboard.get('rows', []):
+        yield from row.get('panels', [])
+
+
+class DatasourceResolver:
+    """
+    Converts the datasource references of panels (name, uid or None for the default one) to {'uid', 'type'}
+    """
+
+    def __init__(self, client: GrafanaClient):
+        self.client = client
+        self._datasources: Optional[List[dict]] = None
+
+    def _load(self) -> List[dict]:
+        if self._datasources is None:
+            self._datasources = self.client.get('/api/datasources')
+        return self._datasources
+
+    def resolve(self, reference) -> dict:
+        """
+        :raise ValueError: if the datasource does not exist
+        """
+        if isinstance(reference, dict) and reference.get('uid'):
+            return {'uid': reference['uid'], 'type': reference.get('type')}
+        for datasource in self._load():
+            if (reference is None and datasource.get('isDefault')) or \
+                    reference in (datasource.get('name'), datasource.get('uid')):
+                return {'uid': datasource['uid'], 'type': datasource.get('type')}
+        raise ValueError('Unknown datasource {}'.format(reference or 'default'))
+
+
+def panel_queries(dashboard: dict, resolver: DatasourceResolver, now_ms: int) -> List[PanelQuery]:
+    """
+    :return: query of each panel having visible targets
+    """
+    variables = template_variables(dashboard)
+    time_range = dashboard.get('time') or DEFAULT_TIME_RANGE
+    queries = []
+    for panel in iter_panels(dashboard):
+        targets = [target for target in panel.get('targets', []) if not target.get('hide')]
+        if panel.get('type') == 'row' or not targets:
+            continue
+        time_from = 'now-{}'.format(panel['timeFrom']) if panel.get('timeFrom') else time_range.get('from', 'now-6h')
+        begin, end = resolve_time(time_from, now_ms), resolve_time(time_range.get('to', 'now'), now_ms)
+        if panel.get('timeShift'):
+            shift = now_ms - resolve_time('now-{}'.format(panel['timeShift']), now_ms)
+            begin, end = begin - shift, end - shift
+        max_data_points = panel.get('maxDataPoints') or DEFAULT_MAX_DATA_POINTS
+        panel_datasource = substitute(panel.get('datasource'), variables)
+        body_queries = []
+        for index, target in enumerate(targets):
+            reference = panel_datasource
+            if reference == MIXED_DATASOURCE or (isinstance(reference, dict) and
+                                                 reference.get('uid') == MIXED_DATASOURCE):
+                # Each target of a mixed panel has its own datasource
+                reference = substitute(target.get('datasource'), variables)
+            query = substitute(target, variables)
+            query.update({'refId': target.get('refId') or chr(ord('A') + index),
+                          'datasource': resolver.resolve(reference),
+                          'maxDataPoints': max_data_points,
+                          'intervalMs': max(1, (end - begin) // max_data_points)})
+            body_queries.append(query)
+        queries.append(PanelQuery(dashboard.get('uid'), dashboard.get('title'), panel.get('id'),
+                                  panel.get('title', ''),
+                                  sorted({query['datasource']['uid'] for query in body_queries}),
+                                  {'from': str(begin), 'to': str(end), 'queries': body_queries}))
+    return queries
+
+
+def server_timing(header: Optional[str]) -> Optional[float]:
+    """
+    :param header: e.g. 'total;dur=123.4, db;dur=53'
+    :return: duration in seconds of the 'total' metric, or the sum of the metrics without 'total'
+    """
+    if not header:
+        return None
+    durations = {}
+    for metric in header.split(','):
+        name, *parameters = [part.strip() for part in metric.split(';')]
+        for parameter in parameters:
+            key, _, value = parameter.partition('=')
+            if key == 'dur':
+                durations[name] = float(value) / 1000.0
+    if not durations:
+        return None
+    return durations['total'] if 'total' in durations else sum(durations.values())
+
+
+def run_query(client: GrafanaClient, query: PanelQuery) -> Tuple[float, Optional[float], int, int, Optional[str]]:
+    """
+    Sends the query of a panel once
+    :return: client latency in seconds, server latency in seconds or None, size of the answer in bytes, number of
+             rows of the frames, error or None
+    """
+    begin = time.perf_counter()
+    try:
+        response = client.request('POST', '/api/ds/query', json=query.body)
+        content = response.content
+    except requests.exceptions.RequestException as e:
+        return time.perf_counter() - begin, None, 0, 0, str(e)
+    elapsed = time.perf_counter() - begin
+    if not response.ok:
+        return elapsed, None, len(content), 0, str(GrafanaError(response))
+    try:
+        results = response.json().get('results', {})
+    except ValueError as e:
+        return elapsed, None, len(content), 0, 'Invalid answer: {}'.format(e)
+    rows = 0
+    errors = []
+    for ref_id, result in sorted(results.items()):
+        if result.get('error'):
+            errors.append('{}: {}'.format(ref_id, result['error']))
+        for frame in result.get('frames') or []:
+            values = frame.get('data', {}).get('values') or []
+            rows += len(values[0]) if values else 0
+    return elapsed, server_timing(response.headers.get('Server-Timing')), len(content), rows, \
+        '; '.join(errors) or None
+
+
+def profile(client: GrafanaClient, queries: List[PanelQuery], repetitions: int = 5, warmup: int = 1,
+            workers: int = 4, rank: str = 'p95') -> List[dict]:
+    """
+    Sends each query *warmup* + *repetitions* times, the warm-up answers being ignored
+    :param rank: percentile of the client latency ranking the panels, e.g. 'p50' or 'p95'
+    :return: one entry per panel, slowest first
+    """
+    client_histograms = [Histogram() for _ in queries]
+    server_histograms = [Histogram() for _ in queries]
+    sizes = [[] for _ in queries]
+    rows = [0 for _ in queries]
+    errors: List[List[str]] = [[] for _ in queries]
+    tasks = [(index, repetition) for repetition in range(warmup + repetitions) for index in range(len(queries))]
+
+    def send(task: Tuple[int, int]) -> None:
+        index, repetition = task
+        elapsed, server_elapsed, size, row_count, error = run_query(client, queries[index])
+        if repetition < warmup:
+            return
+        client_histograms[index].record_seconds(elapsed)
+        if server_elapsed is not None:
+            server_histograms[index].record_seconds(server_elapsed)
+        sizes[index].append(size)
+        rows[index] = row_count
+        if error:
+            errors[index].append(error)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(send, tasks))
+
+    report = []
+    for index, query in enumerate(queries):
+        entry = {'dashboard_uid': query.dashboard_uid, 'dashboard': query.dashboard_title,
+                 'panel_id': query.panel_id, 'title': query.title, 'datasources': query.datasources,
+                 'queries': len(query.body['queries']),
+                 'client': summarize(client_histograms[index], repetitions, len(errors[index])),
+                 'server_latency_ms': summarize(server_histograms[index], server_histograms[index].total_count,
+                                                0)['latency_ms'] if server_histograms[index].total_count else None,
+                 'bytes': round(sum(sizes[index]) / len(sizes[index])) if sizes[index] else 0,
+                 'rows': rows[index],
+                 'errors': sorted(set(errors[index]))}
+        report.append(entry)
+    return sorted(report, key=lambda entry: entry['client']['latency_ms'].get(rank) or 0, reverse=True)
+
+
+def folder_dashboards(client: GrafanaClient, folder_uid: str) -> List[str]:
+    """
+    :return: uids of the dashboards of a folder
+    """
+    folder = client.get('/api/folders/{}'.format(folder_uid))
+    return [hit['uid'] for hit in search_dashboards(client, {'folderIds': folder['id']})]
+
+
+def profile_dashboards(client: GrafanaClient, uids: List[str], repetitions: int = 5, warmup: int = 1,
+                       workers: int = 4, rank: str = 'p95') -> List[dict]:
+    """
+    Profiles the panels of the dashboards *uids* together
+    :raise GrafanaError: if a dashboard cannot be read
+    :raise ValueError: if a panel uses an unknown datasource
+    """
+    resolver = DatasourceResolver(client)
+    now_ms = int(time.time() * 1000)
+    queries = []
+    for uid in uids:
+        dashboard = client.get('/api/dashboards/uid/{}'.format(uid))['dashboard']
+        queries += panel_queries(dashboard, resolver, now_ms)
+    return profile(client, queries, repetitions, warmup, workers, rank)
+
+
+def main():
+    prog_name = sys.argv[0]
+    usage = """{} [options]
+    """.format(prog_name)
+    parser = argparse.ArgumentParser(prog="{pn} {v}".format(pn=prog_name, v=VERSION), usage=usage)
+    parser.add_argument('--config', type=str, default='tests_config/grafana.json', dest='config', metavar='file',
+                        help='Grafana configuration file (host, port, default_user, default_password), '
+                             'defaults to tests_config/grafana.json')
+    parser.add_argument('--dashboard', type=str, action='append', default=[], dest='dashboards', metavar='uid',
+                        help='Dashboard to profile, may be repeated')
+    parser.add_argument('--folder', type=str, action='append', default=[], dest='folders', metavar='uid',
+                        help='Folder whose dashboards are profiled, may be repeated')
+    parser.add_argument('--host', type=str, dest='host', help='Overrides the host of the configuration file')
+    parser.add_argument('--port', type=int, dest='port', help='Overrides the port of the configuration file')
+    parser.add_argument('--rank', type=str, default='p95', dest='rank',
+                        choices=['p{:g}'.format(percentile) for percentile in PERCENTILES] + ['max', 'mean'],
+                        help='Client latency ranking the panels, defaults to p95')
+    parser.add_argument('--repetitions', type=int, default=5, dest='repetitions',
+                        help='Number of measured queries per panel, defaults to 5')
+    parser.add_argument('--top', type=int, dest='top', help='Number of panels reported, defaults to all')
+    parser.add_argument('--warmup', type=int, default=1, dest='warmup',
+                        help='Number of ignored queries per panel before the measures, defaults to 1')
+    parser.add_argument('--workers', type=int, default=4, dest='workers',
+                        help='Number of concurrent queries, defaults to 4')
+    args = parser.parse_args()
+    logger.setLevel(logging.INFO)
+
+    if not args.dashboards and not args.folders:
+        parser.error('--dashboard or --folder is required')
+    try:
+        settings = load_settings(args.config)
+    except (OSError, ValueError) as e:
+        logger.error('Invalid configuration: {error}'.format(error=e))
+        sys.exit(1)
+
+    with GrafanaClient(args.host or settings['host'], args.port or settings['port'], settings.get('default_user'),
+                       settings.get('default_password'), retries=0, pool_maxsize=args.workers) as client:
+        try:
+            uids = list(args.dashboards)
+            for folder_uid in args.folders:
+                uids += folder_dashboards(client, folder_uid)
+            report = profile_dashboards(client, uids, args.repetitions, args.warmup, args.workers, args.rank)
+        except (GrafanaError, requests.exceptions.RequestException, ValueError) as e:
+            logger.error('Profiling failed: {error}'.format(error=e))
+            sys.exit(1)
+    print(json.dumps(report[:args.top] if args.top else report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
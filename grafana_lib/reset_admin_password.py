@@ -1,12 +1,17 @@
 #!/usr/bin/env python
 
 import argparse
+import concurrent.futures
+import csv
+import json
 import logging
+import os
 import requests
 import sys
-import urllib.parse
+import time
 
-from http import HTTPStatus
+from grafana_lib.client import GrafanaClient, GrafanaError
+from typing import List
 
 VERSION = '1.0'
 
@@ -17,6 +22,94 @@ logging.basicConfig(
 )
 
 
+def resolve_credential(reference: str) -> str:
+    """
+    Resolves a credential of the inventory
+    :param reference: 'env:NAME' (environment variable), 'file:/path' (content of the file) or the credential itself
+    :return: credential
+    """
+    if reference.startswith('env:'):
+        try:
+            return os.environ[reference[len('env:'):]]
+        except KeyError:
+            raise ValueError('Environment variable {} not set'.format(reference[len('env:'):]))
+    if reference.startswith('file:'):
+        with open(reference[len('file:'):]) as credential_file:
+            return credential_file.read().strip()
+    return reference
+
+
+def load_inventory(path: str) -> List[dict]:
+    """
+    Loads the Grafana instances from a JSON file (list of objects) or a CSV file (with a header line). Each instance
+    has the keys host, port, password and newpassword, and optionally username (defaults to admin).
+    Example of CSV file:
+    host,port,password,newpassword
+    grafana-1.example.com,80,env:GRAFANA_PASSWORD,file:/run/secrets/grafana-1
+    """
+    with open(path, newline='') as inventory_file:
+        if path.endswith('.csv'):
+            instances = list(csv.DictReader(inventory_file))
+        else:
+            instances = json.load(inventory_file)
+    for instance in instances:
+        missing = [key for key in ('host', 'password', 'newpassword') if not instance.get(key)]
+        if missing:
+            raise ValueError('Instance {instance} has no {keys}'.format(instance=instance.get('host'),
+                                                                         keys=', '.join(missing)))
+    return instances
+
+
+def rotate_password(instance: dict, timeout: float = None) -> dict:
+    """
+    Changes the password of one Grafana instance of the inventory
+    :return: outcome, e.g. {'host': 'grafana-1', 'port': 80, 'status': 'updated', 'latency_ms': 35.2}
+    """
+    host = instance['host']
+    result = {'host': host, 'port': instance.get('port') or 80}
+    begin = time.perf_counter()
+    try:
+        port = int(instance.get('port') or 80)
+        password = resolve_credential(instance['password'])
+        newpassword = resolve_credential(instance['newpassword'])
+    except (OSError, ValueError) as e:
+        # Port which is not a number, credential reference which cannot be resolved
+        result.update({'status': 'invalid', 'error': str(e)})
+    else:
+        result['port'] = port
+        kwargs = {'timeout': (timeout, timeout)} if timeout else {}
+        try:
+            # A retried password change would be rejected once the first request has been applied
+            with GrafanaClient(host, port, instance.get('username') or 'admin', password, retries=0,
+                               **kwargs) as client:
+                client.change_password(password, newpassword)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            result.update({'status': 'unreachable', 'error': str(e)})
+        except GrafanaError as e:
+            result.update({'status': 'failed', 'error': e.message})
+        except ValueError as e:
+            # Accepted, but the answer is not JSON: the password may have been changed
+            result.update({'status': 'unknown', 'error': 'Invalid answer: {}'.format(e)})
+        except requests.exceptions.RequestException as e:
+            result.update({'status': 'failed', 'error': str(e)})
+        else:
+            result['status'] = 'updated'
+    result['latency_ms'] = round((time.perf_counter() - begin) * 1000, 1)
+    return result
+
+
+def rotate_fleet(instances: List[dict], workers: int, timeout: float = None) -> List[dict]:
+    """
+    Changes the passwords of all instances concurrently. A failure on one instance does not stop the others
+    :param instances: see load_inventory
+    :param workers: maximum number of instances updated at the same time
+    :param timeout: connect and read timeouts in seconds
+    :return: outcome of each instance, in the order of *instances*
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda instance: rotate_password(instance, timeout), instances))
+
+
 def main():
     prog_name = sys.argv[0]
     usage = """{} [options]
@@ -25,11 +118,18 @@ def main():
     parser.add_argument('--debug', type=bool, default=False, dest='debug', help='Enable debug')
     parser.add_argument('--host', type=str, default='127.0.0.1', dest='host',
                         help='IP/hostname of the Grafana container, defaults to 127.0.0.1')
-    parser.add_argument('--newpassword', type=str, dest='newpassword', required=True,
-                        metavar='pwd', help='New password')
-    parser.add_argument('--password', type=str, dest='password', required=True, metavar='pwd', help='Current password')
+    parser.add_argument('--inventory', type=str, dest='inventory', metavar='file',
+                        help='JSON/CSV file of Grafana instances whose password must be changed. Replaces --host, '
+                             '--port, --password and --newpassword')
+    parser.add_argument('--newpassword', type=str, dest='newpassword', metavar='pwd', help='New password')
+    parser.add_argument('--password', type=str, dest='password', metavar='pwd', help='Current password')
     parser.add_argument('--port', type=int, default=80, dest='port', help='Connection port, defaults to 80')
+    parser.add_argument('--timeout', type=float, dest='timeout', help='Connect and read timeouts in seconds')
+    parser.add_argument('--workers', type=int, default=16, dest='workers',
+                        help='Number of instances updated concurrently with --inventory, defaults to 16')
     args = parser.parse_args()
+    if args.inventory is None and (args.password is None or args.newpassword is None):
+        parser.error('--password and --newpassword are required without --inventory')
 
     debug = args.debug
     host = args.host
@@ -45,25 +145,36 @@ def main():
         logger.setLevel(logging.INFO)
         logging.getLogger('grafana_tools.reset_admin_password').setLevel(logging.INFO)
 
-    base = 'http://admin:{password}@{host}:{port}'.format(password=password, host=host, port=port)
-    url = urllib.parse.urljoin(base, '/api/user/password')
-    data = {'oldPassword': password,
-            'newPassword': newpassword,
-            'confirmNew': newpassword}
+    if args.inventory is not None:
+        try:
+            instances = load_inventory(args.inventory)
+        except (OSError, ValueError) as e:
+            logger.error('Invalid inventory {file}: {error}'.format(file=args.inventory, error=e))
+            sys.exit(1)
+        results = rotate_fleet(instances, args.workers, args.timeout)
+        print(json.dumps(results, indent=2))
+        failures = [result for result in results if result['status'] != 'updated']
+        logger.info('Grafana admin password updated on {ok}/{total} instance(s)'.format(
+            ok=len(results) - len(failures), total=len(results)))
+        sys.exit(1 if failures else 0)
+
+    kwargs = {'timeout': (args.timeout, args.timeout)} if args.timeout else {}
+    client = GrafanaClient(host, port, 'admin', password, retries=0, **kwargs)
     try:
-        response = requests.put(url, json=data)
-    except requests.exceptions.ConnectionError as e:
-        logger.error('Failed to establish a new connection ({host})'.format(host=base))
+        client.change_password(password, newpassword)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        logger.error('Failed to establish a new connection ({host})'.format(host=client.base_url))
         logger.debug(e)
         sys.exit(1)
+    except GrafanaError as e:
+        logger.error('Grafana admin password has not been updated')
+        logger.info(e.response.text)
+        sys.exit(1)
+    finally:
+        client.close()
 
-    if response.status_code == HTTPStatus.OK:
-        logger.info('Grafana admin password has been updated')
-        sys.exit(0)
-
-    logger.error('Grafana admin password has not been updated')
-    logger.info(response.text)
-    sys.exit(1)
+    logger.info('Grafana admin password has been updated')
+    sys.exit(0)
 
 
 if __name__ == "__main__":
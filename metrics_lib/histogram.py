@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""Latency histogram with a bounded relative error, in the style of HdrHistogram.
+
+Values are integers (e.g. microseconds). They are counted in buckets whose width doubles every power of two, each
+power of two being split in sub-buckets: the error of a recorded value is at most 1 / 2^significant_bits of its
+magnitude whatever its range, for a memory use proportional to the logarithm of the largest value.
+"""
+
+import math
+import threading
+
+from typing import Dict, Iterable, Optional
+
+
+class Histogram:
+    """
+    Counts of recorded values, thread safe
+    """
+
+    def __init__(self, significant_digits: int = 2):
+        """
+        :param significant_digits: number of decimal digits kept for each value, 2 means a relative error < 1 %
+        """
+        # Smallest power of two giving the requested precision, e.g. 256 sub-buckets for 2 digits
+        self.sub_bucket_bits = int(math.ceil(math.log2(2 * 10 ** significant_digits)))
+        self.sub_bucket_half = 1 << (self.sub_bucket_bits - 1)
+        self.counts: Dict[int, int] = {}
+        self.total_count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _index(self, value: int) -> int:
+        bucket = max(0, value.bit_length() - self.sub_bucket_bits)
+        return bucket * self.sub_bucket_half + (value >> bucket)
+
+    def _range(self, index: int) -> range:
+        """
+        :return: values counted at *index*
+        """
+        bucket = max(0, index // self.sub_bucket_half - 1)
+        sub_bucket = index - bucket * self.sub_bucket_half
+        return range(sub_bucket << bucket, (sub_bucket + 1) << bucket)
+
+    def record(self, value: int, count: int = 1) -> None:
+        """
+        :param value: non-negative integer, e.g. a latency in microseconds
+        :param count: number of occurrences of *value*
+        """
+        value = int(value)
+        if value < 0:
+            raise ValueError('Negative value {}'.format(value))
+        index = self._index(value)
+        with self._lock:
+            self.counts[index] = self.counts.get(index, 0) + count
+            self.total_count += count
+            self.total += value * count
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+
+    def record_seconds(self, seconds: float) -> None:
+        """
+        Records a duration in microseconds
+        """
+        self.record(int(round(seconds * 1000000)))
+
+    def merge(self, other: 'Histogram') -> None:
+        """
+        Adds the counts of *other*, which must have the same precision
+        """
+        if other.sub_bucket_bits != self.sub_bucket_bits:
+            raise ValueError('Histograms of different precisions')
+        with other._lock:
+            counts = dict(other.counts)
+            total_count, total, other_min, other_max = other.total_count, other.total, other.min, other.max
+        with self._lock:
+            for index, count in counts.items():
+                self.counts[index] = self.counts.get(index, 0) + count
+            self.total_count += total_count
+            self.total += total
+            if other_min is not None:
+                self.min = other_min if self.min is None else min(self.min, other_min)
+                self.max = other_max if self.max is None else max(self.max, other_max)
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.total_count if self.total_count else None
+
+    def value_at_percentile(self, percentile: float) -> Optional[int]:
+        """
+        :param percentile: e.g. 99.9
+        :return: value below which *percentile* % of the recorded values are, within the precision of the
+                 histogram. None if the histogram is empty
+        """
+        with self._lock:
+            if not self.total_count:
+                return None
+            rank = max(1, int(math.ceil(percentile / 100.0 * self.total_count)))
+            seen = 0
+            for index in sorted(self.counts):
+                seen += self.counts[index]
+                if seen >= rank:
+                    values = self._range(index)
+                    # Middle of the bucket, bounded by the exact extreme values
+                    return min(max((values.start + values.stop - 1) // 2, self.min), self.max)
+            return self.max
+
+    def percentiles(self, percentiles: Iterable[float] = (50, 90, 95, 99, 99.9)) -> Dict[str, Optional[int]]:
+        """
+        :return: e.g. {'p50': 1234, 'p99.9': 51200}
+        """
+        return {'p{:g}'.format(percentile): self.value_at_percentile(percentile) for percentile in percentiles}
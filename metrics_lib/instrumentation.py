@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+"""Counts and durations of the docker and Grafana calls.
+
+Every docker command run by the backends and every request of GrafanaClient is recorded under an operation name,
+e.g. 'docker.inspect', 'docker.exec.busctl' or 'grafana.PUT /api/user/password', in an in-memory histogram. The
+statistics can be exported in the Prometheus text format, listeners receive each call (see
+metrics_lib.pytest_plugin).
+"""
+
+import contextlib
+import re
+import threading
+import time
+
+from typing import Callable, Dict, Iterator, List, Sequence
+
+from metrics_lib.histogram import Histogram
+
+# Set to False to record nothing
+enabled = True
+
+# Commands skipped to name a 'sh -c' script after the program it runs
+SHELL_BUILTINS = ('echo', 'true', 'sleep', 'wait')
+
+
+class OperationStats:
+    """
+    Calls of one operation
+    """
+
+    __slots__ = ('count', 'failures', 'total_seconds', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.total_seconds = 0.0
+        # Durations in microseconds
+        self.histogram = Histogram()
+
+
+class Registry:
+    """
+    Statistics of all operations, thread safe
+    """
+
+    def __init__(self):
+        self.operations: Dict[str, OperationStats] = {}
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[str, float, bool], None]] = []
+
+    def record(self, operation: str, seconds: float, failed: bool = False) -> None:
+        with self._lock:
+            stats = self.operations.get(operation)
+            if stats is None:
+                stats = self.operations[operation] = OperationStats()
+            # Recorded before the statistics are visible: summary and to_prometheus expect a non-empty histogram
+            stats.histogram.record_seconds(seconds)
+            stats.count += 1
+            stats.failures += failed
+            stats.total_seconds += seconds
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(operation, seconds, failed)
+
+    @contextlib.contextmanager
+    def timed(self, operation: str) -> Iterator[None]:
+        """
+        Records the duration of the block, which failed if it raised an exception
+        """
+        begin = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except GeneratorExit:
+            # A stream closed by its consumer did not fail
+            raise
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.record(operation, time.perf_counter() - begin, failed)
+
+    def add_listener(self, listener: Callable[[str, float, bool], None]) -> None:
+        """
+        :param listener: function(operation, seconds, failed) called after each call
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[str, float, bool], None]) -> None:
+        with self._lock:
+            self._listeners.remove(listener)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.operations = {}
+
+    def summary(self) -> List[dict]:
+        """
+        :return: statistics of each operation, most time consuming first, e.g. {'operation': 'docker.inspect',
+                 'count': 12, 'failures': 0, 'total_s': 0.5, 'p50_ms': 40.1, 'p99_ms': 52.3, 'max_ms': 52.3}
+        """
+        with self._lock:
+            operations = dict(self.operations)
+        summary = []
+        for operation, stats in operations.items():
+            summary.append({'operation': operation, 'count': stats.count, 'failures': stats.failures,
+                            'total_s': round(stats.total_seconds, 6),
+                            'p50_ms': stats.histogram.value_at_percentile(50) / 1000.0,
+                            'p99_ms': stats.histogram.value_at_percentile(99) / 1000.0,
+                            'max_ms': stats.histogram.max / 1000.0})
+        return sorted(summary, key=lambda entry: entry['total_s'], reverse=True)
+
+    def to_prometheus(self, prefix: str = 'grafana_tools', quantiles: Sequence[float] = (0.5, 0.9, 0.99)) -> str:
+        """
+        :return: statistics in the Prometheus text exposition format, as a summary of the durations and a counter
+                 of the failures of each operation
+        """
+        with self._lock:
+            operations = sorted(self.operations.items())
+        duration = '{}_operation_duration_seconds'.format(prefix)
+        failures = '{}_operation_failures_total'.format(prefix)
+        lines = ['# HELP {} Duration of the docker commands and Grafana requests.'.format(duration),
+                 '# TYPE {} summary'.format(duration)]
+        for operation, stats in operations:
+            label = 'operation="{}"'.format(escape_label(operation))
+            for quantile in quantiles:
+                lines.append('{name}{{{label},quantile="{quantile:g}"}} {value:.6f}'.format(
+                    name=duration, label=label, quantile=quantile,
+                    value=stats.histogram.value_at_percentile(quantile * 100) / 1000000.0))
+            lines.append('{name}_sum{{{label}}} {value:.6f}'.format(name=duration, label=label,
+                                                                   value=stats.total_seconds))
+            lines.append('{name}_count{{{label}}} {value}'.format(name=duration, label=label, value=stats.count))
+        lines += ['# HELP {} Failed docker commands and Grafana requests.'.format(failures),
+                  '# TYPE {} counter'.format(failures)]
+        for operation, stats in operations:
+            lines.append('{name}{{operation="{operation}"}} {value}'.format(
+                name=failures, operation=escape_label(operation), value=stats.failures))
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def command_name(args: Sequence[str]) -> str:
+    """
+    :return: program run by a command, e.g. 'busctl' for ['sh', '-c', 'echo @unit; busctl get-property ...']
+    """
+    if not args:
+        return ''
+    if len(args) > 2 and args[0] in ('sh', 'bash') and args[1] == '-c':
+        for command in re.split(r'[;&|]', args[2]):
+            words = command.split()
+            # 'timeout 10 busctl ...' and 'exec busctl ...' run busctl
+            if words[:1] == ['timeout']:
+                words = words[2:]
+            if words[:1] == ['exec']:
+                words = words[1:]
+            if words and words[0] not in SHELL_BUILTINS:
+                return words[0]
+    return args[0]
+
+
+def docker_operation(args: Sequence[str]) -> str:
+    """
+    :return: e.g. 'docker.inspect' for ['inspect', 'grafana-1'], 'docker.exec.busctl' for
+             ['exec', 'grafana-1', 'busctl', ...]
+    """
+    if args and args[0] == 'exec':
+        arguments = list(args[1:])
+        while arguments and arguments[0].startswith('-'):
+            arguments = arguments[1:]
+        return 'docker.exec.{}'.format(command_name(arguments[1:]))
+    return 'docker.{}'.format(args[0] if args else '')
+
+
+def http_operation(method: str, path: str) -> str:
+    """
+    :return: e.g. 'grafana.GET /api/datasources/:id' for 'GET /api/datasources/12'
+    """
+    segments = path.split('?')[0].split('/')
+    for index, segment in enumerate(segments):
+        if segment.isdigit():
+            segments[index] = ':id'
+        elif index > 0 and segments[index - 1] == 'uid' and segment:
+            segments[index] = ':uid'
+    return 'grafana.{} {}'.format(method.upper(), '/'.join(segments))
+
+
+_registry = Registry()
+
+
+def get_registry() -> Registry:
+    return _registry
+
+
+def record(operation: str, seconds: float, failed: bool = False) -> None:
+    if enabled:
+        _registry.record(operation, seconds, failed)
+
+
+@contextlib.contextmanager
+def timed(operation: str) -> Iterator[None]:
+    """
+    Records the duration of the block under *operation*
+    """
+    if not enabled:
+        yield
+        return
+    with _registry.timed(operation):
+        yield
+
+
+def timed_iterator(operation: str, iterator: Iterator) -> Iterator:
+    """
+    Yields the items of *iterator*, recording its whole duration under *operation*
+    """
+    with timed(operation):
+        yield from iterator
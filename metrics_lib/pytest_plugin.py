@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""pytest plugin listing the slowest docker commands and Grafana requests of the test session.
+
+python -m pytest tests/test_grafana_container.py --config-file tests_config/dev.json --instrumentation
+"""
+
+import pytest
+
+from typing import Dict, List, Tuple
+
+from metrics_lib import instrumentation
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('instrumentation')
+    group.addoption('--instrumentation', action='store_true', dest='instrumentation',
+                    help='List the slowest docker commands and Grafana requests of each test')
+    group.addoption('--instrumentation-top', action='store', type=int, default=3, dest='instrumentation_top',
+                    help='Number of calls listed per test, defaults to 3')
+    group.addoption('--metrics-file', action='store', dest='metrics_file',
+                    help='Write the statistics of the calls to this file in the Prometheus text format')
+
+
+def pytest_configure(config):
+    if config.getoption('instrumentation') or config.getoption('metrics_file'):
+        config.pluginmanager.register(InstrumentationReporter(config), 'instrumentation_reporter')
+
+
+class InstrumentationReporter:
+    """
+    Attributes each recorded call to the running test
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.current_test = None
+        self.calls: Dict[str, List[Tuple[float, str, bool]]] = {}
+        self.registry = instrumentation.get_registry()
+        self.registry.reset()
+        self.registry.add_listener(self.record)
+
+    def record(self, operation: str, seconds: float, failed: bool) -> None:
+        if self.current_test is not None:
+            self.calls.setdefault(self.current_test, []).append((seconds, operation, failed))
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_protocol(self, item, nextitem):
+        self.current_test = item.nodeid
+        yield
+        self.current_test = None
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if not self.config.getoption('instrumentation'):
+            return
+        summary = self.registry.summary()
+        terminalreporter.write_sep('=', 'docker and Grafana calls')
+        if not summary:
+            terminalreporter.write_line('No call recorded')
+            return
+        terminalreporter.write_line('{:>9} {:>6} {:>8} {:>10} {:>10} {:>10}  {}'.format(
+            'total s', 'count', 'failures', 'p50 ms', 'p99 ms', 'max ms', 'operation'))
+        for entry in summary:
+            terminalreporter.write_line('{total_s:9.3f} {count:6d} {failures:8d} {p50_ms:10.3f} {p99_ms:10.3f} '
+                                        '{max_ms:10.3f}  {operation}'.format(**entry))
+        top = self.config.getoption('instrumentation_top')
+        terminalreporter.write_sep('-', 'slowest calls per test')
+        tests = sorted(self.calls.items(), key=lambda test: sum(call[0] for call in test[1]), reverse=True)
+        for nodeid, calls in tests:
+            terminalreporter.write_line('{nodeid} ({count} calls, {total:.3f} s)'.format(
+                nodeid=nodeid, count=len(calls), total=sum(call[0] for call in calls)))
+            for seconds, operation, failed in sorted(calls, reverse=True)[:top]:
+                terminalreporter.write_line('    {seconds:9.3f} s  {operation}{failed}'.format(
+                    seconds=seconds, operation=operation, failed=' (failed)' if failed else ''))
+
+    def pytest_unconfigure(self, config):
+        self.registry.remove_listener(self.record)
+        metrics_file = config.getoption('metrics_file')
+        if metrics_file:
+            with open(metrics_file, 'w') as prometheus_file:
+                prometheus_file.write(self.registry.to_prometheus())
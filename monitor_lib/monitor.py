@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+
+"""Health-monitoring daemon of the Grafana containers.
+
+Probes (container status, systemd services of a container) are kept in a single heap ordered by due date. The
+probes due within the same coalescing window run together: one 'docker inspect' for all containers, one docker exec
+per container for all its services, each check having a deadline after which its probe is marked unhealthy. Each
+probe is then rescheduled after its interval, plus or minus a random jitter so that probes started together drift
+apart. The last state is served from memory over HTTP:
+GET /state (JSON), GET /health (200 if every probe is healthy, 503 otherwise), GET /metrics (Prometheus text).
+
+Configuration file:
+{"interval": 30, "jitter": 0.1, "timeout": 10,
+ "containers": [{"name": "grafana-1", "services": ["grafana-server.service", "nginx.service"], "interval": 10}]}
+
+python -m monitor_lib.monitor --config monitor.json --listen 127.0.0.1:9110
+"""
+
+import argparse
+import concurrent.futures
+import heapq
+import http.server
+import itertools
+import json
+import logging
+import random
+import sys
+import threading
+import time
+
+from typing import Dict, List, Tuple
+
+from docker_lib.backends import DockerError, get_backend
+from docker_lib.docker_tools import Container
+from metrics_lib import instrumentation
+from systemd_lib.systemd_tools import Systemd
+
+VERSION = '1.0'
+
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger('grafana_tools.monitor')
+
+DEFAULT_TIMEOUT = 10
+
+
+class Probe:
+    """
+    Periodic check of a container, or of the systemd services of a container
+    """
+
+    __slots__ = ('kind', 'container_name', 'systemd_services', 'interval', 'timeout')
+
+    def __init__(self, kind: str, container_name: str, interval: float, systemd_services: List[str] = None,
+                 timeout: float = DEFAULT_TIMEOUT):
+        """
+        :param kind: 'container' or 'services'
+        :param container_name:
+        :param interval: delay in seconds between two checks
+        :param systemd_services: services checked by a 'services' probe
+        :param timeout: delay in seconds after which a check without answer marks the probe unhealthy
+        """
+        self.kind = kind
+        self.container_name = container_name
+        self.interval = interval
+        self.systemd_services = systemd_services or []
+        self.timeout = timeout
+
+    @property
+    def key(self) -> str:
+        return '{kind}:{name}'.format(kind=self.kind, name=self.container_name)
+
+
+def load_probes(config: dict) -> List[Probe]:
+    """
+    :return: one container probe per container of *config*, and one services probe if it lists services
+    :raise ValueError: if *config* has no container
+    """
+    if not config['containers']:
+        raise ValueError('No container to monitor')
+    default_interval = config.get('interval', 30)
+    default_timeout = config.get('timeout', DEFAULT_TIMEOUT)
+    probes = []
+    for container in config['containers']:
+        interval = container.get('interval', default_interval)
+        timeout = container.get('timeout', default_timeout)
+        probes.append(Probe('container', container['name'], interval, timeout=timeout))
+        if container.get('services'):
+            probes.append(Probe('services', container['name'], interval, container['services'], timeout))
+    return probes
+
+
+class Monitor:
+    """
+    Runs the probes and keeps their last results
+    """
+
+    def __init__(self, probes: List[Probe], jitter: float = 0.1, coalesce_window: float = 0.5, workers: int = 8,
+                 seed: int = None):
+        """
+        :param probes:
+        :param jitter: relative random variation of the intervals, e.g. 0.1 for +/- 10 %
+        :param coalesce_window: probes due within this delay in seconds run in the same batch
+        :param workers: number of checks run concurrently
+        :param seed: seed of the random jitter
+        """
+        self.probes = {probe.key: probe for probe in probes}
+        self.jitter = jitter
+        self.coalesce_window = coalesce_window
+        self.workers = workers
+        self.random = random.Random(seed)
+        self.state: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        # Checks which passed their deadline, by probe key: a probe is not checked again before they end
+        self._pending: Dict[str, concurrent.futures.Future] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+        self._sequence = itertools.count()
+        now = get_backend().monotonic()
+        for probe in probes:
+            # First checks spread over a fraction of the interval rather than all at once
+            self._schedule(probe, now + self.random.uniform(0, probe.interval * self.jitter))
+
+    def _schedule(self, probe: Probe, due: float) -> None:
+        heapq.heappush(self._heap, (due, next(self._sequence), probe.key))
+
+    def _next_interval(self, probe: Probe) -> float:
+        return probe.interval * (1 + self.random.uniform(-self.jitter, self.jitter))
+
+    def _pop_due(self) -> List[Probe]:
+        """
+        :return: the first probe and those due within the coalescing window after it
+        """
+        first_due = self._heap[0][0]
+        batch = []
+        while self._heap and self._heap[0][0] <= first_due + self.coalesce_window:
+            due, _, key = heapq.heappop(self._heap)
+            batch.append(self.probes[key])
+        return batch
+
+    def _update(self, key: str, values: dict) -> None:
+        """
+        Stores the result of a check, logging the changes of health
+        """
+        now = get_backend().time()
+        with self.lock:
+            previous = self.state.get(key, {})
+            changed = previous.get('healthy') != values['healthy']
+            self.state[key] = dict(values, checked_at=now,
+                                   changed_at=now if changed else previous.get('changed_at', now))
+        if changed and previous:
+            logger.warning('{key} is {health}'.format(key=key, health='healthy' if values['healthy'] else 'unhealthy'))
+
+    def _failed(self, probe: Probe, error: Exception) -> None:
+        """
+        Marks *probe* unhealthy. Errors other than those of docker and timeouts are logged with their traceback
+        """
+        if not isinstance(error, (DockerError, ValueError, TimeoutError)):
+            logger.error('Check of {key} failed'.format(key=probe.key), exc_info=error)
+        if probe.kind == 'container':
+            self._update(probe.key, {'kind': 'container', 'container': probe.container_name, 'status': None,
+                                     'healthy': False, 'error': str(error)})
+            return
+        for systemd_service in probe.systemd_services:
+            self._update('service:{}/{}'.format(probe.container_name, systemd_service),
+                         {'kind': 'service', 'container': probe.container_name, 'service': systemd_service,
+                          'running': False, 'healthy': False, 'error': str(error)})
+
+    def _check_containers(self, probes: List[Probe]) -> None:
+        try:
+            states = Container.inspect_many([probe.container_name for probe in probes], max_age=0)
+        except Exception:
+            # One missing or unreadable container fails the whole 'docker inspect': check them one by one
+            states = {}
+            for probe in probes:
+                try:
+                    states[probe.container_name] = Container.inspect(probe.container_name, max_age=0)
+                except Exception as e:
+                    self._failed(probe, e)
+        for name, state in states.items():
+            self._update('container:{}'.format(name), {'kind': 'container', 'container': name, 'status': state.status,
+                                                       'health': state.health, 'started_at': state.started_at,
+                                                       'healthy': state.status == 'running' and
+                                                       state.health in (None, 'healthy'), 'error': None})
+
+    def _check_services(self, probe: Probe) -> None:
+        try:
+            running = Systemd.are_services_running(probe.container_name, probe.systemd_services)
+        except Exception as e:
+            self._failed(probe, e)
+            return
+        for systemd_service, is_running in running.items():
+            self._update('service:{}/{}'.format(probe.container_name, systemd_service),
+                         {'kind': 'service', 'container': probe.container_name, 'service': systemd_service,
+                          'running': is_running, 'healthy': is_running, 'error': None})
+
+    def run_batch(self, probes: List[Probe]) -> None:
+        """
+        Runs the checks of *probes* concurrently, and marks unhealthy the probes whose check does not end before
+        their timeout. Such a check goes on in the background, the probe is not checked again until it ends
+        """
+        ready = []
+        for probe in probes:
+            pending = self._pending.pop(probe.key, None)
+            if pending is not None and not pending.done():
+                self._pending[probe.key] = pending
+                self._failed(probe, TimeoutError('Previous check still running'))
+            else:
+                ready.append(probe)
+        checks = []
+        container_probes = [probe for probe in ready if probe.kind == 'container']
+        if container_probes:
+            checks.append((self._executor.submit(self._check_containers, container_probes), container_probes))
+        checks += [(self._executor.submit(self._check_services, probe), [probe])
+                   for probe in ready if probe.kind == 'services']
+        start = time.monotonic()
+        for future, check_probes in checks:
+            timeout = min(probe.timeout for probe in check_probes)
+            try:
+                future.result(timeout=max(0, start + timeout - time.monotonic()))
+            except concurrent.futures.TimeoutError:
+                # A check which has not started yet, the workers being busy with late checks, is dropped
+                running = not future.cancel()
+                for probe in check_probes:
+                    self._failed(probe, TimeoutError('No answer within {}s'.format(timeout)))
+                    if running:
+                        self._pending[probe.key] = future
+            except Exception as e:
+                for probe in check_probes:
+                    self._failed(probe, e)
+
+    def step(self) -> List[Probe]:
+        """
+        Waits until the next probes are due, runs them and reschedules them
+        :return: probes run
+        """
+        backend = get_backend()
+        delay = self._heap[0][0] - backend.monotonic()
+        if delay > 0:
+            backend.sleep(delay)
+        batch = self._pop_due()
+        try:
+            self.run_batch(batch)
+        except Exception as e:
+            # The probes of the batch are rescheduled all the same
+            for probe in batch:
+                self._failed(probe, e)
+        now = backend.monotonic()
+        for probe in batch:
+            self._schedule(probe, now + self._next_interval(probe))
+        return batch
+
+    def run(self, batches: int = None) -> None:
+        """
+        Runs the probes forever, or for *batches* batches
+        """
+        for _ in itertools.count() if batches is None else range(batches):
+            self.step()
+
+    def close(self) -> None:
+        """
+        Releases the workers, without waiting for the checks which passed their deadline
+        """
+        self._executor.shutdown(wait=False)
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self.lock:
+            return {key: dict(value) for key, value in self.state.items()}
+
+    def healthy(self) -> bool:
+        with self.lock:
+            return len(self.state) > 0 and all(value['healthy'] for value in self.state.values())
+
+
+class StateHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the state of the monitor
+    """
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _send(self, status: int, body: str, content_type: str) -> None:
+        payload = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self) -> None:
+        monitor: Monitor = self.server.monitor
+        if self.path == '/state':
+            self._send(200, json.dumps(monitor.snapshot(), indent=2, sort_keys=True), 'application/json')
+        elif self.path == '/health':
+            healthy = monitor.healthy()
+            self._send(200 if healthy else 503, json.dumps({'healthy': healthy}), 'application/json')
+        elif self.path == '/metrics':
+            self._send(200, instrumentation.get_registry().to_prometheus(), 'text/plain; version=0.0.4')
+        else:
+            self._send(404, json.dumps({'message': 'Not found'}), 'application/json')
+
+
+def serve(monitor: Monitor, host: str = '127.0.0.1', port: int = 9110) -> http.server.HTTPServer:
+    """
+    Starts the HTTP endpoint in a background thread
+    :return: server, stopped by shutdown()
+    """
+    server = http.server.ThreadingHTTPServer((host, port), StateHandler)
+    server.daemon_threads = True
+    server.monitor = monitor
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def parse_listen(listen: str) -> Tuple[str, int]:
+    host, _, port = listen.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def main():
+    prog_name = sys.argv[0]
+    usage = """{} [options]
+    """.format(prog_name)
+    parser = argparse.ArgumentParser(prog="{pn} {v}".format(pn=prog_name, v=VERSION), usage=usage)
+    parser.add_argument('--config', type=str, required=True, dest='config', metavar='file',
+                        help='JSON file of the containers and services to monitor')
+    parser.add_argument('--listen', type=str, default='127.0.0.1:9110', dest='listen',
+                        help='Address of the HTTP endpoint, defaults to 127.0.0.1:9110')
+    parser.add_argument('--workers', type=int, default=8, dest='workers',
+                        help='Number of docker exec run concurrently, defaults to 8')
+    args = parser.parse_args()
+    logger.setLevel(logging.INFO)
+
+    try:
+        with open(args.config) as config_file:
+            config = json.load(config_file)
+        probes = load_probes(config)
+        host, port = parse_listen(args.listen)
+    except (OSError, ValueError, KeyError) as e:
+        logger.error('Invalid configuration: {error}'.format(error=e))
+        sys.exit(1)
+
+    monitor = Monitor(probes, config.get('jitter', 0.1), config.get('coalesce_window', 0.5), args.workers)
+    server = serve(monitor, host, port)
+    logger.info('Monitoring {count} probe(s), state served on http://{host}:{port}/state'.format(
+        count=len(probes), host=host, port=server.server_address[1]))
+    try:
+        monitor.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        monitor.close()
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
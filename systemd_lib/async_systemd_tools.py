@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+"""asyncio counterparts of systemd_lib.systemd_tools, to check the services of many containers concurrently.
+
+"""
+
+from typing import Dict, Iterable, List, Union
+
+from docker_lib.async_docker_tools import docker, gather_bounded
+from systemd_lib.systemd_tools import Systemd, UnitSnapshot
+
+
+class AsyncSystemd:
+
+    @staticmethod
+    async def get_unit_snapshot(container_name: str, systemd_services: List[str], busctl_properties: List[str],
+                                timeout: float = None) -> Dict[str, UnitSnapshot]:
+        """
+        See Systemd.get_unit_snapshot
+        """
+        script = Systemd._snapshot_script(systemd_services, busctl_properties)
+        stdout = await docker('exec', container_name, 'sh', '-c', script, timeout=timeout)
+        return Systemd._parse_snapshot(stdout.decode('utf-8'), systemd_services, busctl_properties)
+
+    @staticmethod
+    async def are_services_running(container_name: str, systemd_services: List[str],
+                                   timeout: float = None) -> Dict[str, bool]:
+        snapshots = await AsyncSystemd.get_unit_snapshot(container_name, systemd_services, ['ActiveState'], timeout)
+        return {systemd_service: snapshot.active_state == 'active' for systemd_service, snapshot in snapshots.items()}
+
+    @staticmethod
+    async def is_service_running_many(container_names: Iterable[str], systemd_services: List[str],
+                                      concurrency: int = 10,
+                                      timeout: float = None) -> Dict[str, Union[Dict[str, bool], Exception]]:
+        """
+        Checks *systemd_services* in many containers concurrently, with one docker exec per container
+        :param container_names:
+        :param systemd_services: e.g. ['grafana-server.service', 'monit.service', 'nginx.service']
+        :param concurrency: maximum number of docker commands running at the same time
+        :param timeout: delay in seconds for each container
+        :return: for each container, True for each running service, or the exception raised while checking them
+        """
+        return await gather_bounded(
+            container_names, lambda name: AsyncSystemd.are_services_running(name, systemd_services, timeout),
+            concurrency)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""Streaming reader of the journal of a container.
+
+"""
+
+import json
+import os
+
+from typing import Iterator, List
+
+from docker_lib.backends import get_backend
+
+
+class JournalReader:
+    """
+    Yields the records of 'journalctl -o json' one by one while they are read. The cursor of the last record is
+    remembered (and saved in *cursor_file* if given) so that the next call only returns newer records.
+    """
+
+    def __init__(self, container_name: str, systemd_units: List[str] = None, priority: str = None,
+                 cursor_file: str = None, current_boot: bool = True, fields: List[str] = None):
+        """
+        :param container_name:
+        :param systemd_units: only records of these units, e.g. ['monit']
+        :param priority: only records of this priority or higher, e.g. 'err'
+        :param cursor_file: file where the cursor is persisted between two runs
+        :param current_boot: only records of the current boot
+        :param fields: only these fields are output (__CURSOR is always added), requires systemd >= 236
+        """
+        self.container_name = container_name
+        self.systemd_units = systemd_units or []
+        self.priority = priority
+        self.cursor_file = cursor_file
+        self.current_boot = current_boot
+        self.fields = fields
+        self.cursor = self._load_cursor()
+
+    def _load_cursor(self) -> str:
+        if self.cursor_file is None:
+            return None
+        try:
+            with open(self.cursor_file) as cursor_file:
+                return cursor_file.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _save_cursor(self) -> None:
+        if self.cursor_file is None or self.cursor is None:
+            return
+        temporary_file = '{}.tmp'.format(self.cursor_file)
+        with open(temporary_file, 'w') as cursor_file:
+            cursor_file.write(self.cursor)
+        os.replace(temporary_file, self.cursor_file)
+
+    def _journalctl_args(self, since: str, follow: bool) -> List[str]:
+        args = ['journalctl', '-o', 'json', '--no-pager']
+        for systemd_unit in self.systemd_units:
+            args += ['-u', systemd_unit]
+        if self.priority is not None:
+            args += ['-p', self.priority]
+        if self.current_boot:
+            args.append('-b')
+        if self.fields:
+            args.append('--output-fields={}'.format(','.join(self.fields)))
+        if self.cursor is not None:
+            args += ['--after-cursor', self.cursor]
+        elif since is not None:
+            args += ['--since', since]
+        if follow:
+            args += ['-f', '--no-tail']
+        return args
+
+    def entries(self, since: str = None, follow: bool = False) -> Iterator[dict]:
+        """
+        Yields the journal records newer than the saved cursor, or than *since* if there is no cursor
+        :param since: date understood by journalctl, e.g. '2018-05-15 12:18:54'
+        :param follow: keep waiting for new records. Close the generator to stop
+        :return: records, e.g. {'__CURSOR': 's=...', 'MESSAGE': "'grafana-server' process is not running", ...}
+        """
+        lines = get_backend().exec_stream(self.container_name, *self._journalctl_args(since, follow))
+        try:
+            for line in lines:
+                # Skip '-- No entries --' and other informative lines
+                if not line.startswith('{'):
+                    continue
+                record = json.loads(line)
+                self.cursor = record.get('__CURSOR', self.cursor)
+                yield record
+        finally:
+            lines.close()
+            self._save_cursor()
+
+    def messages(self, since: str = None, follow: bool = False) -> Iterator[str]:
+        """
+        Yields the MESSAGE field of the records, see entries
+        """
+        for record in self.entries(since, follow):
+            message = record.get('MESSAGE')
+            if isinstance(message, list):
+                # journalctl outputs non-printable messages as arrays of bytes
+                message = bytes(message).decode('utf-8', 'replace')
+            yield message
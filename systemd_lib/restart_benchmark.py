@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""Measures how fast monit and systemd bring the services of a container back after a stop or a kill.
+
+Each service is stopped/killed several times. The latency of a restart is the ActiveEnterTimestamp (microseconds,
+read from systemd) of the restarted service minus the date of the systemctl command. The percentiles of each
+service and command are printed as JSON and can be compared with a baseline saved by a previous run.
+
+python -m systemd_lib.restart_benchmark --container grafana-1 --iterations 10 --save-baseline baseline.json
+python -m systemd_lib.restart_benchmark --container grafana-1 --iterations 10 --baseline baseline.json
+python -m systemd_lib.restart_benchmark --container grafana-1 --simulate
+"""
+
+import argparse
+import json
+import logging
+import math
+import sys
+
+from typing import Dict, List
+
+from docker_lib.backends import DockerError, get_backend, set_backend
+from systemd_lib.systemd_tools import Systemd
+
+VERSION = '1.0'
+
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger('grafana_tools.restart_benchmark')
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values: List[float], rank: float) -> float:
+    """
+    :return: *rank*-th percentile of *values*, interpolated between the two closest values
+    """
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * rank / 100.0
+    lower = int(math.floor(position))
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(latencies: List[float], failures: int) -> dict:
+    """
+    :return: e.g. {'count': 10, 'failures': 0, 'p50_ms': 15012.3, 'p95_ms': ..., 'p99_ms': ..., 'max_ms': ...}
+    """
+    summary = {'count': len(latencies), 'failures': failures}
+    if latencies:
+        for rank in PERCENTILES:
+            summary['p{}_ms'.format(rank)] = round(percentile(latencies, rank) * 1000, 3)
+        summary['max_ms'] = round(max(latencies) * 1000, 3)
+    return summary
+
+
+def measure_restart(container_name: str, systemd_service: str, command: str, timeout: int) -> float:
+    """
+    Runs systemctl *command* *systemd_service* and waits until the service is active again
+    :return: restart latency in seconds
+    :raise TimeoutError: if the service is not restarted after *timeout* seconds
+    """
+    _, previous_timestamp = Systemd.get_active_enter_timestamp(container_name, systemd_service)
+    since = get_backend().time()
+    Systemd.systemctl(container_name, command, systemd_service)
+    return Systemd.wait_until_service_is_restarted(container_name, systemd_service, timeout,
+                                                   previous_timestamp=previous_timestamp, since=since)
+
+
+def run_benchmark(container_name: str, systemd_services: List[str], commands: List[str], iterations: int,
+                  timeout: int) -> Dict[str, Dict[str, dict]]:
+    """
+    :return: summary of the latencies of each service and command, e.g. {'nginx.service': {'kill': {...}}}
+    """
+    report = {}
+    for systemd_service in systemd_services:
+        report[systemd_service] = {}
+        for command in commands:
+            latencies = []
+            failures = 0
+            for iteration in range(iterations):
+                try:
+                    latencies.append(measure_restart(container_name, systemd_service, command, timeout))
+                except (TimeoutError, ValueError, DockerError) as e:
+                    failures += 1
+                    logger.warning('{service} not restarted after {command} #{iteration}: {error!r}'.format(
+                        service=systemd_service, command=command, iteration=iteration + 1, error=e))
+                    # Let the next iteration start from a running service
+                    Systemd.systemctl(container_name, 'start', systemd_service)
+            report[systemd_service][command] = summarize(latencies, failures)
+    return report
+
+
+def compare(report: Dict[str, Dict[str, dict]], baseline: Dict[str, Dict[str, dict]],
+            tolerance: float = 0.2) -> List[dict]:
+    """
+    Compares the percentiles of *report* with those of *baseline*
+    :param tolerance: relative increase above which a percentile is a regression, e.g. 0.2 for 20 %
+    :return: one entry per percentile found in both, e.g. {'service': 'nginx.service', 'command': 'kill',
+             'metric': 'p95_ms', 'baseline_ms': 10.0, 'current_ms': 13.0, 'ratio': 1.3, 'regression': True}
+    """
+    comparison = []
+    for systemd_service, commands in sorted(report.items()):
+        for command, summary in sorted(commands.items()):
+            reference = baseline.get(systemd_service, {}).get(command, {})
+            for metric in ['p{}_ms'.format(rank) for rank in PERCENTILES] + ['max_ms']:
+                if metric not in summary or not reference.get(metric):
+                    continue
+                ratio = summary[metric] / reference[metric]
+                comparison.append({'service': systemd_service, 'command': command, 'metric': metric,
+                                   'baseline_ms': reference[metric], 'current_ms': summary[metric],
+                                   'ratio': round(ratio, 3), 'regression': ratio > 1 + tolerance})
+    return comparison
+
+
+def main():
+    prog_name = sys.argv[0]
+    usage = """{} [options]
+    """.format(prog_name)
+    parser = argparse.ArgumentParser(prog="{pn} {v}".format(pn=prog_name, v=VERSION), usage=usage)
+    parser.add_argument('--baseline', type=str, dest='baseline', metavar='file',
+                        help='Report of a previous run to compare with, exits with 1 on regression')
+    parser.add_argument('--commands', type=str, nargs='+', default=['stop', 'kill'], dest='commands',
+                        help='systemctl commands, defaults to stop kill')
+    parser.add_argument('--container', type=str, required=True, dest='container', help='Name of the container')
+    parser.add_argument('--iterations', type=int, default=10, dest='iterations',
+                        help='Number of restarts per service and command, defaults to 10')
+    parser.add_argument('--save-baseline', type=str, dest='save_baseline', metavar='file',
+                        help='Saves the report as baseline')
+    parser.add_argument('--services', type=str, nargs='+', default=['grafana-server.service', 'nginx.service'],
+                        dest='services', help='Services to restart, defaults to grafana-server.service nginx.service')
+    parser.add_argument('--simulate', action='store_true', dest='simulate',
+                        help='Runs against a simulated container instead of the docker daemon')
+    parser.add_argument('--timeout', type=int, default=75, dest='timeout',
+                        help='Maximum restart delay in seconds, defaults to 75')
+    parser.add_argument('--tolerance', type=float, default=0.2, dest='tolerance',
+                        help='Relative increase of a percentile seen as a regression, defaults to 0.2')
+    args = parser.parse_args()
+    logger.setLevel(logging.INFO)
+
+    if args.simulate:
+        from docker_lib.simulated_backend import SimulatedBackend
+        set_backend(SimulatedBackend([args.container]))
+    report = run_benchmark(args.container, args.services, args.commands, args.iterations, args.timeout)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2, sort_keys=True)
+    output = {'report': report}
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            output['comparison'] = compare(report, json.load(baseline_file), args.tolerance)
+        regressions = [entry for entry in output['comparison'] if entry['regression']]
+    print(json.dumps(output, indent=2, sort_keys=True))
+    for regression in regressions:
+        logger.error('{service} {command} {metric}: {current_ms} ms instead of {baseline_ms} ms'.format(**regression))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
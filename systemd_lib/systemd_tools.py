@@ -6,10 +6,122 @@ __copyright__ = 'Copyright 2018, ELCA'
 
 
 import datetime
-import sh
-import time
+import math
+import shlex
 
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
+
+from docker_lib.backends import DockerError, get_backend
+from docker_lib.exec_session import ExecSession
+
+
+class UnitSnapshot:
+    """
+    Values of some D-Bus properties of a systemd unit, read at the same time
+    """
+
+    __slots__ = ('name', 'properties')
+
+    def __init__(self, name: str, properties: Dict[str, object]):
+        self.name = name
+        self.properties = properties
+
+    def __repr__(self) -> str:
+        return 'UnitSnapshot({name!r}, {properties!r})'.format(name=self.name, properties=self.properties)
+
+    @property
+    def active_state(self) -> Optional[str]:
+        return self.properties.get('ActiveState')
+
+    @property
+    def active_enter_timestamp(self) -> Optional[float]:
+        """
+        :return: ActiveEnterTimestamp in seconds since the epoch
+        """
+        microseconds = self.properties.get('ActiveEnterTimestamp')
+        return None if microseconds is None else microseconds / 1000000.0
+
+
+def parse_busctl_value(value: str) -> object:
+    """
+    Converts the output of 'busctl get-property' to a python value
+    Example: 's "active"' becomes 'active', 't 1526305170850190' becomes 1526305170850190
+    """
+    signature, _, data = value.strip().partition(' ')
+    if signature == 's':
+        return data[1:-1] if len(data) >= 2 and data[0] == data[-1] == '"' else data
+    if signature == 'b':
+        return data == 'true'
+    if signature in ('y', 'n', 'q', 'i', 'u', 'x', 't'):
+        return int(data)
+    if signature == 'd':
+        return float(data)
+    return data
+
+
+def parse_monitor_value(value: str) -> object:
+    """
+    Converts a value printed by 'busctl monitor' to a python value
+    Example: 'STRING "active";' becomes 'active', 'UINT64 1526305170850190;' becomes 1526305170850190
+    """
+    kind, _, data = value.strip().rstrip(';').partition(' ')
+    if kind in ('STRING', 'OBJECT_PATH', 'SIGNATURE'):
+        return data[1:-1] if len(data) >= 2 and data[0] == data[-1] == '"' else data
+    if kind == 'BOOLEAN':
+        return data == 'true'
+    if kind in ('BYTE', 'INT16', 'UINT16', 'INT32', 'UINT32', 'INT64', 'UINT64'):
+        return int(data)
+    if kind == 'DOUBLE':
+        return float(data)
+    return data
+
+
+class PropertiesChangedParser:
+    """
+    Incremental parser of the verbose output of 'busctl monitor'. Returns the properties carried by each
+    PropertiesChanged signal as soon as the message is complete. Properties whose value is a container (array,
+    struct...) are skipped.
+    Example of message:
+    MESSAGE "sa{sv}as" {
+            STRING "org.freedesktop.systemd1.Unit";
+            ARRAY "{sv}" {
+                    DICT_ENTRY "sv" {
+                            STRING "ActiveState";
+                            VARIANT "s" {
+                                    STRING "active";
+                            };
+                    };
+            ...
+    };
+    """
+
+    def __init__(self):
+        self._properties = {}
+        self._key = None
+        self._expected = None
+
+    def feed(self, line: str) -> Optional[Dict[str, object]]:
+        """
+        :param line: line printed by busctl monitor
+        :return: properties of the message if *line* ends it, None otherwise
+        """
+        stripped = line.strip()
+        if stripped.startswith('DICT_ENTRY'):
+            self._expected = 'key'
+        elif self._expected == 'key' and stripped.startswith('STRING '):
+            self._key = parse_monitor_value(stripped)
+            self._expected = 'variant'
+        elif self._expected == 'variant' and stripped.startswith('VARIANT'):
+            self._expected = 'value'
+        elif self._expected == 'value':
+            if not stripped.endswith('{'):
+                self._properties[self._key] = parse_monitor_value(stripped)
+            self._expected = None
+        elif stripped == '};' and len(line) - len(line.lstrip()) <= 2:
+            # End of the message
+            properties, self._properties = self._properties, {}
+            return properties or None
+        return None
 
 
 class Systemd:
@@ -17,73 +129,253 @@ class Systemd:
     Tools to check the status of services running inside a container
     """
 
+    # Marker printed before the properties of each unit in the output of get_unit_snapshot
+    SNAPSHOT_MARKER = '@unit'
+    # Delay between two property reads when D-Bus signals are not available
+    POLL_INTERVAL = 1.0
+    # Delay given to 'busctl monitor' to subscribe before reading the current state of the unit
+    MONITOR_ATTACH_DELAY = 0.1
+    # Line printed with the PID of 'timeout busctl monitor' once the monitor is subscribed
+    MONITOR_MARKER = '@monitor'
+    # Wait for D-Bus PropertiesChanged signals instead of polling the properties
+    use_events = True
+
     @staticmethod
-    def _get_systemd_property(container_name: str, systemd_service: str, busctl_property: str) -> str:
+    def _unit_object(systemd_service: str) -> str:
         # Replace non-alphanumeric characters in systemd_service by their hexadecimal equivalents.
         # Example: 'grafana-server.service' becomes 'grafana_2dserver_2eservice'
         systemd_service_alnum = ''.join([char if char.isalnum() else
                                          '_{h}'.format(h=format(ord(char), 'x')) for char in systemd_service])
+        return '/org/freedesktop/systemd1/unit/{service}'.format(service=systemd_service_alnum)
+
+    @staticmethod
+    def _exec(container_name: str, *args: str, session: ExecSession = None) -> bytes:
+        """
+        Runs *args* inside the container, in *session* if given
+        """
+        if session is not None:
+            return session.run(*args)
+        return get_backend().exec(container_name, *args)
 
-        busctl_command = 'get-property'
+    @staticmethod
+    def _snapshot_script(systemd_services: List[str], busctl_properties: List[str]) -> str:
         busctl_service = 'org.freedesktop.systemd1'
-        busctl_object = '/org/freedesktop/systemd1/unit/{service}'.format(service=systemd_service_alnum)
         busctl_interface = 'org.freedesktop.systemd1.Unit'
-        docker_cmd = sh.docker.bake('exec', container_name, 'busctl', busctl_command, busctl_service, busctl_object,
-                                    busctl_interface, busctl_property)
-        return docker_cmd().stdout.decode('utf-8')
+        # busctl prints one line per property. The marker lets us attribute the lines to the units even if a
+        # busctl call fails, in which case the properties of the unit are simply missing.
+        commands = ['echo {marker}; busctl get-property {service} {object} {interface} {properties}'.format(
+            marker=Systemd.SNAPSHOT_MARKER, service=busctl_service,
+            object=shlex.quote(Systemd._unit_object(systemd_service)), interface=busctl_interface,
+            properties=' '.join(shlex.quote(busctl_property) for busctl_property in busctl_properties))
+            for systemd_service in systemd_services]
+        return '; '.join(commands + ['true'])
 
     @staticmethod
-    def is_service_running(container_name: str, systemd_service: str) -> bool:
+    def _parse_snapshot(output: str, systemd_services: List[str],
+                        busctl_properties: List[str]) -> Dict[str, UnitSnapshot]:
+        blocks = output.split(Systemd.SNAPSHOT_MARKER + '\n')[1:]
+        snapshots = {}
+        for index, systemd_service in enumerate(systemd_services):
+            lines = blocks[index].splitlines() if index < len(blocks) else []
+            properties = {}
+            if len(lines) == len(busctl_properties):
+                properties = {busctl_property: parse_busctl_value(line)
+                              for busctl_property, line in zip(busctl_properties, lines)}
+            snapshots[systemd_service] = UnitSnapshot(systemd_service, properties)
+        return snapshots
+
+    @staticmethod
+    def get_unit_snapshot(container_name: str, systemd_services: List[str], busctl_properties: List[str],
+                          session: ExecSession = None) -> Dict[str, UnitSnapshot]:
+        """
+        Reads *busctl_properties* of all *systemd_services* with a single docker exec
+        :param container_name:
+        :param systemd_services: e.g. ['grafana-server.service', 'nginx.service']
+        :param busctl_properties: properties of the org.freedesktop.systemd1.Unit interface, e.g. ['ActiveState']
+        :param session: persistent shell of the container to use instead of a new docker exec
+        :return: snapshot of each service. Properties which could not be read are missing from the snapshot
+        """
+        script = Systemd._snapshot_script(systemd_services, busctl_properties)
+        output: str = Systemd._exec(container_name, 'sh', '-c', script, session=session).decode('utf-8')
+        return Systemd._parse_snapshot(output, systemd_services, busctl_properties)
+
+    @staticmethod
+    def are_services_running(container_name: str, systemd_services: List[str],
+                             session: ExecSession = None) -> Dict[str, bool]:
+        """
+        Checks with a single docker exec which of *systemd_services* are running
+        :param container_name:
+        :param systemd_services:
+        :param session:
+        :return: True for each running service, False otherwise
+        """
+        snapshots = Systemd.get_unit_snapshot(container_name, systemd_services, ['ActiveState'], session)
+        return {systemd_service: snapshot.active_state == 'active' for systemd_service, snapshot in snapshots.items()}
+
+    @staticmethod
+    def is_service_running(container_name: str, systemd_service: str, session: ExecSession = None) -> bool:
         """
         Checks if service *systemd_service" is running
         :param container_name:
         :param systemd_service:
+        :param session:
         :return: True if *systemd_service* is running, False otherwise
         """
-        busctl_property = 'ActiveState'
-        current_state: str = Systemd._get_systemd_property(container_name, systemd_service, busctl_property)
-        expected_state: str = '"active"'
-        return expected_state in current_state
+        return Systemd.are_services_running(container_name, [systemd_service], session)[systemd_service]
 
     @staticmethod
-    def get_active_enter_timestamp(container_name: str, systemd_service: str) -> Tuple[str, float]:
-        busctl_property: str = 'ActiveEnterTimestamp'
-        active_enter_timestamp: str = Systemd._get_systemd_property(container_name, systemd_service, busctl_property)
-        # active_enter_timestamp contains a string s.t. 't 1526305170850190'. Let's get the timestamp and convert it
-        # to something compatible with datetime:
-        try:
-            timestamp: float = float(active_enter_timestamp.split()[1])/1000000.0
-        except (IndexError, ValueError):
-            raise
-        else:
-            return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S'), \
-                   timestamp
+    def get_active_enter_timestamp(container_name: str, systemd_service: str,
+                                   session: ExecSession = None) -> Tuple[str, float]:
+        snapshot = Systemd.get_unit_snapshot(container_name, [systemd_service], ['ActiveEnterTimestamp'], session)
+        timestamp = snapshot[systemd_service].active_enter_timestamp
+        if timestamp is None:
+            raise ValueError('ActiveEnterTimestamp of {service} not available'.format(service=systemd_service))
+        return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S'), \
+            timestamp
+
+    @staticmethod
+    def _restarted_at(properties: Dict[str, object], previous_timestamp: Optional[float]) -> Optional[float]:
+        """
+        :return: ActiveEnterTimestamp in seconds if *properties* show an active unit which entered this state after
+                 *previous_timestamp*, None otherwise
+        """
+        if properties.get('ActiveState') != 'active' or properties.get('ActiveEnterTimestamp') is None:
+            return None
+        timestamp = properties['ActiveEnterTimestamp'] / 1000000.0
+        if previous_timestamp is not None and timestamp <= previous_timestamp:
+            return None
+        return timestamp
 
     @staticmethod
-    def wait_until_service_is_restarted(container_name: str, systemd_service: str, timeout: int) -> None:
-        counter = 0
+    def _poll_restart(container_name: str, systemd_service: str, previous_timestamp: Optional[float],
+                      deadline: float, session: ExecSession = None) -> float:
         while True:
-            time.sleep(1)
-            counter = counter + 1
-            if Systemd.is_service_running(container_name, systemd_service):
-                return
-            if counter > timeout:
+            snapshot = Systemd.get_unit_snapshot(container_name, [systemd_service],
+                                                 ['ActiveState', 'ActiveEnterTimestamp'], session)[systemd_service]
+            restarted_at = Systemd._restarted_at(snapshot.properties, previous_timestamp)
+            if restarted_at is not None:
+                return restarted_at
+            remaining = deadline - get_backend().monotonic()
+            if remaining <= 0:
                 raise TimeoutError
+            get_backend().sleep(min(Systemd.POLL_INTERVAL, remaining))
+
+    @staticmethod
+    def _wait_for_restart_signal(container_name: str, systemd_service: str, previous_timestamp: Optional[float],
+                                 deadline: float) -> Optional[float]:
+        """
+        Streams the PropertiesChanged signals of the unit from inside the container
+        :return: ActiveEnterTimestamp in seconds of the restarted unit, None if the stream ended without it
+        :raise DockerError: if the stream is not available
+        """
+        unit_object = Systemd._unit_object(systemd_service)
+        match = "type='signal',path='{object}',interface='org.freedesktop.DBus.Properties'," \
+                "member='PropertiesChanged'".format(object=unit_object)
+        duration = max(int(math.ceil(deadline - get_backend().monotonic())), 1)
+        # Once the monitor is subscribed, its PID is printed and the current state is read by another exec: the unit
+        # may have restarted before the subscription. Closing the stream only stops the docker client, the monitor
+        # is killed inside the container unless timeout already stopped it.
+        script = 'timeout {duration} busctl monitor --match {match} & sleep {delay}; echo {marker} $!; wait'.format(
+            duration=duration, match=shlex.quote(match), delay=Systemd.MONITOR_ATTACH_DELAY,
+            marker=Systemd.MONITOR_MARKER)
+        lines = get_backend().exec_stream(container_name, 'sh', '-c', script)
+        parser = PropertiesChangedParser()
+        state = {}
+        monitor_pid = None
+        try:
+            for line in lines:
+                if line.startswith(Systemd.MONITOR_MARKER + ' '):
+                    monitor_pid = line.split()[1]
+                    snapshots = Systemd.get_unit_snapshot(container_name, [systemd_service],
+                                                          ['ActiveState', 'ActiveEnterTimestamp'])
+                    properties = snapshots[systemd_service].properties
+                else:
+                    properties = parser.feed(line)
+                if not properties:
+                    continue
+                state.update(properties)
+                if properties.get('ActiveState') == 'active' and 'ActiveEnterTimestamp' not in properties:
+                    # The signal did not carry the timestamp, read it
+                    snapshot = Systemd.get_unit_snapshot(container_name, [systemd_service],
+                                                         ['ActiveEnterTimestamp'])[systemd_service]
+                    state.update(snapshot.properties)
+                restarted_at = Systemd._restarted_at(state, previous_timestamp)
+                if restarted_at is not None:
+                    return restarted_at
+            # The monitor exited with the stream
+            monitor_pid = None
+        finally:
+            lines.close()
+            if monitor_pid is not None:
+                Systemd._stop_monitor(container_name, monitor_pid)
+        return None
+
+    @staticmethod
+    def _stop_monitor(container_name: str, pid: str) -> None:
+        """
+        Kills 'timeout busctl monitor' in the container, timeout passing the signal on to busctl
+        """
+        try:
+            get_backend().exec(container_name, 'kill', pid)
+        except DockerError:
+            # Already stopped by timeout
+            pass
+
+    @staticmethod
+    def wait_until_service_is_restarted(container_name: str, systemd_service: str, timeout: int,
+                                        session: ExecSession = None, previous_timestamp: float = None,
+                                        since: float = None) -> float:
+        """
+        Waits until *systemd_service* is active again. D-Bus PropertiesChanged signals of the unit are streamed from
+        the container, properties are polled if they are not available.
+        :param container_name:
+        :param systemd_service:
+        :param timeout: delay in seconds
+        :param session: persistent shell of the container, used when polling
+        :param previous_timestamp: ActiveEnterTimestamp (seconds) before the stop/kill: the service must have entered
+                                   the active state after this date. Defaults to the ActiveEnterTimestamp read at the
+                                   start of the call, so that a service not stopped yet is not taken as restarted; it
+                                   must be given if the service may have restarted before the call
+        :param since: date of the stop/kill in seconds since the epoch, defaults to now
+        :return: restart latency in seconds, i.e. ActiveEnterTimestamp of the restarted service minus *since*
+        :raise TimeoutError: if the service is not restarted after *timeout* seconds
+        """
+        since = get_backend().time() if since is None else since
+        if previous_timestamp is None:
+            try:
+                _, previous_timestamp = Systemd.get_active_enter_timestamp(container_name, systemd_service, session)
+            except ValueError:
+                # Not active since the container started: any active state is a restart
+                pass
+        deadline = get_backend().monotonic() + timeout
+        restarted_at = None
+        if Systemd.use_events:
+            try:
+                restarted_at = Systemd._wait_for_restart_signal(container_name, systemd_service, previous_timestamp,
+                                                                deadline)
+            except DockerError:
+                # D-Bus signals unavailable: fall back to polling
+                pass
+        if restarted_at is None:
+            restarted_at = Systemd._poll_restart(container_name, systemd_service, previous_timestamp, deadline,
+                                                 session)
+        return max(restarted_at - since, 0.0)
 
     @staticmethod
-    def systemctl(container_name: str, command: str, systemd_service: str) -> None:
+    def systemctl(container_name: str, command: str, systemd_service: str, session: ExecSession = None) -> None:
         """
         Runs systemctl *command* *systemd_service*
         :param container_name:
         :param command:
         :param systemd_service:
+        :param session:
         :return:
         """
-        docker_cmd = sh.docker.bake('exec', container_name, 'systemctl', command, systemd_service)
-        docker_cmd()
+        Systemd._exec(container_name, 'systemctl', command, systemd_service, session=session)
 
     @staticmethod
-    def list_errors_not_older_than(container_name: str, systemd_service: str, date: str) -> str:
-        container = sh.docker.bake('exec', container_name)
-        errors = container.journalctl('-u', systemd_service, '--since', date, '-p', 'err', '-b').stdout.decode('utf-8')
+    def list_errors_not_older_than(container_name: str, systemd_service: str, date: str,
+                                   session: ExecSession = None) -> str:
+        errors = Systemd._exec(container_name, 'journalctl', '-u', systemd_service, '--since', date, '-p', 'err', '-b',
+                               session=session).decode('utf-8')
         return errors
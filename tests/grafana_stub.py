@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""Local stub of the Grafana HTTP API used by the unit tests of grafana_lib.
+
+"""
+
+import http.server
+import json
+import socketserver
+import threading
+import urllib.parse
+
+from typing import Callable, Dict, Tuple
+
+
+class StubRequest:
+
+    def __init__(self, method: str, path: str, query: dict, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately: without TCP_NODELAY each answer waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _handle(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length) if length else b''
+        try:
+            body = json.loads(data.decode('utf-8')) if data else None
+        except ValueError:
+            body = data
+        request = StubRequest(self.command, url.path, urllib.parse.parse_qs(url.query), self.headers, body)
+        with self.server.lock:
+            self.server.requests.append(request)
+        route = self.server.routes.get((self.command, url.path)) or self.server.routes.get((self.command, '*'))
+        headers = {}
+        if route is None:
+            status, answer = 404, {'message': 'Not found'}
+        else:
+            status, answer, *extra = route(request)
+            headers = extra[0] if extra else {}
+        if isinstance(answer, (bytes, str)):
+            payload = answer.encode('utf-8') if isinstance(answer, str) else answer
+            content_type = 'text/plain; version=0.0.4'
+        else:
+            payload = json.dumps(answer).encode('utf-8')
+            content_type = 'application/json'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+class GrafanaStub(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    Answers with the routes registered in *routes*: (method, path) -> function(request) -> (status, body) or
+    (status, body, headers). The path '*' matches any path.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.lock = threading.Lock()
+        self.routes: Dict[Tuple[str, str], Callable[[StubRequest], Tuple[int, object]]] = {}
+        self.requests = []
+        self.connections = 0
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def host(self) -> str:
+        return self.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def __enter__(self) -> 'GrafanaStub':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+"""Unit tests of the asyncio API against a fake docker executable.
+
+"""
+
+import asyncio
+import os
+import stat
+import time
+
+import pytest
+
+from docker_lib.async_docker_tools import AsyncContainer
+from docker_lib.backends import DockerError
+from systemd_lib.async_systemd_tools import AsyncSystemd
+
+
+FAKE_DOCKER = """#!/bin/sh
+# Every container answers after 0.3 second, except 'slow' which never answers and 'missing' which does not exist
+case "$2" in
+    slow) exec sleep 30 ;;
+    missing) echo "Error: No such object: missing" >&2; exit 1 ;;
+esac
+sleep 0.3
+case "$1" in
+    inspect) echo '[{"State": {"Status": "running"}}]' ;;
+    exec) printf '@unit\\ns "active"\\n@unit\\ns "inactive"\\n' ;;
+esac
+"""
+
+
+@pytest.fixture(autouse=True)
+def fake_docker(tmpdir, monkeypatch):
+    script = tmpdir.join('docker')
+    script.write(FAKE_DOCKER)
+    os.chmod(str(script), os.stat(str(script)).st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', '{}{}{}'.format(tmpdir, os.pathsep, os.environ['PATH']))
+
+
+def test_status_many_runs_concurrently():
+    names = ['grafana-{}'.format(i) for i in range(10)]
+    begin = time.monotonic()
+    statuses = asyncio.run(AsyncContainer.status_many(names, concurrency=10, timeout=5))
+    assert time.monotonic() - begin < 1.5
+    assert statuses == {name: 'running' for name in names}
+
+
+def test_status_many_per_container_errors():
+    statuses = asyncio.run(AsyncContainer.status_many(['grafana-1', 'missing', 'slow'], timeout=1))
+    assert statuses['grafana-1'] == 'running'
+    assert isinstance(statuses['missing'], DockerError)
+    assert isinstance(statuses['slow'], asyncio.TimeoutError)
+
+
+def test_is_service_running_many():
+    services = ['grafana-server.service', 'nginx.service']
+    results = asyncio.run(AsyncSystemd.is_service_running_many(['grafana-1', 'grafana-2'], services, concurrency=1))
+    assert results == {name: {'grafana-server.service': True, 'nginx.service': False}
+                       for name in ['grafana-1', 'grafana-2']}
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+"""Unit tests of docker_lib.container_lock.
+
+"""
+
+import multiprocessing
+import time
+
+import pytest
+
+from docker_lib.container_lock import ContainerLock
+
+
+def hold_exclusive(directory: str, seconds: float, ready) -> None:
+    with ContainerLock('grafana-1', directory).exclusive():
+        ready.set()
+        time.sleep(seconds)
+
+
+def test_shared_locks_coexist(tmpdir):
+    lock = ContainerLock('grafana-1', str(tmpdir))
+    with lock.shared():
+        with ContainerLock('grafana-1', str(tmpdir)).shared(blocking=False):
+            pass
+        with pytest.raises(BlockingIOError):
+            with ContainerLock('grafana-1', str(tmpdir)).exclusive(blocking=False):
+                pass
+    with lock.exclusive(blocking=False):
+        pass
+
+
+def test_exclusive_lock(tmpdir):
+    with ContainerLock('grafana-1', str(tmpdir)).exclusive():
+        with pytest.raises(BlockingIOError):
+            with ContainerLock('grafana-1', str(tmpdir)).shared(blocking=False):
+                pass
+        # Other containers are not locked
+        with ContainerLock('grafana-2', str(tmpdir)).exclusive(blocking=False):
+            pass
+
+
+def test_lock_shared_between_processes(tmpdir):
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=hold_exclusive, args=(str(tmpdir), 0.3, ready))
+    process.start()
+    try:
+        assert ready.wait(10)
+        begin = time.monotonic()
+        with ContainerLock('grafana-1', str(tmpdir)).shared():
+            waited = time.monotonic() - begin
+    finally:
+        process.join()
+    assert waited > 0.1
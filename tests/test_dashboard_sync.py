@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+"""Unit tests of grafana_lib.dashboard_sync against a local stub of the Grafana API.
+
+"""
+
+import json
+import os
+
+import pytest
+
+from grafana_lib.client import GrafanaClient
+from grafana_lib.dashboard_sync import export_dashboards, import_dashboards, import_state_name, load_manifest
+from grafana_stub import GrafanaStub
+
+
+def make_dashboard(uid: str, version: int, title: str) -> dict:
+    return {'id': len(uid), 'uid': uid, 'title': title, 'version': version, 'panels': []}
+
+
+@pytest.fixture
+def stub():
+    with GrafanaStub() as grafana_stub:
+        grafana_stub.dashboards = {'a': make_dashboard('a', 1, 'A'), 'bb': make_dashboard('bb', 3, 'B')}
+
+        def search(request):
+            return 200, [{'id': dashboard['id'], 'uid': uid, 'title': dashboard['title'], 'type': 'dash-db'}
+                         for uid, dashboard in grafana_stub.dashboards.items()]
+
+        def versions(request):
+            dashboard_id = int(request.path.split('/')[4])
+            dashboard = [d for d in grafana_stub.dashboards.values() if d['id'] == dashboard_id][0]
+            return 200, [{'version': dashboard['version']}]
+
+        def dashboard(request):
+            uid = request.path.rsplit('/', 1)[1]
+            meta = {'folderId': 4, 'folderUid': 'ops'} if uid == 'bb' else {'folderId': 0}
+            return 200, {'dashboard': dict(grafana_stub.dashboards[uid]), 'meta': meta}
+
+        def save(request):
+            pushed = dict(request.body['dashboard'], version=request.body['dashboard']['version'] + 1)
+            grafana_stub.dashboards[pushed['uid']] = dict(pushed, id=len(pushed['uid']))
+            return 200, {'status': 'success', 'uid': pushed['uid'], 'version': pushed['version']}
+
+        grafana_stub.routes[('GET', '/api/search')] = search
+        grafana_stub.routes[('GET', '*')] = lambda request: versions(request) if request.path.endswith('/versions') \
+            else dashboard(request)
+        grafana_stub.routes[('POST', '/api/dashboards/db')] = save
+        yield grafana_stub
+
+
+def full_downloads(stub: GrafanaStub) -> list:
+    return [request.path for request in stub.requests if request.path.startswith('/api/dashboards/uid/')]
+
+
+def test_export_only_changed(stub, tmpdir):
+    with GrafanaClient(stub.host, stub.port, 'admin', 'admin') as client:
+        report = export_dashboards(client, str(tmpdir))
+        assert sorted(report['exported']) == ['a', 'bb']
+        manifest = load_manifest(str(tmpdir))
+        assert manifest['bb']['version'] == 3
+        object_path = tmpdir.join('objects', '{}.json'.format(manifest['a']['sha256']))
+        assert 'id' not in json.loads(object_path.read())
+        mtime = os.stat(str(object_path)).st_mtime_ns
+
+        stub.requests.clear()
+        assert export_dashboards(client, str(tmpdir))['exported'] == []
+        assert full_downloads(stub) == []
+        assert [request.path for request in stub.requests].count('/api/search') == 1
+
+        stub.dashboards['bb'] = make_dashboard('bb', 4, 'B2')
+        del stub.dashboards['a']
+        stub.requests.clear()
+        report = export_dashboards(client, str(tmpdir))
+    assert report == {'exported': ['bb'], 'unchanged': [], 'removed': ['a']}
+    assert full_downloads(stub) == ['/api/dashboards/uid/bb']
+    assert os.stat(str(object_path)).st_mtime_ns == mtime
+    assert sorted(load_manifest(str(tmpdir))) == ['bb']
+
+
+def test_import_only_changed(stub, tmpdir):
+    with GrafanaClient(stub.host, stub.port, 'admin', 'admin') as client:
+        export_dashboards(client, str(tmpdir))
+        manifest = load_manifest(str(tmpdir))
+        # Same contents: compared once, then known from the import state
+        stub.requests.clear()
+        assert import_dashboards(client, str(tmpdir))['imported'] == []
+        assert sorted(full_downloads(stub)) == ['/api/dashboards/uid/a', '/api/dashboards/uid/bb']
+        stub.requests.clear()
+        assert import_dashboards(client, str(tmpdir))['imported'] == []
+        assert full_downloads(stub) == []
+
+        del stub.dashboards['a']
+        stub.dashboards['bb'] = make_dashboard('bb', 5, 'Edited in Grafana')
+        stub.requests.clear()
+        report = import_dashboards(client, str(tmpdir))
+        assert sorted(report['imported']) == ['a', 'bb']
+        pushed = {request.body['dashboard']['uid']: request.body for request in stub.requests
+                  if request.method == 'POST'}
+        assert pushed['bb']['dashboard']['title'] == 'B' and pushed['bb']['overwrite']
+        assert pushed['a']['dashboard']['id'] is None
+        # The manifest still describes the exported objects
+        assert load_manifest(str(tmpdir)) == manifest
+
+        stub.requests.clear()
+        assert import_dashboards(client, str(tmpdir))['imported'] == []
+        assert [request.method for request in stub.requests] == ['GET'] * 3
+
+
+def test_import_compares_contents(stub, tmpdir):
+    with GrafanaClient(stub.host, stub.port, 'admin', 'admin') as client:
+        export_dashboards(client, str(tmpdir))
+        # Another instance, whose dashboard bb has the version of the manifest but another content
+        stub.dashboards['bb'] = make_dashboard('bb', 3, 'Other instance')
+        stub.dashboards['a'] = make_dashboard('a', 7, 'A')
+        report = import_dashboards(client, str(tmpdir))
+    assert report == {'imported': ['bb'], 'unchanged': ['a'], 'failed': []}
+    assert stub.dashboards['bb']['title'] == 'B'
+    [push] = [request.body for request in stub.requests if request.method == 'POST']
+    assert push['folderUid'] == 'ops' and 'folderId' not in push
+
+
+def test_import_saves_state_of_successful_dashboards(stub, tmpdir):
+    with GrafanaClient(stub.host, stub.port, 'admin', 'admin') as client:
+        export_dashboards(client, str(tmpdir))
+        stub.dashboards.clear()
+        save = stub.routes[('POST', '/api/dashboards/db')]
+        stub.routes[('POST', '/api/dashboards/db')] = lambda request: \
+            (400, {'message': 'Folder not found'}) if request.body['dashboard']['uid'] == 'bb' else save(request)
+        report = import_dashboards(client, str(tmpdir))
+        assert report == {'imported': ['a'], 'unchanged': [], 'failed': ['bb']}
+        assert load_manifest(str(tmpdir), import_state_name(client)) == \
+            {'a': {'sha256': load_manifest(str(tmpdir))['a']['sha256'], 'version': 2}}
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""Unit tests of grafana_lib.data_backup against the simulated container.
+
+"""
+
+import gzip
+import io
+import os
+import tarfile
+
+import pytest
+
+from docker_lib import backends
+from docker_lib.backends import DockerError
+from docker_lib.simulated_backend import SimulatedBackend
+from grafana_lib.data_backup import CHUNKS, backup_to_archive, backup_to_store, decompress, fixed_chunks, \
+    list_backups, restore_from_archive, restore_from_store
+
+DATABASE = '/var/lib/grafana/grafana.db'
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    simulated_backend = SimulatedBackend(['grafana-1'])
+    monkeypatch.setattr(backends, '_backend', simulated_backend)
+    return simulated_backend
+
+
+def files(backend: SimulatedBackend) -> dict:
+    return dict(backend.containers['grafana-1'].files)
+
+
+def test_fixed_chunks():
+    assert list(fixed_chunks([b'abc', b'defgh', b'', b'ij'], 4)) == [b'abcd', b'efgh', b'ij']
+    assert list(fixed_chunks([], 4)) == []
+
+
+def test_decompress_bounds_chunks():
+    data = gzip.compress(b'\0' * 100000)
+    chunks = list(decompress([data[:10], data[10:]], 4096))
+    assert b''.join(chunks) == b'\0' * 100000
+    assert max(len(chunk) for chunk in chunks) <= 4096
+
+
+def test_archive_round_trip(backend, tmpdir):
+    archive = str(tmpdir.join('grafana-1.tar.gz'))
+    original = files(backend)
+    report = backup_to_archive('grafana-1', archive, chunk_size=4096)
+    assert report['compressed'] == os.path.getsize(archive) < report['size']
+    with tarfile.open(archive, 'r:gz') as tar:
+        assert 'grafana/grafana.db' in tar.getnames()
+
+    backend.containers['grafana-1'].files[DATABASE] = b'corrupted'
+    restore_from_archive('grafana-1', archive, chunk_size=4096)
+    assert files(backend) == original
+
+
+def test_archive_not_replaced_on_failure(backend, tmpdir):
+    archive = tmpdir.join('grafana-1.tar.gz')
+    archive.write('previous')
+    with pytest.raises(DockerError):
+        backup_to_archive('grafana-1', str(archive), path='/var/lib/missing')
+    assert archive.read() == 'previous'
+    assert tmpdir.listdir() == [archive]
+
+
+def test_store_deduplicates_chunks(backend, tmpdir):
+    store = str(tmpdir)
+    first = backup_to_store('grafana-1', store, 'first', chunk_size=4096)
+    assert first['stored_chunks'] == len(os.listdir(os.path.join(store, CHUNKS))) > 1
+
+    # Same size, one byte changed in the middle of the database
+    database = bytearray(backend.containers['grafana-1'].files[DATABASE])
+    database[len(database) // 2] ^= 0xff
+    backend.containers['grafana-1'].files[DATABASE] = bytes(database)
+    second = backup_to_store('grafana-1', store, 'second', chunk_size=4096)
+    assert second['chunks'] == first['chunks']
+    assert second['stored_chunks'] == 1
+    assert list_backups(store) == ['first', 'second']
+
+    modified = files(backend)
+    restore_from_store('grafana-1', store, 'first')
+    assert files(backend)[DATABASE] != modified[DATABASE]
+    manifest = restore_from_store('grafana-1', store)
+    assert manifest['name'] == 'second'
+    assert files(backend) == modified
+
+
+def test_store_detects_corruption(backend, tmpdir):
+    store = str(tmpdir)
+    backup_to_store('grafana-1', store, 'first', chunk_size=4096)
+    chunk = tmpdir.join(CHUNKS).listdir()[0]
+    chunk.write_binary(gzip.compress(b'other content'))
+    with pytest.raises(ValueError):
+        restore_from_store('grafana-1', store)
+    with pytest.raises(ValueError):
+        restore_from_store('grafana-1', str(tmpdir.join('empty')))
+
+
+def test_simulated_put_archive_rejects_garbage(backend):
+    with pytest.raises(DockerError):
+        backend.put_archive('grafana-1', '/var/lib', [b'not a tar archive'])
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode='w') as tar:
+        info = tarfile.TarInfo('grafana/new.txt')
+        info.size = 2
+        tar.addfile(info, io.BytesIO(b'ok'))
+    backend.put_archive('grafana-1', '/var/lib', [archive.getvalue()])
+    assert files(backend)['/var/lib/grafana/new.txt'] == b'ok'
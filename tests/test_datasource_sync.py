@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""Unit tests of grafana_lib.datasource_sync against a local stub of the Grafana API.
+
+"""
+
+import pytest
+
+from grafana_lib.client import GrafanaClient
+from grafana_lib.datasource_sync import diff_fields, plan, sync
+from grafana_stub import GrafanaStub
+
+
+CURRENT = {'1': [{'id': 1, 'orgId': 1, 'name': 'graphite', 'type': 'graphite', 'url': 'http://graphite',
+                  'access': 'proxy', 'jsonData': {'graphiteVersion': '1.1'}},
+                 {'id': 2, 'orgId': 1, 'name': 'obsolete', 'type': 'graphite', 'url': 'http://old'}],
+           '2': [{'id': 3, 'orgId': 2, 'uid': 'prom', 'name': 'prometheus', 'type': 'prometheus',
+                  'url': 'http://prometheus:9090', 'access': 'proxy', 'jsonData': {}}]}
+
+# Fields of the full models missing from the listing
+DETAILS = {1: {'basicAuthUser': 'grafana', 'withCredentials': False, 'secureJsonFields': {'basicAuthPassword': True},
+               'version': 4},
+           2: {'basicAuthUser': '', 'version': 1},
+           3: {'basicAuthUser': '', 'version': 2}}
+
+DESIRED = {1: [{'name': 'graphite', 'type': 'graphite', 'url': 'http://graphite', 'access': 'proxy',
+                'basicAuthPassword': 'secret'}],
+           2: [{'uid': 'prom', 'name': 'prometheus', 'type': 'prometheus', 'url': 'http://prometheus:9090',
+                'jsonData': {}}]}
+
+
+def full_model(datasource_id: int):
+    for datasources in CURRENT.values():
+        for datasource in datasources:
+            if datasource['id'] == datasource_id:
+                return 200, dict(datasource, **DETAILS[datasource_id])
+    return 404, {'message': 'Data source not found'}
+
+
+@pytest.fixture
+def stub():
+    with GrafanaStub() as grafana_stub:
+        grafana_stub.routes[('GET', '/api/datasources')] = \
+            lambda request: (200, CURRENT[request.headers['X-Grafana-Org-Id']])
+        grafana_stub.routes[('GET', '*')] = lambda request: full_model(int(request.path.rsplit('/', 1)[1]))
+        for method in ('POST', 'PUT', 'DELETE'):
+            grafana_stub.routes[(method, '*')] = lambda request: (200, {'message': 'ok'})
+        yield grafana_stub
+
+
+def test_diff_fields():
+    current = {'url': 'http://a', 'jsonData': {'timeInterval': '10s', 'added': 'by grafana'}}
+    assert diff_fields({'url': 'http://a', 'jsonData': {'timeInterval': '10s'}, 'password': 'x'}, current) == []
+    assert diff_fields({'url': 'http://b', 'jsonData': {'timeInterval': '5s'}}, current) == \
+        ['jsonData.timeInterval', 'url']
+
+
+def test_plan():
+    desired = [{'name': 'graphite', 'url': 'http://graphite:8080', 'jsonData': {'graphiteVersion': '1.1'}},
+               {'name': 'influxdb', 'type': 'influxdb', 'url': 'http://influxdb'}]
+    actions = plan(1, desired, CURRENT['1'], prune=True)
+    assert [str(action) for action in actions] == ['org 1: update graphite (url)', 'org 1: create influxdb',
+                                                   'org 1: delete obsolete']
+    assert actions[0].datasource['type'] == 'graphite'
+    assert actions[0].datasource_id == 1
+
+
+def test_plan_matches_by_name_without_uid():
+    actions = plan(1, [{'uid': 'graphite', 'name': 'graphite', 'url': 'http://graphite'}], CURRENT['1'])
+    assert [(action.kind, action.datasource_id, action.changes) for action in actions] == [('update', 1, ['uid'])]
+
+
+def test_update_keeps_fields_missing_from_listing(stub):
+    desired = {1: [{'name': 'graphite', 'url': 'http://graphite:8080', 'basicAuthUser': 'grafana'}],
+               2: [{'uid': 'prom', 'name': 'prometheus', 'basicAuthUser': ''}]}
+    with GrafanaClient(stub.host, stub.port, 'admin', 'admin') as client:
+        report = sync(client, desired)
+    # basicAuthUser is only in the full models: read, then found unchanged
+    assert report['plan'] == ['org 1: update graphite (url)']
+    [update] = [request for request in stub.requests if request.method == 'PUT']
+    assert update.body['basicAuthUser'] == 'grafana' and update.body['version'] == 4
+    assert update.body['withCredentials'] is False and update.body['url'] == 'http://graphite:8080'
+    assert sorted(request.path for request in stub.requests if request.method == 'GET') == \
+        ['/api/datasources', '/api/datasources', '/api/datasources/1', '/api/datasources/3']
+
+
+def test_unchanged_config_makes_no_write(stub):
+    with GrafanaClient(stub.host, stub.port, 'admin', 'admin') as client:
+        report = sync(client, DESIRED)
+    assert report == {'plan': [], 'results': []}
+    assert sorted((request.method, request.headers['X-Grafana-Org-Id']) for request in stub.requests) == \
+        [('GET', '1'), ('GET', '2')]
+
+
+def test_sync(stub):
+    desired = {1: [{'name': 'graphite', 'url': 'http://graphite:8080'}],
+               2: [{'uid': 'prom', 'name': 'prometheus', 'url': 'http://prometheus:9090'},
+                   {'name': 'loki', 'type': 'loki', 'url': 'http://loki'}]}
+    with GrafanaClient(stub.host, stub.port, 'admin', 'admin') as client:
+        report = sync(client, desired, prune=True, workers=4)
+    assert [result['status'] for result in report['results']] == ['done'] * 3
+    writes = sorted((request.method, request.path, request.headers['X-Grafana-Org-Id'])
+                    for request in stub.requests if request.method != 'GET')
+    assert writes == [('DELETE', '/api/datasources/2', '1'), ('POST', '/api/datasources', '2'),
+                      ('PUT', '/api/datasources/1', '1')]
+
+
+def test_dry_run(stub):
+    with GrafanaClient(stub.host, stub.port, 'admin', 'admin') as client:
+        report = sync(client, {1: []}, prune=True, dry_run=True)
+    assert report == {'plan': ['org 1: delete graphite', 'org 1: delete obsolete'], 'results': []}
+    assert [request.method for request in stub.requests] == ['GET']
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+"""Unit tests of docker_lib.docker_tools against a fake docker executable.
+
+"""
+
+import json
+import os
+import stat
+import sys
+import time
+
+import pytest
+
+from docker_lib.backends import ARCHIVE_BUFFER_SIZE, DockerError, ShBackend
+from docker_lib.docker_tools import Container
+
+
+FAKE_DOCKER = """#!{python}
+import json
+import os
+import sys
+import time
+
+args = sys.argv[1:]
+with open(os.environ['FAKE_DOCKER_CALLS'], 'a') as calls:
+    calls.write(' '.join(args[:1]) + '\\n')
+if args[0] == 'events':
+    if os.environ.get('FAKE_DOCKER_EVENTS_FAIL'):
+        sys.exit(1)
+    for line in os.environ.get('FAKE_DOCKER_EVENTS', '').split('|'):
+        if line:
+            print(line, flush=True)
+    time.sleep(float(os.environ.get('FAKE_DOCKER_EVENTS_LINGER', '0')))
+elif args[0] == 'inspect':
+    state = {{'Status': os.environ.get('FAKE_DOCKER_STATUS', 'running'), 'Pid': 42,
+             'StartedAt': '2018-05-14T13:39:30.850190Z', 'FinishedAt': '0001-01-01T00:00:00Z',
+             'Health': {{'Status': 'healthy'}}}}
+    print(json.dumps([{{'Name': '/' + name, 'RestartCount': 2, 'State': state}} for name in args[1:]]))
+elif args[0] == 'cp' and args[1] == '-':
+    with open(os.environ['FAKE_DOCKER_RESTORED'], 'wb') as restored:
+        restored.write(sys.stdin.buffer.read())
+elif args[0] == 'cp':
+    if not os.path.exists(os.environ['FAKE_DOCKER_ARCHIVE']):
+        sys.stderr.write('Error: No such container:path: ' + args[1])
+        sys.exit(1)
+    with open(os.environ['FAKE_DOCKER_ARCHIVE'], 'rb') as archive:
+        data = archive.read()
+    # Writes 64 KiB at a time, recording the number of bytes written
+    for offset in range(0, len(data), 65536):
+        sys.stdout.buffer.write(data[offset:offset + 65536])
+        sys.stdout.buffer.flush()
+        if os.environ.get('FAKE_DOCKER_ARCHIVE_PROGRESS'):
+            with open(os.environ['FAKE_DOCKER_ARCHIVE_PROGRESS'] + '.tmp', 'w') as progress:
+                progress.write(str(offset + 65536))
+            os.replace(os.environ['FAKE_DOCKER_ARCHIVE_PROGRESS'] + '.tmp', os.environ['FAKE_DOCKER_ARCHIVE_PROGRESS'])
+"""
+
+
+@pytest.fixture
+def fake_docker(tmpdir, monkeypatch):
+    script = tmpdir.join('docker')
+    script.write(FAKE_DOCKER.format(python=sys.executable))
+    os.chmod(str(script), os.stat(str(script)).st_mode | stat.S_IEXEC)
+    calls = tmpdir.join('calls')
+    calls.write('')
+    monkeypatch.setenv('PATH', '{}{}{}'.format(tmpdir, os.pathsep, os.environ['PATH']))
+    monkeypatch.setenv('FAKE_DOCKER_CALLS', str(calls))
+    monkeypatch.setattr(Container, 'POLL_INTERVAL', 0.05)
+    monkeypatch.setattr(Container, '_cache', {})
+    return lambda: calls.read().split()
+
+
+def test_start_returns_on_event(fake_docker, monkeypatch):
+    monkeypatch.setenv('FAKE_DOCKER_EVENTS', json.dumps({'status': 'start', 'id': 'abc', 'Action': 'start'}))
+    monkeypatch.setenv('FAKE_DOCKER_EVENTS_LINGER', '5')
+    begin = time.monotonic()
+    Container.start('grafana-1', 10)
+    assert time.monotonic() - begin < 1
+    assert fake_docker() == ['start', 'events']
+
+
+def test_stop_times_out_without_event(fake_docker, monkeypatch):
+    monkeypatch.setenv('FAKE_DOCKER_STATUS', 'running')
+    with pytest.raises(TimeoutError):
+        Container.stop('grafana-1', 0)
+
+
+def test_fallback_to_polling(fake_docker, monkeypatch):
+    monkeypatch.setenv('FAKE_DOCKER_EVENTS_FAIL', '1')
+    monkeypatch.setenv('FAKE_DOCKER_STATUS', 'exited')
+    Container.stop('grafana-1', 10)
+    assert fake_docker() == ['stop', 'events', 'inspect']
+
+
+def test_inspect_many_single_call(fake_docker):
+    states = Container.inspect_many(['grafana-1', 'grafana-2', 'grafana-1'])
+    assert fake_docker() == ['inspect']
+    assert sorted(states) == ['grafana-1', 'grafana-2']
+    state = states['grafana-2']
+    assert (state.status, state.restart_count, state.health, state.pid) == ('running', 2, 'healthy', 42)
+    assert Container.started_at('grafana-1') == ('2018-05-14 13:39:30', 1526305170.85019)
+    assert Container.status('grafana-2') == 'running'
+    assert fake_docker() == ['inspect']
+
+
+def test_state_changes_invalidate_cache(fake_docker, monkeypatch):
+    monkeypatch.setenv('FAKE_DOCKER_EVENTS_FAIL', '1')
+    assert Container.status('grafana-1') == 'running'
+    monkeypatch.setenv('FAKE_DOCKER_STATUS', 'exited')
+    assert Container.status('grafana-1') == 'running'
+    Container.stop('grafana-1', 10)
+    assert Container.status('grafana-1') == 'exited'
+    assert fake_docker() == ['inspect', 'stop', 'events', 'inspect']
+    assert Container.inspect('grafana-1', max_age=0).status == 'exited'
+    assert fake_docker()[-1] == 'inspect' and len(fake_docker()) == 5
+
+
+def test_sh_backend_archive(fake_docker, tmpdir, monkeypatch):
+    data = bytes(range(256)) * 8192 + b'\r\n\x00'
+    tmpdir.join('archive.tar').write_binary(data)
+    monkeypatch.setenv('FAKE_DOCKER_ARCHIVE', str(tmpdir.join('archive.tar')))
+    monkeypatch.setenv('FAKE_DOCKER_RESTORED', str(tmpdir.join('restored.tar')))
+    backend = ShBackend()
+    assert b''.join(backend.get_archive('grafana-1', '/var/lib/grafana')) == data
+    backend.put_archive('grafana-1', '/var/lib', (data[offset:offset + 65536] for offset in range(0, len(data), 65536)))
+    assert tmpdir.join('restored.tar').read_binary() == data
+
+    monkeypatch.setenv('FAKE_DOCKER_ARCHIVE', str(tmpdir.join('missing.tar')))
+    with pytest.raises(DockerError) as e:
+        list(backend.get_archive('grafana-1', '/var/lib/grafana'))
+    assert e.value.exit_code == 1
+
+
+def test_sh_backend_archive_is_streamed(fake_docker, tmpdir, monkeypatch):
+    data = os.urandom(16 * ARCHIVE_BUFFER_SIZE)
+    tmpdir.join('archive.tar').write_binary(data)
+    progress = tmpdir.join('progress')
+    monkeypatch.setenv('FAKE_DOCKER_ARCHIVE', str(tmpdir.join('archive.tar')))
+    monkeypatch.setenv('FAKE_DOCKER_ARCHIVE_PROGRESS', str(progress))
+    chunks = ShBackend().get_archive('grafana-1', '/var/lib/grafana')
+    first = next(chunks)
+    # docker cp blocks while the chunks are not consumed: the archive is never buffered
+    time.sleep(0.5)
+    assert int(progress.read()) < 3 * ARCHIVE_BUFFER_SIZE
+    rest = list(chunks)
+    assert first + b''.join(rest) == data
+    assert max(len(chunk) for chunk in [first] + rest) <= ARCHIVE_BUFFER_SIZE
+
+    # Closing the generator stops docker cp
+    chunks = ShBackend().get_archive('grafana-1', '/var/lib/grafana')
+    next(chunks)
+    chunks.close()
+    assert int(progress.read()) < 3 * ARCHIVE_BUFFER_SIZE
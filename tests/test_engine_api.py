@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+"""Unit tests of docker_lib.engine_api against a fake Engine API server listening on a unix socket.
+
+"""
+
+import http.server
+import json
+import os
+import socketserver
+import struct
+import tempfile
+import threading
+
+import pytest
+
+from docker_lib.backends import DockerError, EngineBackend
+from docker_lib.engine_api import EngineAPIError, EngineClient, demultiplex
+
+
+def frame(stream_type: int, payload: bytes) -> bytes:
+    return struct.pack('>BxxxL', stream_type, len(payload)) + payload
+
+
+class FakeEngineHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def address_string(self) -> str:
+        return 'unix'
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.connections += 1
+
+    def _send_json(self, status: int, body) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path == '/containers/grafana-1/json':
+            self._send_json(200, {'State': {'Status': 'running', 'StartedAt': '2018-05-15T12:09:54.5Z'}})
+        elif self.path == '/exec/exec-1/json':
+            self._send_json(200, {'ExitCode': self.server.exit_code})
+        elif self.path == '/containers/grafana-1/archive?path=%2Fvar%2Flib%2Fgrafana':
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-tar')
+            self.send_header('Content-Length', str(len(self.server.archive)))
+            self.end_headers()
+            self.wfile.write(self.server.archive)
+        else:
+            self._send_json(404, {'message': 'No such container: {}'.format(self.path.split('/')[2])})
+
+    def do_PUT(self) -> None:
+        # Chunked transfer encoding: hexadecimal size, payload, until a chunk of size 0
+        data = b''
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            data += self.rfile.read(size)
+            self.rfile.readline()
+            if size == 0:
+                break
+        self.server.requests.append((self.path, data))
+        if self.path.startswith('/containers/grafana-1/archive'):
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self._send_json(404, {'message': 'No such container: {}'.format(self.path.split('/')[2])})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length).decode('utf-8')) if length else None
+        self.server.requests.append((self.path, body))
+        if self.path in ('/containers/grafana-1/start', '/containers/grafana-1/stop?t=5'):
+            self.send_response(204)
+            self.end_headers()
+        elif self.path == '/containers/grafana-1/exec':
+            self._send_json(201, {'Id': 'exec-1'})
+        elif self.path == '/exec/exec-1/start':
+            # The daemon hijacks the connection and closes it at the end of the stream
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/vnd.docker.raw-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.wfile.write(frame(1, b'"active"\n') + frame(2, b'warning\n'))
+            self.close_connection = True
+        else:
+            self._send_json(404, {'message': 'page not found'})
+
+
+class FakeEngineServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str):
+        super().__init__(socket_path, FakeEngineHandler)
+        self.connections = 0
+        self.requests = []
+        self.exit_code = 0
+        self.archive = b''
+
+
+@pytest.fixture
+def engine():
+    directory = tempfile.mkdtemp()
+    server = FakeEngineServer(os.path.join(directory, 'docker.sock'))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_inspect_reuses_connection(engine):
+    client = EngineClient(engine.server_address)
+    for _ in range(5):
+        assert client.inspect('grafana-1')['State']['Status'] == 'running'
+    assert engine.connections == 1
+
+
+def test_start_stop(engine):
+    client = EngineClient(engine.server_address)
+    client.start('grafana-1')
+    client.stop('grafana-1', 5)
+    assert [path for path, _ in engine.requests] == ['/containers/grafana-1/start', '/containers/grafana-1/stop?t=5']
+
+
+def test_error_status(engine):
+    client = EngineClient(engine.server_address)
+    with pytest.raises(EngineAPIError) as e:
+        client.inspect('unknown')
+    assert e.value.status == 404
+    assert 'No such container' in e.value.message
+
+
+def test_exec_run(engine):
+    client = EngineClient(engine.server_address)
+    exit_code, stdout, stderr = client.exec_run('grafana-1', ['busctl', 'get-property'])
+    assert (exit_code, stdout, stderr) == (0, b'"active"\n', b'warning\n')
+    assert engine.requests[0][1]['Cmd'] == ['busctl', 'get-property']
+
+
+def test_backend_exec_failure(engine):
+    engine.exit_code = 3
+    backend = EngineBackend(EngineClient(engine.server_address))
+    with pytest.raises(DockerError) as e:
+        backend.exec('grafana-1', 'systemctl', 'kill', 'nginx.service')
+    assert e.value.exit_code == 3
+
+
+def test_demultiplex_truncated_frame():
+    assert demultiplex(frame(1, b'abc') + b'\x01\x00') == (b'abc', b'')
+
+
+def test_archive(engine):
+    engine.archive = bytes(range(256)) * 1000
+    backend = EngineBackend(EngineClient(engine.server_address))
+    assert b''.join(backend.get_archive('grafana-1', '/var/lib/grafana')) == engine.archive
+    backend.put_archive('grafana-1', '/var/lib', iter([b'abc', b'def']))
+    assert engine.requests[-1] == ('/containers/grafana-1/archive?path=%2Fvar%2Flib', b'abcdef')
+    with pytest.raises(DockerError) as e:
+        backend.put_archive('unknown', '/var/lib', [b'abc'])
+    assert 'No such container' in str(e.value)
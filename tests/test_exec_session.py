@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""Unit tests of docker_lib.exec_session. A fake docker executable runs the shell on the local host.
+
+"""
+
+import concurrent.futures
+import os
+import stat
+
+import pytest
+
+from docker_lib.backends import DockerError
+from docker_lib.exec_session import ExecSession
+
+
+FAKE_DOCKER = """#!/bin/sh
+# docker exec -i <container> <shell>
+echo started >> {launches}
+exec "$4"
+"""
+
+
+@pytest.fixture
+def session(tmpdir):
+    launches = tmpdir.join('launches')
+    launches.write('')
+    script = tmpdir.join('docker')
+    script.write(FAKE_DOCKER.format(launches=launches))
+    os.chmod(str(script), os.stat(str(script)).st_mode | stat.S_IEXEC)
+    exec_session = ExecSession('grafana-1', docker=str(script))
+    exec_session.launches = lambda: len(launches.read().split())
+    yield exec_session
+    exec_session.close()
+
+
+def test_commands_share_one_shell(session):
+    assert session.run('echo', 'hello world') == b'hello world\n'
+    assert session.run('printf', 'no new line') == b'no new line'
+    assert session.run('true') == b''
+    assert session.launches() == 1
+
+
+def test_exit_code_and_stderr(session):
+    with pytest.raises(DockerError) as e:
+        session.run('sh', '-c', 'echo out; echo err >&2; exit 3')
+    assert (e.value.exit_code, e.value.stdout, e.value.stderr) == (3, b'out\n', b'err\n')
+    assert session.run('echo', 'next') == b'next\n'
+
+
+def test_stderr_without_new_line(session):
+    with pytest.raises(DockerError) as e:
+        session.run('sh', '-c', 'printf err >&2; exit 1')
+    assert (e.value.exit_code, e.value.stderr) == (1, b'err')
+    with pytest.raises(DockerError) as e:
+        session.run('sh', '-c', 'echo; echo err >&2; exit 2')
+    assert e.value.stderr == b'err\n'
+
+
+def test_concurrent_use(session):
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda i: session.run('echo', str(i)), range(50)))
+    assert results == ['{}\n'.format(i).encode('utf-8') for i in range(50)]
+    assert session.launches() == 1
+
+
+def test_reconnect_after_shell_died(session):
+    session.run('true')
+    session._process.kill()
+    session._process.wait()
+    assert session.run('echo', 'back') == b'back\n'
+    assert session.launches() == 2
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""Unit tests of grafana_lib.client against a local stub of the Grafana API.
+
+"""
+
+import base64
+
+import pytest
+import requests
+
+from grafana_lib.client import GrafanaClient, GrafanaError
+from grafana_stub import GrafanaStub
+
+
+@pytest.fixture
+def stub():
+    with GrafanaStub() as grafana_stub:
+        yield grafana_stub
+
+
+def test_keep_alive_and_basic_auth(stub):
+    stub.routes[('GET', '/api/admin/stats')] = lambda request: (200, {'dashboards': 3})
+    with GrafanaClient(stub.host, stub.port, 'admin', 'secret') as client:
+        for _ in range(5):
+            assert client.get_admin_stats() == {'dashboards': 3}
+    assert stub.connections == 1
+    expected = 'Basic {}'.format(base64.b64encode(b'admin:secret').decode('ascii'))
+    assert all(request.headers['Authorization'] == expected for request in stub.requests)
+
+
+def test_retry_on_server_error(stub):
+    answers = iter([(503, {'message': 'busy'}), (502, {'message': 'busy'}), (200, [{'id': 1}])])
+    stub.routes[('GET', '/api/datasources')] = lambda request: next(answers)
+    with GrafanaClient(stub.host, stub.port, backoff_factor=0) as client:
+        assert client.list_datasources() == [{'id': 1}]
+    assert len(stub.requests) == 3
+
+
+def test_post_is_not_retried(stub):
+    stub.routes[('POST', '/api/datasources')] = lambda request: (500, {'message': 'database is locked'})
+    with GrafanaClient(stub.host, stub.port, backoff_factor=0) as client:
+        with pytest.raises(GrafanaError) as e:
+            client.create_datasource({'name': 'graphite'})
+    assert (e.value.status_code, e.value.message) == (500, 'database is locked')
+    assert len(stub.requests) == 1
+
+
+def test_change_password(stub):
+    stub.routes[('PUT', '/api/user/password')] = lambda request: (200, {'message': 'User password changed'})
+    with GrafanaClient(stub.host, stub.port, 'admin', 'admin', org_id=2) as client:
+        client.change_password('admin', 'secret')
+    request = stub.requests[0]
+    assert request.body == {'oldPassword': 'admin', 'newPassword': 'secret', 'confirmNew': 'secret'}
+    assert request.headers['X-Grafana-Org-Id'] == '2'
+
+
+def test_connection_error():
+    with GrafanaClient('127.0.0.1', 1, retries=1, backoff_factor=0) as client:
+        with pytest.raises(requests.exceptions.ConnectionError):
+            client.get_admin_settings()
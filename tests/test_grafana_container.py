@@ -11,7 +11,9 @@ __copyright__ = 'Copyright 2018, ELCA'
 import logging
 import pytest
 
+from docker_lib.backends import get_backend
 from docker_lib.docker_tools import Container
+from systemd_lib.journal_tools import JournalReader
 from systemd_lib.systemd_tools import Systemd
 
 
@@ -38,15 +40,17 @@ class TestContainerGrafana:
         assert expected_status in current_status
 
     @pytest.mark.parametrize('systemd_service', ['grafana-server.service', 'monit.service', 'nginx.service'])
-    def test_services(self, container_name: str, systemd_service: str) -> None:
+    def test_services(self, container_name: str, systemd_service: str, unit_snapshots: dict) -> None:
         """
         Checks that grafana-server, monit, and nginx are running when the container starts.
         :param container_name: from tests_config/dev.json
         :param systemd_service: service to check
+        :param unit_snapshots: state of the services read once per container
         :return:
         """
-        assert Systemd.is_service_running(container_name, systemd_service) is True
+        assert unit_snapshots[container_name][systemd_service].active_state == 'active'
 
+    @pytest.mark.destructive
     @pytest.mark.parametrize('cmd', ['stop', 'kill'])
     @pytest.mark.parametrize('systemd_service', ['grafana-server.service', 'nginx.service'])
     def test_restart_service_with_monit(self, container_name: str, cmd: str, systemd_service: str,
@@ -55,10 +59,13 @@ class TestContainerGrafana:
                                                                                             systemd_service)
         logger.info("Service {service} running since {timestamp} UTC. "
                     "Let's {cmd} it.".format(service=systemd_service, timestamp=timestamp, cmd=cmd))
+        stopped_at = get_backend().time()
         Systemd.systemctl(container_name, cmd, systemd_service)
 
         try:
-            Systemd.wait_until_service_is_restarted(container_name, systemd_service, monit_timeout)
+            latency = Systemd.wait_until_service_is_restarted(container_name, systemd_service, monit_timeout,
+                                                              previous_timestamp=timestamp_before_restart_in_seconds,
+                                                              since=stopped_at)
         except TimeoutError:
             pytest.fail('Service {service} did not restart after {delay} second(s)'.format(service=systemd_service,
                                                                                            delay=monit_timeout))
@@ -66,8 +73,10 @@ class TestContainerGrafana:
         timestamp, timestamp_after_restart_in_seconds = Systemd.get_active_enter_timestamp(container_name,
                                                                                            systemd_service)
         assert timestamp_before_restart_in_seconds < timestamp_after_restart_in_seconds
-        logger.info('Service {service} restarted at {timestamp} UTC'.format(service=systemd_service, timestamp=timestamp))
+        logger.info('Service {service} restarted at {timestamp} UTC after {latency:.3f} second(s)'.format(
+            service=systemd_service, timestamp=timestamp, latency=latency))
 
+    @pytest.mark.destructive
     @pytest.mark.parametrize('systemd_service', ['monit.service'])
     def test_restart_service_with_systemd(self, container_name: str, systemd_service: str,
                                           systemd_timeout: int) -> None:
@@ -75,10 +84,13 @@ class TestContainerGrafana:
                                                                                             systemd_service)
         logger.info("Service {service} running since {timestamp} UTC. "
                     "Let's kill it.".format(service=systemd_service, timestamp=timestamp))
+        stopped_at = get_backend().time()
         Systemd.systemctl(container_name, 'kill', systemd_service)
 
         try:
-            Systemd.wait_until_service_is_restarted(container_name, systemd_service, systemd_timeout)
+            latency = Systemd.wait_until_service_is_restarted(container_name, systemd_service, systemd_timeout,
+                                                              previous_timestamp=timestamp_before_restart_in_seconds,
+                                                              since=stopped_at)
         except TimeoutError:
             pytest.fail('Service {service} did not restart after {delay} second(s)'.format(service=systemd_service,
                                                                                            delay=systemd_timeout))
@@ -86,8 +98,10 @@ class TestContainerGrafana:
         timestamp, timestamp_after_restart_in_seconds = Systemd.get_active_enter_timestamp(container_name,
                                                                                            systemd_service)
         assert timestamp_before_restart_in_seconds < timestamp_after_restart_in_seconds
-        logger.info('Service {service} restarted at {timestamp} UTC'.format(service=systemd_service, timestamp=timestamp))
+        logger.info('Service {service} restarted at {timestamp} UTC after {latency:.3f} second(s)'.format(
+            service=systemd_service, timestamp=timestamp, latency=latency))
 
+    @pytest.mark.destructive
     def test_monit_logs(self, container_name: str, monit_timeout: int, docker_timeout: int) -> None:
         """
         Checks that there is no error in the logs of monit.
@@ -105,6 +119,7 @@ class TestContainerGrafana:
         :return:
         """
         timestamp, timestamp_before_stop_in_seconds = Container.started_at(container_name)
+        _, previous_timestamp = Systemd.get_active_enter_timestamp(container_name, 'grafana-server.service')
         logger.info("Container {container} running since {timestamp} UTC. "
                     "Let's restart it.".format(container=container_name, timestamp=timestamp))
         try:
@@ -114,7 +129,8 @@ class TestContainerGrafana:
                                                                                                delay=docker_timeout))
 
         try:
-            Systemd.wait_until_service_is_restarted(container_name, 'grafana-server.service', monit_timeout)
+            Systemd.wait_until_service_is_restarted(container_name, 'grafana-server.service', monit_timeout,
+                                                    previous_timestamp=previous_timestamp)
         except TimeoutError:
             pytest.fail('Service grafana-server did not restart after {delay} second(s)'.format(delay=monit_timeout))
 
@@ -123,6 +139,5 @@ class TestContainerGrafana:
                                                                                 timestamp=timestamp))
         assert timestamp_before_stop_in_seconds < timestamp_after_restart_in_seconds
 
-        monit_log = Systemd.list_errors_not_older_than(container_name, 'monit', timestamp)
-        expected_substring = 'no entries'
-        assert expected_substring in monit_log.lower()
+        monit_errors = list(JournalReader(container_name, ['monit'], priority='err').messages(since=timestamp))
+        assert monit_errors == []
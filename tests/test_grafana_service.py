@@ -10,10 +10,10 @@ __copyright__ = 'Copyright 2018, ELCA'
 
 import logging
 import pytest
-import requests
-import urllib.parse
 import uuid
 
+from grafana_lib.client import GrafanaClient
+from grafana_lib.metrics_scraper import delta, scrape
 from http import HTTPStatus
 from typing import Tuple
 
@@ -25,25 +25,48 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+HTTP_DURATION = 'grafana_http_request_duration_seconds'
+# Seconds
+SEARCH_P99_BUDGET = 0.5
+
 
 @pytest.mark.usefixtures('default_credentials', 'host', 'port')
 class TestServiceGrafana:
 
     @pytest.mark.parametrize('get_method', ['/api/admin/settings', '/api/admin/stats'])
     def test_admin_api_wo_credentials(self, get_method, host: str, port: str) -> None:
-        base = 'http://{host}:{port}'.format(host=host, port=port)
-        url = urllib.parse.urljoin(base, get_method)
-        response = requests.get(url)
+        with GrafanaClient(host, port) as client:
+            response = client.request('GET', get_method)
         assert response.status_code == HTTPStatus.UNAUTHORIZED
 
     @pytest.mark.parametrize('get_method', ['/api/admin/settings', '/api/admin/stats'])
     def test_admin_api(self, get_method, default_credentials: Tuple[str, str], host: str, port: str) -> None:
         username, password = default_credentials
-        base = 'http://{user}:{password}@{host}:{port}'.format(user=username, password=password, host=host, port=port)
-        url = urllib.parse.urljoin(base, get_method)
-        response = requests.get(url)
+        with GrafanaClient(host, port, username, password) as client:
+            response = client.request('GET', get_method)
         assert response.status_code == HTTPStatus.OK
 
+    def test_search_latency_budget(self, default_credentials: Tuple[str, str], host: str, port: str) -> None:
+        """
+        The 99th percentile of the /api/search requests after a warm-up, read from /metrics, stays under
+        SEARCH_P99_BUDGET seconds
+        """
+        username, password = default_credentials
+        with GrafanaClient(host, port, username, password) as client:
+            for _ in range(20):
+                client.get('/api/search')
+            before = scrape(client, [HTTP_DURATION])
+            for _ in range(100):
+                client.get('/api/search')
+            window = delta(before, scrape(client, [HTTP_DURATION]))
+        handlers = {sample.labels.get('handler') for sample in window.samples('{}_count'.format(HTTP_DURATION))}
+        handler = next((handler for handler in handlers if (handler or '').rstrip('/') == '/api/search'), None)
+        if handler is None:
+            pytest.skip('{} of /api/search not exposed'.format(HTTP_DURATION))
+        p99 = window.quantile(HTTP_DURATION, 0.99, handler=handler)
+        logger.info('p99 of /api/search: {p99} s'.format(p99=p99))
+        assert p99 is not None and p99 < SEARCH_P99_BUDGET
+
     def test_data_source_api(self, default_credentials: Tuple[str, str], host: str, port: str) -> None:
         """
 
@@ -54,43 +77,41 @@ class TestServiceGrafana:
         :return:
         """
         username, password = default_credentials
-        base = 'http://{user}:{password}@{host}:{port}'.format(user=username, password=password, host=host, port=port)
-        url = urllib.parse.urljoin(base, '/api/datasources')
-        name = str(uuid.uuid4())
-        data = {'name': name,
-                'type': 'graphite',
-                'url': 'http://mydatasource.com',
-                'access': 'proxy',
-                'basicAuth': False}
-        response = requests.post(url, json=data)
-        assert response.status_code == HTTPStatus.OK
-        datasource_id = response.json().get('id')
-        assert id, 'undefined id'
-        logger.info('Data source created with id {id}'.format(id=datasource_id))
-        logger.debug(response.text)
-
-        data = {'id': datasource_id,
-                'orgId': datasource_id,
-                'name': name,
-                'type': 'graphite',
-                'access': 'proxy',
-                'url': 'http://mydatasource.com',
-                'password': '',
-                'user': '',
-                'database': '',
-                'basicAuth': True,
-                'basicAuthUser': 'basicuser',
-                'basicAuthPassword': 'basicuser',
-                'isDefault': False,
-                'jsonData': None}
-        url = urllib.parse.urljoin(base, '/api/datasources/{}'.format(datasource_id))
-        response = requests.put(url, json=data)
-        assert response.status_code == HTTPStatus.OK
-        logger.info('Data source {id} updated'.format(id=datasource_id))
-        logger.debug(response.text)
+        with GrafanaClient(host, port, username, password) as client:
+            name = str(uuid.uuid4())
+            data = {'name': name,
+                    'type': 'graphite',
+                    'url': 'http://mydatasource.com',
+                    'access': 'proxy',
+                    'basicAuth': False}
+            response = client.request('POST', '/api/datasources', json=data)
+            assert response.status_code == HTTPStatus.OK
+            datasource_id = response.json().get('id')
+            assert datasource_id, 'undefined id'
+            logger.info('Data source created with id {id}'.format(id=datasource_id))
+            logger.debug(response.text)
 
-        response = requests.delete(url)
-        assert response.status_code == HTTPStatus.OK
-        logger.info('Data source {id} deleted'.format(id=datasource_id))
-        logger.debug(response.text)
+            data = {'id': datasource_id,
+                    'orgId': datasource_id,
+                    'name': name,
+                    'type': 'graphite',
+                    'access': 'proxy',
+                    'url': 'http://mydatasource.com',
+                    'password': '',
+                    'user': '',
+                    'database': '',
+                    'basicAuth': True,
+                    'basicAuthUser': 'basicuser',
+                    'basicAuthPassword': 'basicuser',
+                    'isDefault': False,
+                    'jsonData': None}
+            path = '/api/datasources/{}'.format(datasource_id)
+            response = client.request('PUT', path, json=data)
+            assert response.status_code == HTTPStatus.OK
+            logger.info('Data source {id} updated'.format(id=datasource_id))
+            logger.debug(response.text)
 
+            response = client.request('DELETE', path)
+            assert response.status_code == HTTPStatus.OK
+            logger.info('Data source {id} deleted'.format(id=datasource_id))
+            logger.debug(response.text)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+"""Unit tests of metrics_lib.histogram.
+
+"""
+
+import random
+
+import pytest
+
+from metrics_lib.histogram import Histogram
+
+
+def test_relative_error():
+    histogram = Histogram(significant_digits=2)
+    values = sorted(random.Random(1).randint(1, 10 ** 8) for _ in range(20000))
+    for value in values:
+        histogram.record(value)
+    for percentile in (50, 90, 99, 99.9):
+        exact = values[int(len(values) * percentile / 100) - 1]
+        assert histogram.value_at_percentile(percentile) == pytest.approx(exact, rel=0.01)
+    assert (histogram.min, histogram.max, histogram.total_count) == (values[0], values[-1], 20000)
+    assert histogram.value_at_percentile(100) == values[-1]
+
+
+def test_small_values_are_exact():
+    histogram = Histogram()
+    for value in range(200):
+        histogram.record(value)
+    assert histogram.percentiles((50, 100)) == {'p50': 99, 'p100': 199}
+
+
+def test_merge():
+    first, second = Histogram(), Histogram()
+    first.record_seconds(0.001)
+    second.record(3000, count=3)
+    first.merge(second)
+    assert (first.total_count, first.min, first.max, first.mean) == (4, 1000, 3000, 2500)
+    assert Histogram().value_at_percentile(50) is None
+    with pytest.raises(ValueError):
+        first.merge(Histogram(significant_digits=3))
+    with pytest.raises(ValueError):
+        first.record(-1)
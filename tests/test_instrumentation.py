@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""Unit tests of metrics_lib.instrumentation and of its pytest plugin.
+
+"""
+
+import threading
+
+import pytest
+
+from docker_lib import backends
+from docker_lib.backends import InstrumentedBackend, get_backend, set_backend
+from docker_lib.simulated_backend import SimulatedBackend
+from grafana_lib.client import GrafanaClient
+from grafana_stub import GrafanaStub
+from metrics_lib import instrumentation
+from metrics_lib.histogram import Histogram
+from metrics_lib.instrumentation import OperationStats, Registry, command_name, docker_operation, \
+    http_operation
+from systemd_lib.systemd_tools import Systemd
+
+pytest_plugins = 'pytester'
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    fresh_registry = Registry()
+    monkeypatch.setattr(instrumentation, '_registry', fresh_registry)
+    return fresh_registry
+
+
+def test_operation_names():
+    assert command_name(['sh', '-c', 'echo @unit; busctl get-property a b c ActiveState; true']) == 'busctl'
+    assert command_name(['sh', '-c', "timeout 10 busctl monitor --match 'x' & sleep 0.1; wait"]) == 'busctl'
+    assert command_name(['systemctl', 'kill', 'nginx.service']) == 'systemctl'
+    assert docker_operation(('exec', '-i', 'grafana-1', 'journalctl', '-o', 'json')) == 'docker.exec.journalctl'
+    assert docker_operation(('inspect', 'grafana-1')) == 'docker.inspect'
+    assert http_operation('put', '/api/datasources/12?x=1') == 'grafana.PUT /api/datasources/:id'
+    assert http_operation('GET', '/api/dashboards/uid/abc') == 'grafana.GET /api/dashboards/uid/:uid'
+
+
+def test_timed_records_failures(registry):
+    with instrumentation.timed('docker.stop'):
+        pass
+    with pytest.raises(KeyError):
+        with instrumentation.timed('docker.stop'):
+            raise KeyError
+    stats = registry.operations['docker.stop']
+    assert (stats.count, stats.failures) == (2, 1)
+    [entry] = registry.summary()
+    assert entry['operation'] == 'docker.stop' and entry['max_ms'] >= entry['p50_ms']
+
+
+def test_export_while_recording(registry, monkeypatch):
+    errors = []
+
+    def export():
+        try:
+            registry.summary()
+            registry.to_prometheus()
+        except Exception as e:
+            errors.append(e)
+
+    exporter = threading.Thread(target=export)
+
+    class ExportingHistogram(Histogram):
+        def record_seconds(self, seconds: float) -> None:
+            # Another thread exports the statistics while the first call of the operation is being recorded
+            exporter.start()
+            exporter.join(0.2)
+            super().record_seconds(seconds)
+
+    class ExportingStats(OperationStats):
+        def __init__(self):
+            super().__init__()
+            self.histogram = ExportingHistogram()
+
+    monkeypatch.setattr(instrumentation, 'OperationStats', ExportingStats)
+    registry.record('docker.inspect', 0.01)
+    exporter.join()
+    assert errors == []
+    assert registry.summary()[0]['p50_ms'] == pytest.approx(10, rel=0.01)
+
+
+def test_instrumented_backend(registry, monkeypatch):
+    monkeypatch.setattr(backends, '_backend', backends._backend)
+    set_backend(SimulatedBackend(['grafana-1']))
+    assert isinstance(get_backend(), InstrumentedBackend)
+    Systemd.is_service_running('grafana-1', 'nginx.service')
+    Systemd.systemctl('grafana-1', 'kill', 'monit.service')
+    Systemd.wait_until_service_is_restarted('grafana-1', 'monit.service', 10)
+    with pytest.raises(backends.DockerError):
+        get_backend().inspect('grafana-2')
+    # busctl: state of nginx, ActiveEnterTimestamp of monit before the wait, then its signals and state
+    assert sorted((operation, stats.count, stats.failures) for operation, stats in registry.operations.items()) == \
+        [('docker.exec.busctl', 4, 0), ('docker.exec.kill', 1, 0), ('docker.exec.systemctl', 1, 0),
+         ('docker.inspect', 1, 1)]
+
+
+def test_grafana_requests(registry):
+    with GrafanaStub() as stub:
+        stub.routes[('GET', '/api/admin/stats')] = lambda request: (200, {})
+        with GrafanaClient(stub.host, stub.port, retries=0) as client:
+            client.get_admin_stats()
+            client.request('DELETE', '/api/datasources/3')
+    text = registry.to_prometheus()
+    assert 'grafana_tools_operation_duration_seconds_count{operation="grafana.GET /api/admin/stats"} 1\n' in text
+    assert 'grafana_tools_operation_failures_total{operation="grafana.DELETE /api/datasources/:id"} 1\n' in text
+    assert '# TYPE grafana_tools_operation_duration_seconds summary\n' in text
+    assert 'grafana_tools_operation_duration_seconds{operation="grafana.GET /api/admin/stats",quantile="0.99"}' \
+        in text
+
+
+def test_pytest_plugin(testdir):
+    testdir.makepyfile("""
+        from metrics_lib import instrumentation
+
+        def test_slow():
+            instrumentation.record('docker.exec.busctl', 0.5)
+            instrumentation.record('docker.inspect', 0.1, failed=True)
+    """)
+    metrics_file = testdir.tmpdir.join('metrics.prom')
+    result = testdir.runpytest('-p', 'metrics_lib.pytest_plugin', '--instrumentation',
+                               '--metrics-file', str(metrics_file))
+    result.stdout.fnmatch_lines(['*docker and Grafana calls*', '*0.500*docker.exec.busctl',
+                                 '*slowest calls per test*', '*test_slow*2 calls*', '*0.100 s  docker.inspect (failed)'])
+    assert 'grafana_tools_operation_failures_total{operation="docker.inspect"} 1' in metrics_file.read()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""Unit tests of systemd_lib.journal_tools against a fake docker executable emitting canned journal records.
+
+"""
+
+import json
+import os
+import stat
+import sys
+
+import pytest
+
+from systemd_lib.journal_tools import JournalReader
+
+
+RECORDS = [{'__CURSOR': 's=1;i=1', 'PRIORITY': '3', '_SYSTEMD_UNIT': 'monit.service',
+            'MESSAGE': "'grafana-server' process is not running"},
+           {'__CURSOR': 's=1;i=2', 'PRIORITY': '3', '_SYSTEMD_UNIT': 'monit.service',
+            'MESSAGE': [39, 110, 103, 105, 110, 120, 39, 32, 102, 97, 105, 108, 101, 100]},
+           {'__CURSOR': 's=1;i=3', 'PRIORITY': '3', '_SYSTEMD_UNIT': 'monit.service',
+            'MESSAGE': "'nginx' process is not running"}]
+
+FAKE_DOCKER = """#!{python}
+import json
+import sys
+
+# docker exec <container> journalctl ...
+args = sys.argv[3:]
+with open({calls!r}, 'a') as calls:
+    calls.write(json.dumps(args) + '\\n')
+records = {records!r}
+if '--after-cursor' in args:
+    cursor = args[args.index('--after-cursor') + 1]
+    records = records[[record['__CURSOR'] for record in records].index(cursor) + 1:]
+if not records:
+    print('-- No entries --')
+for record in records:
+    print(json.dumps(record), flush=True)
+"""
+
+
+@pytest.fixture
+def calls(tmpdir, monkeypatch):
+    calls_file = tmpdir.join('calls')
+    calls_file.write('')
+    script = tmpdir.join('docker')
+    script.write(FAKE_DOCKER.format(python=sys.executable, calls=str(calls_file), records=RECORDS))
+    os.chmod(str(script), os.stat(str(script)).st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', '{}{}{}'.format(tmpdir, os.pathsep, os.environ['PATH']))
+    return lambda: [json.loads(line) for line in calls_file.read().splitlines()]
+
+
+def test_messages_with_server_side_filters(calls):
+    reader = JournalReader('grafana-1', ['monit'], priority='err')
+    messages = list(reader.messages(since='2018-05-15 12:18:54'))
+    assert messages == ["'grafana-server' process is not running", "'nginx' failed", "'nginx' process is not running"]
+    assert calls() == [['journalctl', '-o', 'json', '--no-pager', '-u', 'monit', '-p', 'err', '-b',
+                        '--since', '2018-05-15 12:18:54']]
+
+
+def test_cursor_is_persisted(calls, tmpdir):
+    cursor_file = str(tmpdir.join('monit.cursor'))
+    entries = JournalReader('grafana-1', ['monit'], cursor_file=cursor_file).entries()
+    assert next(entries)['__CURSOR'] == 's=1;i=1'
+    entries.close()
+    assert [record['__CURSOR'] for record in JournalReader('grafana-1', cursor_file=cursor_file).entries()] == \
+        ['s=1;i=2', 's=1;i=3']
+    assert list(JournalReader('grafana-1', cursor_file=cursor_file).entries()) == []
+    assert calls()[-1][-2:] == ['--after-cursor', 's=1;i=3']
+
+
+def test_follow(calls):
+    reader = JournalReader('grafana-1', ['monit'])
+    reader.cursor = 's=1;i=2'
+    assert [record['__CURSOR'] for record in reader.entries(follow=True)] == ['s=1;i=3']
+    assert calls()[0][-4:] == ['--after-cursor', 's=1;i=2', '-f', '--no-tail']
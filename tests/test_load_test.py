@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+"""Unit tests of grafana_lib.load_test against a local stub of the Grafana API.
+
+"""
+
+import collections
+
+import pytest
+
+from grafana_lib.client import GrafanaClient
+from grafana_lib.load_test import parse_mix, run_load
+from grafana_stub import GrafanaStub
+
+
+@pytest.fixture
+def stub():
+    with GrafanaStub() as grafana_stub:
+        grafana_stub.routes[('GET', '/api/admin/stats')] = lambda request: (200, {'dashboards': 2})
+        grafana_stub.routes[('GET', '/api/search')] = lambda request: (200, [{'uid': 'a'}, {'uid': 'b'}])
+        grafana_stub.routes[('GET', '/api/datasources')] = lambda request: (500, {'message': 'database locked'})
+        grafana_stub.routes[('GET', '*')] = lambda request: (200, {'dashboard': {}})
+        yield grafana_stub
+
+
+def test_parse_mix():
+    assert parse_mix('stats=2, search,dashboard=0.5') == {'stats': 2.0, 'search': 1.0, 'dashboard': 0.5}
+    with pytest.raises(ValueError):
+        parse_mix('users=1')
+
+
+def test_rate_and_errors(stub):
+    with GrafanaClient(stub.host, stub.port, 'admin', 'admin', retries=0) as client:
+        report = run_load(client, {'stats': 1, 'datasources': 1, 'dashboard': 2}, rate=200, duration=0.5,
+                          workers=4)
+    assert report['requests'] == 100
+    operations = report['operations']
+    assert sum(operation['requests'] for operation in operations.values()) == 100
+    assert operations['datasources']['error_rate'] == 1.0
+    assert operations['stats']['errors'] == operations['dashboard']['errors'] == 0
+    assert report['errors'] == operations['datasources']['requests']
+    assert 0 < report['latency_ms']['p50'] <= report['latency_ms']['p99'] <= report['latency_ms']['max']
+    assert report['throughput_rps'] == pytest.approx(200, rel=0.25)
+    paths = collections.Counter(request.path for request in stub.requests)
+    assert paths['/api/search'] == 1
+    assert paths['/api/dashboards/uid/a'] + paths['/api/dashboards/uid/b'] == operations['dashboard']['requests']
+
+
+def test_closed_loop_without_dashboards(stub):
+    stub.routes[('GET', '/api/search')] = lambda request: (200, [])
+    with GrafanaClient(stub.host, stub.port, 'admin', 'admin') as client:
+        report = run_load(client, {'stats': 1, 'dashboard': 1}, rate=0, duration=0.2, workers=2)
+        assert list(report['operations']) == ['stats']
+        assert report['requests'] > 0 and report['errors'] == 0
+        with pytest.raises(ValueError):
+            run_load(client, {'dashboard': 1}, rate=0, duration=0.1)
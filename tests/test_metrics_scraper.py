@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+"""Unit tests of grafana_lib.metrics_scraper against canned /metrics answers.
+
+"""
+
+import os
+
+import pytest
+
+from grafana_lib.client import GrafanaClient, GrafanaError
+from grafana_lib.metrics_scraper import Scrape, delta, histogram_quantile, parse_budget, parse_metrics, \
+    parse_sample, scrape, summarize
+from grafana_stub import GrafanaStub
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+HTTP_DURATION = 'grafana_http_request_duration_seconds'
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name)) as fixture:
+        return fixture.read()
+
+
+@pytest.fixture
+def stub():
+    answers = [read_fixture('grafana_metrics_1.prom'), read_fixture('grafana_metrics_2.prom')]
+    with GrafanaStub() as grafana_stub:
+        grafana_stub.routes[('GET', '/metrics')] = lambda request: (200, answers.pop(0))
+        yield grafana_stub
+
+
+def test_parse_sample():
+    sample = parse_sample('grafana_build_info{version="9.5.2",comment="say \\"hi\\", then leave",} 1 1700000000')
+    assert sample.name == 'grafana_build_info'
+    assert sample.labels == {'version': '9.5.2', 'comment': 'say "hi", then leave'}
+    assert (sample.value, sample.timestamp) == (1.0, 1700000000)
+    assert parse_sample('go_goroutines 57').labels == {}
+    assert parse_sample('up{} NaN').value != parse_sample('up{} NaN').value
+    with pytest.raises(ValueError):
+        parse_sample('grafana_build_info{version=9} 1')
+
+
+def test_parse_metrics_filters_families():
+    lines = read_fixture('grafana_metrics_1.prom').encode('utf-8').splitlines()
+    families = parse_metrics(iter(lines), [HTTP_DURATION, 'grafana_alerting_*'])
+    assert sorted(families) == ['grafana_alerting_execution_time_milliseconds',
+                                'grafana_alerting_rule_evaluation_duration_seconds', HTTP_DURATION]
+    http_duration = families[HTTP_DURATION]
+    assert http_duration.type == 'histogram'
+    # 12 buckets, a sum and a count for each of the 2 handlers
+    assert len(http_duration.samples) == 28
+    assert len(parse_metrics(lines)) == 8
+
+
+def test_histogram_quantile():
+    buckets = [(0.1, 50.0), (0.5, 90.0), (1.0, 100.0), (float('inf'), 100.0)]
+    assert histogram_quantile(0.5, buckets) == pytest.approx(0.1)
+    assert histogram_quantile(0.7, buckets) == pytest.approx(0.3)
+    assert histogram_quantile(0.99, buckets) == pytest.approx(0.95)
+    assert histogram_quantile(0.99, [(0.1, 0.0), (float('inf'), 10.0)]) == 0.1
+    assert histogram_quantile(0.99, [(0.1, 0.0), (float('inf'), 0.0)]) is None
+
+
+def test_delta():
+    before = Scrape(parse_metrics(read_fixture('grafana_metrics_1.prom').splitlines()), 100.0)
+    after = Scrape(parse_metrics(read_fixture('grafana_metrics_2.prom').splitlines()), 130.0)
+    window = delta(before, after)
+    assert window.elapsed == 30.0
+    assert window.value('grafana_api_response_status_total') == 292
+    assert window.rate('grafana_api_response_status_total', code='200') == pytest.approx(290 / 30.0)
+    assert window.value('grafana_db_datasource_query_by_id_total') == 90
+    # Gauges and summary quantiles keep their last value
+    assert window.value('go_goroutines') == 61
+    assert window.value('grafana_alerting_execution_time_milliseconds', quantile='0.99') == 150
+    assert window.value('grafana_alerting_execution_time_milliseconds_count') == 20
+    # 200 searches in the window: 196 under 0.25 s, 199 under 0.5 s
+    assert window.value('{}_count'.format(HTTP_DURATION), handler='/api/search/') == 200
+    assert window.quantile(HTTP_DURATION, 0.99, handler='/api/search/') == pytest.approx(0.25 + 0.25 * 2 / 3)
+    # No dashboard request in the window
+    assert window.quantile(HTTP_DURATION, 0.99, handler='/api/dashboards/uid/:uid') is None
+    # Over the 350 requests of both handlers since the start of Grafana: 65 under 10 ms, 200 under 25 ms
+    assert after.quantile(HTTP_DURATION, 0.5) == pytest.approx(0.01 + 0.015 * (175 - 65) / (200 - 65))
+    with pytest.raises(ValueError):
+        after.rate('grafana_api_response_status_total')
+
+
+def test_delta_counter_reset():
+    before = Scrape(parse_metrics(['# TYPE requests_total counter', 'requests_total 500']), 0.0)
+    after = Scrape(parse_metrics(['# TYPE requests_total counter', 'requests_total 20']), 10.0)
+    assert delta(before, after).value('requests_total') == 20
+
+
+def test_scrape(stub):
+    with GrafanaClient(stub.host, stub.port, 'admin', 'admin') as client:
+        before = scrape(client, [HTTP_DURATION])
+        after = scrape(client, [HTTP_DURATION])
+    assert list(after.families) == [HTTP_DURATION]
+    summary = summarize(delta(before, after))
+    search = [entry for entry in summary[HTTP_DURATION] if entry['labels']['handler'] == '/api/search/'][0]
+    assert search['count'] == 200
+    assert search['p99'] == pytest.approx(0.41667, abs=1e-4)
+    assert search['p50'] <= search['p90'] <= search['p99']
+    assert stub.requests[0].headers['Authorization'].startswith('Basic ')
+
+
+def test_scrape_error(stub):
+    stub.routes[('GET', '/metrics')] = lambda request: (401, {'message': 'Unauthorized'})
+    with GrafanaClient(stub.host, stub.port, retries=0) as client:
+        with pytest.raises(GrafanaError) as error:
+            scrape(client)
+    assert error.value.status_code == 401
+
+
+def test_parse_budget():
+    assert parse_budget('{}{{handler="/api/search/"}}:0.99<0.25'.format(HTTP_DURATION)) == \
+        (HTTP_DURATION, {'handler': '/api/search/'}, 0.99, 0.25)
+    assert parse_budget('{}:0.5<0.1'.format(HTTP_DURATION)) == (HTTP_DURATION, {}, 0.5, 0.1)
+    with pytest.raises(ValueError):
+        parse_budget(HTTP_DURATION)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+"""Unit tests of monitor_lib.monitor against simulated containers.
+
+"""
+
+import json
+import pytest
+import threading
+import urllib.error
+import urllib.request
+
+from docker_lib import backends
+from docker_lib.backends import InstrumentedBackend
+from docker_lib.docker_tools import Container
+from docker_lib.simulated_backend import SimulatedBackend
+from metrics_lib import instrumentation
+from monitor_lib.monitor import Monitor, Probe, load_probes, parse_listen, serve
+from systemd_lib.systemd_tools import Systemd
+
+CONFIG = {'interval': 10, 'jitter': 0.1,
+          'containers': [{'name': 'grafana-1', 'services': ['grafana-server.service', 'nginx.service']},
+                         {'name': 'grafana-2', 'services': ['nginx.service'], 'interval': 20}]}
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    simulated_backend = SimulatedBackend(['grafana-1', 'grafana-2'])
+    monkeypatch.setattr(backends, '_backend', InstrumentedBackend(simulated_backend))
+    monkeypatch.setattr(instrumentation, '_registry', instrumentation.Registry())
+    monkeypatch.setattr(Container, '_cache', {})
+    return simulated_backend
+
+
+def calls(operation: str) -> int:
+    stats = instrumentation.get_registry().operations.get(operation)
+    return stats.count if stats else 0
+
+
+def test_load_probes():
+    probes = load_probes(CONFIG)
+    assert [(probe.key, probe.interval) for probe in probes] == [
+        ('container:grafana-1', 10), ('services:grafana-1', 10), ('container:grafana-2', 20),
+        ('services:grafana-2', 20)]
+    assert probes[1].systemd_services == ['grafana-server.service', 'nginx.service']
+    assert parse_listen('0.0.0.0:9200') == ('0.0.0.0', 9200)
+    assert parse_listen(':9200') == ('127.0.0.1', 9200)
+    assert load_probes(dict(CONFIG, timeout=5))[3].timeout == 5
+    with pytest.raises(ValueError):
+        load_probes({'containers': []})
+
+
+def test_probes_are_coalesced(backend):
+    monitor = Monitor(load_probes(CONFIG), jitter=0.1, coalesce_window=2, workers=1, seed=1)
+    assert len(monitor.step()) == 4
+    # One docker inspect for both containers, one docker exec per container for all its services
+    assert calls('docker.inspect') == 1
+    assert calls('docker.exec.busctl') == 2
+    state = monitor.snapshot()
+    assert state['container:grafana-2']['status'] == 'running'
+    assert state['service:grafana-1/grafana-server.service']['running'] is True
+    assert monitor.healthy()
+
+
+def test_probes_are_jittered(backend):
+    monitor = Monitor([Probe('container', 'grafana-1', 10)], jitter=0.1, coalesce_window=0, seed=3)
+    dates = []
+    for _ in range(20):
+        monitor.step()
+        dates.append(backend.monotonic())
+    intervals = [after - before for before, after in zip(dates, dates[1:])]
+    assert all(9 <= interval <= 11 for interval in intervals)
+    # Probes started together drift apart instead of running in lockstep
+    assert len(set(round(interval, 6) for interval in intervals)) > 1
+
+
+def test_state_changes(backend):
+    monitor = Monitor(load_probes(CONFIG), coalesce_window=2, workers=1, seed=1)
+    monitor.step()
+    changed_at = monitor.snapshot()['service:grafana-2/nginx.service']['changed_at']
+    backend.exec('grafana-2', 'systemctl', 'stop', 'monit.service')
+    backend.exec('grafana-2', 'systemctl', 'stop', 'nginx.service')
+    monitor.run(batches=3)
+    state = monitor.snapshot()
+    assert state['service:grafana-2/nginx.service']['running'] is False
+    assert state['service:grafana-2/nginx.service']['changed_at'] > changed_at
+    assert state['service:grafana-1/nginx.service']['running'] is True
+    assert not monitor.healthy()
+
+
+def test_missing_container(backend):
+    monitor = Monitor([Probe('container', 'grafana-1', 10), Probe('container', 'missing', 10)], coalesce_window=2)
+    monitor.step()
+    state = monitor.snapshot()
+    assert state['container:grafana-1']['healthy'] is True
+    assert state['container:missing']['healthy'] is False
+    assert 'No such container' in state['container:missing']['error']
+
+
+def test_unexpected_errors(backend, monkeypatch):
+    inspect = backend.inspect
+    # Answer of docker inspect without State for grafana-2, exec failing with an unexpected error in grafana-1
+    monkeypatch.setattr(backend, 'inspect', lambda name: {'Name': '/grafana-2'} if name == 'grafana-2' else
+                        inspect(name))
+    are_services_running = Systemd.are_services_running
+
+    def failing_services(container_name, systemd_services, session=None):
+        if container_name == 'grafana-1':
+            raise RuntimeError('unexpected answer')
+        return are_services_running(container_name, systemd_services, session)
+
+    monkeypatch.setattr(Systemd, 'are_services_running', failing_services)
+    monitor = Monitor(load_probes(CONFIG), coalesce_window=2, workers=2, seed=1)
+    monitor.run(batches=2)
+    state = monitor.snapshot()
+    assert state['container:grafana-1']['healthy'] is True
+    assert state['container:grafana-2']['healthy'] is False
+    assert state['container:grafana-2']['error'] == "'State'"
+    assert state['service:grafana-1/nginx.service']['error'] == 'unexpected answer'
+    assert state['service:grafana-2/nginx.service']['healthy'] is True
+    assert not monitor.healthy()
+
+
+def test_hung_check(backend, monkeypatch):
+    answer = threading.Event()
+    are_services_running = Systemd.are_services_running
+
+    def hung_services(container_name, systemd_services, session=None):
+        if container_name == 'grafana-1':
+            answer.wait()
+        return are_services_running(container_name, systemd_services, session)
+
+    monkeypatch.setattr(Systemd, 'are_services_running', hung_services)
+    config = dict(CONFIG, timeout=0.2, containers=[dict(container, interval=10) for container in CONFIG['containers']])
+    monitor = Monitor(load_probes(config), coalesce_window=2, workers=2, seed=1)
+    try:
+        monitor.step()
+        state = monitor.snapshot()
+        assert state['service:grafana-1/nginx.service']['error'] == 'No answer within 0.2s'
+        assert state['service:grafana-2/nginx.service']['healthy'] is True
+        assert state['container:grafana-1']['healthy'] is True
+        # The hung check is not started again
+        monitor.step()
+        assert monitor.snapshot()['service:grafana-1/nginx.service']['error'] == 'Previous check still running'
+        answer.set()
+        monitor._pending['services:grafana-1'].result()
+        monitor.step()
+        assert monitor.healthy()
+    finally:
+        answer.set()
+        monitor.close()
+
+
+def test_http_endpoint(backend):
+    monitor = Monitor(load_probes(CONFIG), coalesce_window=2, workers=1, seed=1)
+    monitor.step()
+    server = serve(monitor, '127.0.0.1', 0)
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    try:
+        with urllib.request.urlopen(url + '/state') as response:
+            assert json.loads(response.read().decode('utf-8')) == monitor.snapshot()
+        with urllib.request.urlopen(url + '/health') as response:
+            assert json.loads(response.read().decode('utf-8')) == {'healthy': True}
+        with urllib.request.urlopen(url + '/metrics') as response:
+            assert 'operation="docker.inspect"' in response.read().decode('utf-8')
+
+        backend.stop('grafana-1')
+        monitor.run(batches=2)
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(url + '/health')
+        assert error.value.code == 503
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""Unit tests of grafana_lib.query_profiler against a local stub serving a canned dashboard.
+
+"""
+
+import json
+import os
+import time
+
+import pytest
+
+from grafana_lib import dashboard_sync
+from grafana_lib.client import GrafanaClient
+from grafana_lib.query_profiler import DatasourceResolver, folder_dashboards, panel_queries, profile_dashboards, \
+    resolve_time, server_timing
+from grafana_stub import GrafanaStub
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+NOW_MS = 1526305170000
+HOUR_MS = 3600000
+DATASOURCES = [{'name': 'Prometheus', 'uid': 'prom', 'type': 'prometheus', 'isDefault': True},
+               {'name': 'PostgreSQL', 'uid': 'pg', 'type': 'postgres', 'isDefault': False}]
+
+
+def load_dashboard() -> dict:
+    with open(os.path.join(FIXTURES, 'dashboard_services.json')) as fixture:
+        return json.load(fixture)
+
+
+def query_answer(request):
+    """
+    Queries of the PostgreSQL datasource are slow and return many rows, those of Prometheus fail for 'up'
+    """
+    results = {}
+    slow = False
+    for query in request.body['queries']:
+        rows = 2
+        if query['datasource']['uid'] == 'pg':
+            slow = True
+            rows = 500
+        result = {'frames': [{'schema': {'fields': [{'name': 'time'}, {'name': 'value'}]},
+                              'data': {'values': [list(range(rows)), [1.5] * rows]}}]}
+        if query.get('expr') == 'up':
+            result['error'] = 'bad_data: parse error'
+        results[query['refId']] = result
+    if slow:
+        time.sleep(0.05)
+    return 200, {'results': results}, {'Server-Timing': 'total;dur={}'.format(50 if slow else 2)}
+
+
+@pytest.fixture
+def stub():
+    with GrafanaStub() as grafana_stub:
+        grafana_stub.routes[('GET', '/api/dashboards/uid/services')] = lambda request: (
+            200, {'dashboard': load_dashboard(), 'meta': {'folderId': 7}})
+        grafana_stub.routes[('GET', '/api/datasources')] = lambda request: (200, DATASOURCES)
+        grafana_stub.routes[('GET', '/api/folders/ops')] = lambda request: (200, {'id': 7, 'uid': 'ops'})
+        grafana_stub.routes[('GET', '/api/search')] = lambda request: (
+            200, [{'uid': 'services'}] if request.query.get('folderIds') == ['7'] else [])
+        grafana_stub.routes[('POST', '/api/ds/query')] = query_answer
+        yield grafana_stub
+
+
+def test_resolve_time():
+    assert resolve_time('now', NOW_MS) == NOW_MS
+    assert resolve_time('now-1d-6h', NOW_MS) == NOW_MS - 30 * HOUR_MS
+    assert resolve_time('now/d', NOW_MS) == NOW_MS
+    assert resolve_time('1526305170000', NOW_MS) == NOW_MS
+    assert resolve_time('2018-05-14T13:39:30Z', 0) == NOW_MS
+    with pytest.raises(ValueError):
+        resolve_time('now-6x', NOW_MS)
+
+
+def test_server_timing():
+    assert server_timing('total;dur=123.4, db;dur=53') == pytest.approx(0.1234)
+    assert server_timing('db;dur=50, render;desc="Render";dur=25') == pytest.approx(0.075)
+    assert server_timing('cache;desc="miss"') is None
+    assert server_timing(None) is None
+
+
+def test_panel_queries(stub):
+    with GrafanaClient(stub.host, stub.port, 'admin', 'admin') as client:
+        queries = panel_queries(load_dashboard(), DatasourceResolver(client), NOW_MS)
+    # The text panel and the row have no query, the panel of the collapsed row has one
+    assert [(query.panel_id, query.datasources) for query in queries] == [(1, ['prom']), (4, ['pg']),
+                                                                          (5, ['prom'])]
+    requests, slow, mixed = [query.body for query in queries]
+    assert requests['queries'][0]['expr'] == 'rate(http_requests_total{instance="grafana-1"}[$__rate_interval])'
+    assert (requests['from'], requests['to']) == (str(NOW_MS - HOUR_MS), str(NOW_MS))
+    assert requests['queries'][0]['intervalMs'] == HOUR_MS // 1000
+    assert slow['queries'][0]['rawSql'].endswith("instance = 'grafana-1'")
+    assert slow['from'] == str(NOW_MS - 24 * HOUR_MS)
+    assert slow['queries'][0]['maxDataPoints'] == 100
+    # Hidden target skipped, target without datasource sent to the default one, range shifted by one day
+    assert [query['refId'] for query in mixed['queries']] == ['A', 'B']
+    assert mixed['queries'][1]['datasource'] == {'uid': 'prom', 'type': 'prometheus'}
+    assert mixed['to'] == str(NOW_MS - 24 * HOUR_MS)
+    # Datasources are read once
+    assert len([request for request in stub.requests if request.path == '/api/datasources']) == 1
+
+
+def test_profile_ranks_panels(stub):
+    with GrafanaClient(stub.host, stub.port, 'admin', 'admin') as client:
+        report = profile_dashboards(client, folder_dashboards(client, 'ops'), repetitions=3, warmup=1, workers=3)
+    assert [entry['title'] for entry in report][0] == 'Slow queries'
+    slow = report[0]
+    assert slow['client']['requests'] == 3
+    assert slow['client']['latency_ms']['p50'] >= 50
+    assert slow['server_latency_ms']['p50'] == pytest.approx(50, rel=0.01)
+    assert slow['rows'] == 500
+    assert slow['bytes'] > max(entry['bytes'] for entry in report[1:])
+    mixed = [entry for entry in report if entry['title'] == 'Mixed'][0]
+    assert mixed['client']['errors'] == 3
+    assert mixed['errors'] == ['A: bad_data: parse error']
+    # 3 panels, 1 warm-up and 3 measured queries each
+    assert len([request for request in stub.requests if request.path == '/api/ds/query']) == 12
+
+
+def test_invalid_answer_is_a_panel_error(stub):
+    stub.routes[('POST', '/api/ds/query')] = lambda request: (200, '<html>Proxy error</html>')
+    with GrafanaClient(stub.host, stub.port, 'admin', 'admin') as client:
+        report = profile_dashboards(client, ['services'], repetitions=2, warmup=0)
+    assert all(entry['client']['errors'] == 2 for entry in report)
+    assert all(entry['errors'][0].startswith('Invalid answer: ') for entry in report)
+
+
+def test_folder_dashboards_are_paged(stub, monkeypatch):
+    monkeypatch.setattr(dashboard_sync, 'SEARCH_LIMIT', 2)
+    uids = ['services', 'nodes', 'databases']
+    stub.routes[('GET', '/api/search')] = lambda request: (
+        200, [{'uid': uid} for uid in uids][(int(request.query['page'][0]) - 1) * 2:][:2])
+    with GrafanaClient(stub.host, stub.port, 'admin', 'admin') as client:
+        assert folder_dashboards(client, 'ops') == uids
+    assert [request.query['folderIds'] for request in stub.requests if request.path == '/api/search'] == [['7']] * 2
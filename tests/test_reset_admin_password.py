@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""Unit tests of the fleet mode of grafana_lib.reset_admin_password against local stubs of the Grafana API.
+
+"""
+
+import json
+import time
+
+import pytest
+
+from grafana_lib.reset_admin_password import load_inventory, resolve_credential, rotate_fleet
+from grafana_stub import GrafanaStub
+
+
+def change_password(request):
+    if request.body['oldPassword'] != 'admin':
+        return 401, {'message': 'Invalid old password'}
+    return 200, {'message': 'User password changed'}
+
+
+@pytest.fixture
+def stubs():
+    with GrafanaStub() as first, GrafanaStub() as second:
+        for stub in (first, second):
+            stub.routes[('PUT', '/api/user/password')] = change_password
+        yield first, second
+
+
+def test_resolve_credential(tmpdir, monkeypatch):
+    monkeypatch.setenv('GRAFANA_PASSWORD', 'from-env')
+    secret = tmpdir.join('secret')
+    secret.write('from-file\n')
+    assert resolve_credential('env:GRAFANA_PASSWORD') == 'from-env'
+    assert resolve_credential('file:{}'.format(secret)) == 'from-file'
+    assert resolve_credential('plain') == 'plain'
+    with pytest.raises(ValueError):
+        resolve_credential('env:UNDEFINED_GRAFANA_PASSWORD')
+
+
+def test_load_inventory(tmpdir):
+    csv_file = tmpdir.join('inventory.csv')
+    csv_file.write('host,port,password,newpassword\ngrafana-1,9090,env:OLD,env:NEW\n')
+    assert load_inventory(str(csv_file)) == [{'host': 'grafana-1', 'port': '9090', 'password': 'env:OLD',
+                                              'newpassword': 'env:NEW'}]
+    json_file = tmpdir.join('inventory.json')
+    json_file.write(json.dumps([{'host': 'grafana-1', 'password': 'env:OLD'}]))
+    with pytest.raises(ValueError):
+        load_inventory(str(json_file))
+
+
+def test_rotate_fleet(stubs, monkeypatch):
+    monkeypatch.setenv('NEW_PASSWORD', 'secret')
+    first, second = stubs
+    instances = [{'host': first.host, 'port': first.port, 'password': 'admin', 'newpassword': 'env:NEW_PASSWORD'},
+                 {'host': second.host, 'port': second.port, 'password': 'wrong', 'newpassword': 'secret'},
+                 {'host': '127.0.0.1', 'port': 1, 'password': 'admin', 'newpassword': 'secret'},
+                 {'host': first.host, 'port': first.port, 'password': 'admin', 'newpassword': 'env:UNDEFINED_PWD'}]
+    results = rotate_fleet(instances, workers=4, timeout=1)
+    assert [result['status'] for result in results] == ['updated', 'failed', 'unreachable', 'invalid']
+    assert results[1]['error'] == 'Invalid old password'
+    assert all(result['latency_ms'] >= 0 for result in results)
+    assert first.requests[0].body['newPassword'] == 'secret'
+
+
+def test_password_change_is_not_retried(stubs):
+    first, _ = stubs
+
+    def slow_change_password(request):
+        # Applied, but answered after the read timeout
+        time.sleep(1.5)
+        return change_password(request)
+
+    first.routes[('PUT', '/api/user/password')] = slow_change_password
+    results = rotate_fleet([{'host': first.host, 'port': first.port, 'password': 'admin', 'newpassword': 'secret'}],
+                           workers=1, timeout=1)
+    assert results[0]['status'] == 'unreachable'
+    assert len(first.requests) == 1
+
+
+def test_invalid_rows_do_not_stop_the_fleet(stubs):
+    first, second = stubs
+    second.routes[('PUT', '/api/user/password')] = lambda request: (200, 'not json')
+    instances = [{'host': first.host, 'port': 'http', 'password': 'admin', 'newpassword': 'secret'},
+                 {'host': second.host, 'port': second.port, 'password': 'admin', 'newpassword': 'secret'},
+                 {'host': first.host, 'port': first.port, 'password': 'admin', 'newpassword': 'secret'}]
+    results = rotate_fleet(instances, workers=2, timeout=1)
+    assert [result['status'] for result in results] == ['invalid', 'unknown', 'updated']
+    assert results[0]['port'] == 'http'
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+"""Unit tests of systemd_lib.restart_benchmark against the simulated container.
+
+"""
+
+import pytest
+
+from docker_lib import backends
+from docker_lib.simulated_backend import SimulatedBackend
+from systemd_lib.restart_benchmark import compare, percentile, run_benchmark
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    simulated_backend = SimulatedBackend(['grafana-1'])
+    monkeypatch.setattr(backends, '_backend', simulated_backend)
+    return simulated_backend
+
+
+def test_percentile():
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 50) == pytest.approx(50.5)
+    assert percentile(values, 99) == pytest.approx(99.01)
+    assert percentile([3.0], 95) == 3.0
+
+
+def test_run_benchmark(backend):
+    report = run_benchmark('grafana-1', ['nginx.service', 'monit.service'], ['kill'], 5, 75)
+    nginx = report['nginx.service']['kill']
+    assert (nginx['count'], nginx['failures']) == (5, 0)
+    assert nginx['p50_ms'] <= nginx['p95_ms'] <= nginx['p99_ms'] <= nginx['max_ms'] <= \
+        (SimulatedBackend.MONIT_CYCLE + 0.5) * 1000
+    # monit is restarted by systemd, not by itself
+    assert report['monit.service']['kill']['max_ms'] == pytest.approx((SimulatedBackend.RESTART_SEC + 0.2) * 1000)
+
+
+def test_run_benchmark_failures(backend):
+    backends.get_backend().exec('grafana-1', 'systemctl', 'stop', 'monit.service')
+    report = run_benchmark('grafana-1', ['nginx.service'], ['stop'], 2, 10)
+    assert report['nginx.service']['stop'] == {'count': 0, 'failures': 2}
+
+
+def test_compare():
+    baseline = {'nginx.service': {'kill': {'p50_ms': 100.0, 'p95_ms': 200.0, 'p99_ms': 250.0, 'max_ms': 300.0}}}
+    report = {'nginx.service': {'kill': {'p50_ms': 110.0, 'p95_ms': 300.0, 'p99_ms': 250.0, 'max_ms': 300.0}},
+              'grafana-server.service': {'kill': {'p50_ms': 1.0}}}
+    comparison = compare(report, baseline, tolerance=0.2)
+    assert [(entry['metric'], entry['regression']) for entry in comparison] == \
+        [('p50_ms', False), ('p95_ms', True), ('p99_ms', False), ('max_ms', False)]
+    assert comparison[1]['ratio'] == 1.5
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""Unit tests of docker_lib.simulated_backend, through Container, Systemd and JournalReader.
+
+"""
+
+import pytest
+
+from docker_lib import backends
+from docker_lib.backends import DockerError
+from docker_lib.docker_tools import Container
+from docker_lib.simulated_backend import SimulatedBackend
+from systemd_lib.journal_tools import JournalReader
+from systemd_lib.systemd_tools import Systemd
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    simulated_backend = SimulatedBackend(['grafana-1'])
+    monkeypatch.setattr(backends, '_backend', simulated_backend)
+    monkeypatch.setattr(Container, '_cache', {})
+    return simulated_backend
+
+
+def test_services_running(backend):
+    assert Container.status('grafana-1') == 'running'
+    assert Systemd.are_services_running('grafana-1', ['grafana-server.service', 'nginx.service', 'monit.service',
+                                                      'unknown.service']) == \
+        {'grafana-server.service': True, 'nginx.service': True, 'monit.service': True, 'unknown.service': False}
+
+
+@pytest.mark.parametrize('use_events', [True, False])
+def test_monit_restarts_stopped_service(backend, monkeypatch, use_events):
+    monkeypatch.setattr(Systemd, 'use_events', use_events)
+    _, previous_timestamp = Systemd.get_active_enter_timestamp('grafana-1', 'grafana-server.service')
+    stopped_at = backend.time()
+    Systemd.systemctl('grafana-1', 'stop', 'grafana-server.service')
+    assert Systemd.is_service_running('grafana-1', 'grafana-server.service') is False
+    latency = Systemd.wait_until_service_is_restarted('grafana-1', 'grafana-server.service', 75,
+                                                      previous_timestamp=previous_timestamp, since=stopped_at)
+    # Next monit cycle, then the start delay of grafana-server
+    assert 2.0 <= latency <= SimulatedBackend.MONIT_CYCLE + 2.0
+    errors = list(JournalReader('grafana-1', ['monit'], priority='err').messages())
+    assert errors == ["'grafana-server' process is not running"]
+
+
+def test_systemd_restarts_killed_monit(backend):
+    _, previous_timestamp = Systemd.get_active_enter_timestamp('grafana-1', 'monit.service')
+    Systemd.systemctl('grafana-1', 'kill', 'monit.service')
+    latency = Systemd.wait_until_service_is_restarted('grafana-1', 'monit.service', 10,
+                                                      previous_timestamp=previous_timestamp)
+    assert latency == pytest.approx(SimulatedBackend.RESTART_SEC + 0.2)
+    # The monitor is killed once the restart is seen
+    assert backend.containers['grafana-1'].monitors == []
+
+
+def test_restart_timeout(backend):
+    Systemd.systemctl('grafana-1', 'stop', 'monit.service')
+    Systemd.systemctl('grafana-1', 'stop', 'nginx.service')
+    begin = backend.time()
+    with pytest.raises(TimeoutError):
+        Systemd.wait_until_service_is_restarted('grafana-1', 'nginx.service', 75)
+    assert backend.time() - begin == pytest.approx(75, abs=1)
+
+
+def test_active_service_is_not_restarted(backend):
+    # Without previous_timestamp, the activation current at the start of the wait is not a restart
+    with pytest.raises(TimeoutError):
+        Systemd.wait_until_service_is_restarted('grafana-1', 'nginx.service', 5)
+
+
+def test_container_restart(backend):
+    Systemd.systemctl('grafana-1', 'stop', 'nginx.service')
+    backend.sleep(SimulatedBackend.MONIT_CYCLE)
+    timestamp, started_at = Container.started_at('grafana-1')
+    _, previous_timestamp = Systemd.get_active_enter_timestamp('grafana-1', 'grafana-server.service')
+    Container.restart('grafana-1', 10)
+    assert Container.started_at('grafana-1')[1] > started_at
+    Systemd.wait_until_service_is_restarted('grafana-1', 'grafana-server.service', 75,
+                                            previous_timestamp=previous_timestamp)
+    # The error logged by monit before the restart belongs to the previous boot
+    assert list(JournalReader('grafana-1', ['monit'], priority='err').messages(since=timestamp)) == []
+
+
+def test_stopped_container(backend):
+    Container.stop('grafana-1', 10)
+    assert Container.status('grafana-1') == 'exited'
+    with pytest.raises(DockerError):
+        Systemd.is_service_running('grafana-1', 'grafana-server.service')
+    with pytest.raises(DockerError):
+        Container.status('grafana-2')
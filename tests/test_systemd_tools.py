@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+"""Unit tests of systemd_lib.systemd_tools. Commands sent to the container run locally against a fake busctl.
+
+"""
+
+import os
+import stat
+import subprocess
+import sys
+import time
+
+from typing import Iterator
+
+import pytest
+
+from docker_lib import backends
+from docker_lib.backends import Backend, DockerError
+from systemd_lib.systemd_tools import PropertiesChangedParser, Systemd, parse_busctl_value
+
+
+FAKE_BUSCTL = """#!{python}
+import os
+import sys
+import time
+
+if sys.argv[1] == 'monitor':
+    with open(os.environ['FAKE_BUSCTL_MONITOR_PID'], 'w') as pid_file:
+        pid_file.write(str(os.getpid()))
+    # grafana-server is restarted 0.2 second after the subscription
+    time.sleep(0.2)
+    print(MESSAGE, flush=True)
+    time.sleep(30)
+    sys.exit(0)
+
+units = {{
+    '/org/freedesktop/systemd1/unit/grafana_2dserver_2eservice': {{'ActiveState': 's "active"',
+                                                                  'ActiveEnterTimestamp': 't 1526305170850190'}},
+    '/org/freedesktop/systemd1/unit/nginx_2eservice': {{'ActiveState': 's "failed"',
+                                                       'ActiveEnterTimestamp': 't 1526305170000000'}},
+}}
+if sys.argv[3] not in units:
+    sys.stderr.write('Unknown object\\n')
+    sys.exit(1)
+for busctl_property in sys.argv[5:]:
+    print(units[sys.argv[3]][busctl_property])
+"""
+
+MONITOR_MESSAGE = """\
+\u2023 Type=signal  Endian=l  Flags=1  Version=1  Priority=0 Cookie=2171
+  Sender=:1.0  Path=/org/freedesktop/systemd1/unit/grafana_2dserver_2eservice  Interface=org.freedesktop.DBus.Properties
+  MESSAGE "sa{sv}as" {
+          STRING "org.freedesktop.systemd1.Unit";
+          ARRAY "{sv}" {
+                  DICT_ENTRY "sv" {
+                          STRING "ActiveState";
+                          VARIANT "s" {
+                                  STRING "active";
+                          };
+                  };
+                  DICT_ENTRY "sv" {
+                          STRING "Names";
+                          VARIANT "as" {
+                                  ARRAY "s" {
+                                          STRING "grafana-server.service";
+                                  };
+                          };
+                  };
+                  DICT_ENTRY "sv" {
+                          STRING "ActiveEnterTimestamp";
+                          VARIANT "t" {
+                                  UINT64 1526305180250000;
+                          };
+                  };
+          };
+          ARRAY "s" {
+          };
+  };
+"""
+
+
+class LocalBackend(Backend):
+    """
+    Runs the commands sent to the container on the local host
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def exec(self, container_name: str, *args: str) -> bytes:
+        self.calls.append(args)
+        process = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if process.returncode:
+            raise DockerError(' '.join(args), process.returncode, process.stdout, process.stderr)
+        return process.stdout
+
+    def exec_stream(self, container_name: str, *args: str) -> Iterator[str]:
+        self.calls.append(args)
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, universal_newlines=True)
+        try:
+            for line in process.stdout:
+                yield line
+        finally:
+            # Like the docker client, leaves the children of the command running
+            process.kill()
+            process.wait()
+            process.stdout.close()
+
+
+def is_running(pid: int, timeout: float = 2) -> bool:
+    """
+    :return: whether process *pid* is still running (not a zombie) after *timeout* seconds
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with open('/proc/{}/stat'.format(pid)) as stat_file:
+                if stat_file.read().rsplit(')', 1)[1].split()[0] == 'Z':
+                    return False
+        except FileNotFoundError:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+@pytest.fixture
+def backend(tmpdir, monkeypatch):
+    script = tmpdir.join('busctl')
+    script.write(FAKE_BUSCTL.format(python=sys.executable).replace('MESSAGE', repr(MONITOR_MESSAGE)))
+    os.chmod(str(script), os.stat(str(script)).st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', '{}{}{}'.format(tmpdir, os.pathsep, os.environ['PATH']))
+    monkeypatch.setenv('FAKE_BUSCTL_MONITOR_PID', str(tmpdir.join('monitor.pid')))
+    local_backend = LocalBackend()
+    local_backend.monitor_pid = lambda: int(tmpdir.join('monitor.pid').read())
+    monkeypatch.setattr(backends, '_backend', local_backend)
+    return local_backend
+
+
+def test_snapshot_single_exec(backend):
+    services = ['grafana-server.service', 'nginx.service', 'unknown.service']
+    snapshots = Systemd.get_unit_snapshot('grafana-1', services, ['ActiveState', 'ActiveEnterTimestamp'])
+    assert len(backend.calls) == 1
+    assert snapshots['grafana-server.service'].properties == {'ActiveState': 'active',
+                                                              'ActiveEnterTimestamp': 1526305170850190}
+    assert snapshots['nginx.service'].active_state == 'failed'
+    assert snapshots['unknown.service'].properties == {}
+
+
+def test_are_services_running(backend):
+    running = Systemd.are_services_running('grafana-1', ['grafana-server.service', 'nginx.service'])
+    assert running == {'grafana-server.service': True, 'nginx.service': False}
+    assert len(backend.calls) == 1
+
+
+def test_get_active_enter_timestamp(backend):
+    assert Systemd.get_active_enter_timestamp('grafana-1', 'grafana-server.service') == ('2018-05-14 13:39:30',
+                                                                                         1526305170.85019)
+    with pytest.raises(ValueError):
+        Systemd.get_active_enter_timestamp('grafana-1', 'unknown.service')
+
+
+@pytest.mark.parametrize('value, expected', [('s "active"', 'active'), ('t 42', 42), ('b false', False),
+                                             ('as 2 "a" "b"', '2 "a" "b"')])
+def test_parse_busctl_value(value: str, expected) -> None:
+    assert parse_busctl_value(value) == expected
+
+
+def test_parse_properties_changed():
+    parser = PropertiesChangedParser()
+    messages = [parser.feed(line) for line in MONITOR_MESSAGE.splitlines(True)]
+    assert [message for message in messages if message] == [{'ActiveState': 'active',
+                                                              'ActiveEnterTimestamp': 1526305180250000}]
+
+
+def test_wait_for_restart_signal(backend, monkeypatch):
+    monkeypatch.setattr(Systemd, 'MONITOR_ATTACH_DELAY', 0.05)
+    begin = time.monotonic()
+    latency = Systemd.wait_until_service_is_restarted('grafana-1', 'grafana-server.service', 10,
+                                                      previous_timestamp=1526305170.85019, since=1526305180.0)
+    assert time.monotonic() - begin < 2
+    assert latency == pytest.approx(0.25)
+    # The monitor does not outlive the wait
+    assert backend.calls[-1] == ('kill', backend.calls[-1][1])
+    assert not is_running(backend.monitor_pid())
+
+
+def test_wait_for_restart_already_restarted(backend, monkeypatch):
+    monkeypatch.setattr(Systemd, 'MONITOR_ATTACH_DELAY', 0.05)
+    begin = time.monotonic()
+    Systemd.wait_until_service_is_restarted('grafana-1', 'grafana-server.service', 10,
+                                            previous_timestamp=1526305170.0)
+    assert time.monotonic() - begin < 0.2
+
+
+def test_wait_for_restart_polling_timeout(backend, monkeypatch):
+    monkeypatch.setattr(Systemd, 'use_events', False)
+    monkeypatch.setattr(Systemd, 'POLL_INTERVAL', 0.05)
+    with pytest.raises(TimeoutError):
+        Systemd.wait_until_service_is_restarted('grafana-1', 'grafana-server.service', 0.2,
+                                                previous_timestamp=1526305170.85019)